@@ -67,6 +67,9 @@ setup(
         'webpack': [
              'calmjs.webpack',
         ],
+        'orjson': [
+             'orjson',
+        ],
     },
     extras_calmjs={
         'node_modules': {
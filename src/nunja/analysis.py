@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Static analysis of the references between templates.
+
+The include, import, from and extends tags within templates are used to
+build a graph of references between templates, such that the templates
+that can be reached from the default templates of the molds can be
+determined.  References that are not string literals (e.g. the template
+being passed in as a value like the case for the ``include_by_value``
+mold) cannot be resolved, and so templates containing them are flagged
+as dynamic.
+"""
+
+import codecs
+from logging import getLogger
+
+from jinja2 import Environment
+from jinja2.exceptions import TemplateSyntaxError
+from jinja2.meta import find_referenced_templates
+
+from nunja.registry import DEFAULT_WRAPPER_NAME
+from nunja.registry import REQ_TMPL_NAME
+
+logger = getLogger(__name__)
+
+# the name of the wrapper template, which includes the default template
+# of the mold being executed through the _template_ variable.
+WRAPPER_TEMPLATE_NAME = DEFAULT_WRAPPER_NAME + '/' + REQ_TMPL_NAME
+
+# the extensions that provide the tags used by the templates; these are
+# referenced by name as nunja.cache depends on this module.
+extensions = ['nunja.cache.CacheExtension']
+
+
+def name_to_mold_id(name):
+    """
+    Return the mold_id for the template name.
+    """
+
+    return '/'.join(name.split('/')[:2])
+
+
+def find_template_references(source, env=None):
+    """
+    Return a 2-tuple of the set of names of templates referenced by the
+    source, and whether any of the references are dynamic.
+    """
+
+    env = env or Environment(extensions=extensions)
+    names = set()
+    dynamic = False
+    for name in find_referenced_templates(env.parse(source)):
+        if name is None:
+            dynamic = True
+        else:
+            names.add(name)
+    return names, dynamic
+
+
+def build_reference_graph(templates):
+    """
+    Build the reference graph for templates, which is a mapping of the
+    template names to their paths.
+
+    Returns a dict with the template names as the keys, and with the
+    2-tuple as returned by find_template_references as the values.  The
+    templates that cannot be analysed will be treated as dynamic.  The
+    dynamic reference in the wrapper template is not treated as such,
+    as it is only ever to the default template of a mold.
+    """
+
+    env = Environment(extensions=extensions)
+    graph = {}
+    for name, path in templates.items():
+        try:
+            with codecs.open(path, encoding='utf8') as fd:
+                graph[name] = find_template_references(fd.read(), env)
+            if name == WRAPPER_TEMPLATE_NAME:
+                # the default templates of the molds are the roots.
+                graph[name] = (graph[name][0], False)
+        except (IOError, OSError, TemplateSyntaxError) as e:
+            logger.warning(
+                "failed to analyse template '%s' for references; treating "
+                "its references as dynamic: %s", name, e,
+            )
+            graph[name] = (set(), True)
+    return graph
+
+
+def find_reachable(graph, roots=None):
+    """
+    Return the set of template names in the graph that are reachable
+    from roots, which defaults to the default template of every mold.
+
+    As the targets of dynamic references cannot be determined, they may
+    be to any template, so every template in the graph will be treated
+    as reachable once a template with dynamic references is reached.
+    """
+
+    if roots is None:
+        roots = [
+            name for name in graph
+            if name.split('/', 2)[-1] == REQ_TMPL_NAME
+        ]
+
+    reachable = set()
+    pending = list(roots)
+    while pending:
+        name = pending.pop()
+        if name in reachable or name not in graph:
+            continue
+        reachable.add(name)
+        names, dynamic = graph[name]
+        pending.extend(names)
+        if dynamic:
+            logger.warning(
+                "template '%s' has dynamic references; treating all "
+                "templates as reachable", name,
+            )
+            return set(graph)
+    return reachable
+
+
+def find_shared(graph, threshold=2):
+    """
+    Return the set of template names in the graph that are referenced by
+    the templates from at least the threshold number of distinct molds.
+    """
+
+    referrers = {}
+    for name, (names, dynamic) in graph.items():
+        for target in names:
+            referrers.setdefault(target, set()).add(name_to_mold_id(name))
+    return {
+        name for name, molds in referrers.items()
+        if name in graph and len(molds) >= threshold
+    }
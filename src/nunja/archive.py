@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Packing of the templates into a single archive file.
+
+Rather than reading every template from wherever the registry resolved
+them to, the templates provided by a registry may be packed into a
+single archive, which the ArchiveLoader will map into memory such that
+loading the templates require no further system calls.
+
+The archive starts with the magic bytes, followed by the length of the
+index as an unsigned 32-bit big-endian integer, the index encoded as
+JSON, then the UTF-8 encoded source of every template.  The index is a
+mapping of the template names to the offset of their source from the
+end of the index and the length of the source.
+
+The archive may be produced from the registries as a script, e.g.::
+
+    $ python -m nunja.archive templates.nja-archive nunja.mold nunja.tmpl
+"""
+
+import codecs
+import json
+import mmap
+import struct
+import sys
+from logging import getLogger
+from os import fdopen
+from os import remove
+from os import rename
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+from tempfile import mkstemp
+
+from jinja2.loaders import BaseLoader
+from jinja2.loaders import TemplateNotFound
+
+from calmjs.registry import get
+from nunja.loader import always_uptodate
+
+logger = getLogger(__name__)
+
+ARCHIVE_MAGIC = b'NUNJAR\x00\x01'
+_index_length = struct.Struct('>I')
+
+
+def pack(registries, target):
+    """
+    Pack the templates provided by the registries into the archive at
+    target.  Where multiple registries provide a template with the same
+    name, the one from the registry listed first will be used.
+
+    Returns the number of templates packed.
+    """
+
+    sources = []
+    index = {}
+    offset = 0
+    for registry in registries:
+        for name in registry.iter_template_names():
+            if name in index:
+                continue
+            path = registry.lookup_path(name)
+            with codecs.open(path, encoding='utf-8') as fd:
+                source = fd.read().encode('utf-8')
+            index[name] = [offset, len(source)]
+            sources.append(source)
+            offset += len(source)
+
+    header = json.dumps(index, sort_keys=True).encode('utf-8')
+    fd, tmp = mkstemp(dir=dirname(abspath(target)), suffix='.tmp')
+    with fdopen(fd, 'wb') as stream:
+        stream.write(ARCHIVE_MAGIC)
+        stream.write(_index_length.pack(len(header)))
+        stream.write(header)
+        for source in sources:
+            stream.write(source)
+    try:
+        rename(tmp, target)
+    except OSError:
+        # the target may not be replaced on certain platforms.
+        remove(target)
+        rename(tmp, target)
+
+    logger.info(
+        "packed %d templates from registries %s into archive '%s'",
+        len(index), ', '.join(
+            "'%s'" % registry.registry_name for registry in registries),
+        target,
+    )
+    return len(index)
+
+
+class ArchiveLoader(BaseLoader):
+    """
+    Load the templates from an archive produced by pack.  As the
+    archive is not expected to be modified while it is in use, the
+    templates are never checked for modifications.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fd:
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic = self._mmap[:len(ARCHIVE_MAGIC)]
+        if magic != ARCHIVE_MAGIC:
+            self._mmap.close()
+            raise ValueError("'%s' is not a nunja template archive" % path)
+
+        start = len(ARCHIVE_MAGIC)
+        length, = _index_length.unpack_from(self._mmap, start)
+        start += _index_length.size
+        self.index = json.loads(
+            self._mmap[start:start + length].decode('utf-8'))
+        self._offset = start + length
+
+    def get_source(self, environment, template):
+        try:
+            offset, length = self.index[template]
+        except KeyError:
+            raise TemplateNotFound(template)
+
+        offset += self._offset
+        source = self._mmap[offset:offset + length].decode('utf-8')
+        return source, join(self.path, template), always_uptodate
+
+    def list_templates(self):
+        return sorted(self.index)
+
+    def close(self):
+        self._mmap.close()
+
+
+def main(args=None):
+    """
+    Pack the templates from the registries with the names provided
+    after the target into the archive at the target.
+    """
+
+    args = sys.argv[1:] if args is None else args
+    if len(args) < 2:
+        sys.stderr.write(
+            'usage: python -m nunja.archive target registry_name '
+            '[registry_name ...]\n')
+        return 2
+
+    registries = []
+    for name in args[1:]:
+        registry = get(name)
+        if registry is None:
+            sys.stderr.write("registry '%s' not found\n" % name)
+            return 1
+        registries.append(registry)
+
+    count = pack(registries, args[0])
+    sys.stdout.write('packed %d templates into %s\n' % (count, args[0]))
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
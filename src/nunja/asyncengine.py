@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Engines for rendering through asyncio.
+
+As the async mode of Jinja2 is used, this module requires Python 3.6
+or later with Jinja2 2.9 or later.  Loading of the templates remain
+synchronous, so the bytecode cache and the warm_bytecode_cache method
+should be used to keep that cost to a minimum.
+"""
+
+import asyncio
+import inspect
+
+from nunja.engine import Engine
+from nunja.engine import JinjaEngine
+
+
+async def resolve_data(data):
+    """
+    Return the data with the values that are awaitables replaced by
+    their results, with all of them awaited concurrently.
+    """
+
+    keys = [key for key, value in data.items() if inspect.isawaitable(value)]
+    if not keys:
+        return data
+
+    results = await asyncio.gather(*(data[key] for key in keys))
+    resolved = dict(data)
+    resolved.update(zip(keys, results))
+    return resolved
+
+
+async def buffer_stream_async(stream, buffer_size=None, encoding=None):
+    """
+    The asynchronous version of nunja.engine.buffer_stream for the
+    async iterable stream.
+    """
+
+    empty = b'' if encoding else u''
+    buf = []
+    size = 0
+    async for chunk in stream:
+        if not chunk:
+            continue
+        if encoding:
+            chunk = chunk.encode(encoding)
+        if not buffer_size:
+            yield chunk
+            continue
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield empty.join(buf)
+            buf = []
+            size = 0
+
+    if buf:
+        yield empty.join(buf)
+
+
+class AsyncEngine(Engine):
+    """
+    Nunja core engine for asyncio.
+
+    The values in the data that are awaitables will be awaited
+    concurrently before the rendering starts; any other awaitables
+    accessed by the templates will be awaited as they are rendered.
+    """
+
+    environment_options = {'enable_async': True}
+
+    async def execute_async(self, mold_id, data, wrapper_tag='div'):
+        """
+        Execute a mold `mold_id` asynchronously, see execute.
+        """
+
+        kwargs = self._execute_kwargs(
+            mold_id, await resolve_data(data), wrapper_tag)
+        return await self._core_template_.render_async(**kwargs)
+
+    async def execute_stream_async(
+            self, mold_id, data, wrapper_tag='div',
+            buffer_size=None, encoding=None):
+        """
+        Execute a mold `mold_id` asynchronously as an async generator,
+        see execute_stream.
+        """
+
+        kwargs = self._execute_kwargs(
+            mold_id, await resolve_data(data), wrapper_tag)
+        async for chunk in buffer_stream_async(
+                self._core_template_.generate_async(**kwargs),
+                buffer_size=buffer_size, encoding=encoding):
+            yield chunk
+
+    async def render_async(self, mold_id, data):
+        """
+        Render a mold `mold_id` asynchronously, see render.
+        """
+
+        template = self.load_mold(mold_id)
+        return await template.render_async(**(await resolve_data(data)))
+
+    async def render_stream_async(
+            self, mold_id, data, buffer_size=None, encoding=None):
+        """
+        Render a mold `mold_id` asynchronously as an async generator,
+        see render_stream.
+        """
+
+        template = self.load_mold(mold_id)
+        data = await resolve_data(data)
+        async for chunk in buffer_stream_async(
+                template.generate_async(**data),
+                buffer_size=buffer_size, encoding=encoding):
+            yield chunk
+
+
+class AsyncJinjaEngine(JinjaEngine):
+    """
+    Jinja only engine for asyncio.
+    """
+
+    environment_options = {'enable_async': True}
+
+    async def render_template_async(self, name, data):
+        """
+        Render a template asynchronously.
+        """
+
+        template = self.load_template(name)
+        return await template.render_async(**(await resolve_data(data)))
+
+    async def render_template_stream_async(
+            self, name, data, buffer_size=None, encoding=None):
+        """
+        Render a template asynchronously as an async generator.
+        """
+
+        template = self.load_template(name)
+        data = await resolve_data(data)
+        async for chunk in buffer_stream_async(
+                template.generate_async(**data),
+                buffer_size=buffer_size, encoding=encoding):
+            yield chunk
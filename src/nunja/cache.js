@@ -0,0 +1,39 @@
+'use strict';
+
+/*
+The nunjucks counterpart of the cache tag provided by nunja.cache, such
+that templates making use of it will work with both engines.  No output
+is cached here, the body of the tag is simply rendered as is.
+*/
+
+var CacheExtension = function() {
+    this.tags = ['cache'];
+    // the body is already escaped as it is rendered.
+    this.autoescape = false;
+};
+
+CacheExtension.prototype.parse = function(parser, nodes) {
+    var token = parser.nextToken();
+    // the key and the optional ttl, which are both ignored.
+    var args = parser.parseSignature(null, true);
+    parser.advanceAfterBlockEnd(token.value);
+    var body = parser.parseUntilBlocks('endcache');
+    parser.advanceAfterBlockEnd();
+    return new nodes.CallExtension(this, 'run', args, [body]);
+};
+
+CacheExtension.prototype.run = function() {
+    // the body is always the final argument.
+    return arguments[arguments.length - 1]();
+};
+
+var install = function(env) {
+    /*
+    Add the extensions to the nunjucks environment.
+    */
+    env.addExtension('CacheExtension', new CacheExtension());
+    return env;
+};
+
+exports.CacheExtension = CacheExtension;
+exports.install = install;
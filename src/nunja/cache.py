@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Caching of the compiled templates and their output.
+
+The bytecode caches provided by Jinja2 are keyed by the name and the
+path of the template as resolved by the registry, with the checksum of
+the source stored alongside the bytecode such that modified templates
+will be compiled again.
+
+The output of molds may be cached through the FragmentCache, either for
+the whole mold through the engine, or for parts of templates through
+the ``{% cache key %}...{% endcache %}`` tag provided by CacheExtension.
+"""
+
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from logging import getLogger
+from os import makedirs
+from os.path import isdir
+from threading import Lock
+from timeit import default_timer
+
+from jinja2.bccache import BytecodeCache
+from jinja2.bccache import FileSystemBytecodeCache
+from jinja2 import nodes
+from jinja2.exceptions import TemplateError
+from jinja2.ext import Extension
+
+from nunja.analysis import name_to_mold_id
+
+logger = getLogger(__name__)
+
+# the exact types of the values that are accepted for fingerprinting.
+_text_types = tuple(set([str, type(u'')]))
+_integer_types = tuple(set([int, type(2 ** 64)]))
+_sequence_types = {list: 'l', tuple: 't'}
+_mapping_types = (dict, OrderedDict)
+
+# the value that may be specified as the bytecode_cache for the engines
+# to make use of the in-memory bytecode cache shared by the process.
+BYTECODE_CACHE_MEMORY = ':memory:'
+
+
+class MemoryBytecodeCache(BytecodeCache):
+    """
+    A bytecode cache that keeps the bytecode in memory, such that it may
+    be shared between the environments within a process.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+
+    def load_bytecode(self, bucket):
+        code = self._buckets.get(bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        self._buckets[bucket.key] = bucket.bytecode_to_string()
+
+    def clear(self):
+        self._buckets.clear()
+
+
+memory_bytecode_cache = MemoryBytecodeCache()
+
+
+def get_bytecode_cache(bytecode_cache):
+    """
+    Return the bytecode cache for the value, which may be an instance of
+    a jinja2 BytecodeCache, BYTECODE_CACHE_MEMORY for the in-memory
+    cache shared by the process, or the path to the directory for the
+    filesystem based cache, which will be created if it does not exist.
+    """
+
+    if bytecode_cache is None or isinstance(bytecode_cache, BytecodeCache):
+        return bytecode_cache
+
+    if bytecode_cache == BYTECODE_CACHE_MEMORY:
+        return memory_bytecode_cache
+
+    if not isdir(bytecode_cache):
+        makedirs(bytecode_cache)
+    return FileSystemBytecodeCache(bytecode_cache)
+
+
+def load_templates(env, registry, timer=default_timer):
+    """
+    Load every template provided by the registry through the env, such
+    that they will be compiled and kept in the caches of the env.
+
+    Returns a 2-tuple of the dict of the names of the loaded templates
+    to the time taken to load them in seconds, and the dict of the names
+    of the templates that failed to load to their errors.
+    """
+
+    timings = OrderedDict()
+    failures = OrderedDict()
+    for name in registry.iter_template_names():
+        start = timer()
+        try:
+            env.get_template(name)
+        except TemplateError as e:
+            failures[name] = e
+            continue
+        timings[name] = timer() - start
+    return timings, failures
+
+
+def warm_bytecode_cache(env, registry):
+    """
+    Load every template provided by the registry through the env, such
+    that the bytecode cache for the env will be populated with all the
+    compiled templates ahead of time.
+
+    Returns the number of templates loaded.
+    """
+
+    timings, failures = load_templates(env, registry)
+    for name, e in failures.items():
+        logger.warning(
+            "failed to compile template '%s' for the bytecode cache: %s",
+            name, e,
+        )
+
+    logger.info(
+        "loaded %d templates from registry '%s' into the bytecode cache",
+        len(timings), registry.registry_name,
+    )
+    return len(timings)
+
+
+def prewarm(env, registry, timer=default_timer):
+    """
+    Load and compile every template provided by the registry through the
+    env, such that none of them will need to be compiled when they are
+    first rendered.
+
+    Returns the report as a dict, with the templates key being the dict
+    of the names of the loaded templates to the time taken in seconds,
+    the failures key being the dict of the names of the templates that
+    failed to their error messages, and the elapsed key being the total
+    time taken in seconds.
+    """
+
+    start = timer()
+    timings, failures = load_templates(env, registry, timer=timer)
+    for name, e in failures.items():
+        logger.warning("failed to prewarm template '%s': %s", name, e)
+
+    capacity = getattr(env.cache, 'capacity', None)
+    if env.cache is None or (capacity is not None and capacity < len(timings)):
+        logger.warning(
+            "the template cache of the environment cannot hold all %d "
+            "templates from registry '%s'; prewarming is not effective for "
+            "all of them", len(timings), registry.registry_name,
+        )
+
+    report = {
+        'templates': timings,
+        'failures': OrderedDict(
+            (name, str(e)) for name, e in failures.items()),
+        'elapsed': timer() - start,
+    }
+    logger.info(
+        "prewarmed %d templates from registry '%s' in %.3f seconds "
+        "with %d failures", len(timings), registry.registry_name,
+        report['elapsed'], len(failures),
+    )
+    return report
+
+
+def _encode(value):
+    # every value is encoded with a tag for its type, such that values
+    # that would be rendered differently (e.g. Markup against str) will
+    # not produce the same encoding.
+    if hasattr(value, '__html__'):
+        return 'm' + json.dumps(u'%s' % value.__html__())
+    value_type = type(value)
+    if value_type in _text_types:
+        return 's' + json.dumps(value)
+    if value is None or value_type is bool:
+        return repr(value)[0]
+    if value_type in _integer_types:
+        return 'i%d' % value
+    if value_type is float:
+        return 'f' + repr(value)
+    if value_type in _sequence_types:
+        return _sequence_types[value_type] + '[%s]' % ','.join(
+            _encode(item) for item in value)
+    if value_type in _mapping_types:
+        # the order of the items is kept, as it is also the order that
+        # the templates will iterate through them.
+        return 'd{%s}' % ','.join(
+            _encode(k) + ':' + _encode(v) for k, v in value.items())
+    raise TypeError(
+        'value of type %s cannot be fingerprinted' % value_type.__name__)
+
+
+def fingerprint(value):
+    """
+    Return the fingerprint of the value as a hex digest, which will be
+    unique for the value and the types of everything within it.  Only
+    the values made of the types that may be encoded as JSON without any
+    loss, plus Markup (or any object with the __html__ method), may be
+    fingerprinted; a TypeError will be raised for anything else.
+    """
+
+    try:
+        return sha256(_encode(value).encode('utf8')).hexdigest()
+    except RuntimeError:
+        # the value is too deeply nested or is recursive.
+        raise TypeError('value is too deeply nested to be fingerprinted')
+
+
+class FragmentCache(object):
+    """
+    A cache for the rendered output of molds, with the least recently
+    used entries evicted once maxsize is reached, and entries expiring
+    after ttl seconds if specified.
+
+    Every entry is stored with a token, which is typically the tuple of
+    the templates used to produce the output; an entry will only be
+    used if its token is identical to the one provided for the lookup.
+    The keys must be tuples with the mold_id as the first element.
+    """
+
+    def __init__(self, maxsize=256, ttl=None, timer=default_timer):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, token):
+        """
+        Return the value for the key, or None if there is no valid
+        entry for the key and token.
+        """
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, entry_token, expires = entry
+            if entry_token != token or (
+                    expires is not None and self.timer() >= expires):
+                self.misses += 1
+                return None
+
+            # reinsert as the most recently used.
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, token, value, ttl=None):
+        """
+        Set the value for the key with the token, with the ttl for the
+        entry overriding the ttl for the cache if specified.
+        """
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.timer() + ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, token, expires)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, mold_id=None):
+        """
+        Remove all entries for the mold_id, or all entries if it is not
+        specified.
+        """
+
+        with self._lock:
+            if mold_id is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == mold_id]:
+                del self._entries[key]
+
+    def stats(self):
+        """
+        Return a dict with the hits, misses, evictions and the current
+        size of the cache.
+        """
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+        }
+
+
+class CacheExtension(Extension):
+    """
+    Provide the cache tag, which caches the rendered output of its body
+    by the value of the key expression, with an optional ttl in seconds
+    as the second argument, e.g.::
+
+        {% cache 'navigation', 300 %}...{% endcache %}
+
+    The entries are stored in the block_cache of the environment, which
+    is a FragmentCache by default but may be replaced by anything that
+    implements the same get and set methods (invalidate is optional, but
+    the engines will not be able to discard the entries without it);
+    setting it to None will disable the caching.  The entries are keyed
+    by the mold_id and name of the template and the key, such that they
+    may be invalidated for the mold, and will no longer be used once the
+    template is modified.
+
+    The nunjucks counterpart in nunja/cache.js renders the body as is,
+    such that the templates remain usable by the JavaScript engine.
+    """
+
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(CacheExtension, self).__init__(environment)
+        environment.extend(block_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        if parser.stream.skip_if('comma'):
+            ttl = parser.parse_expression()
+        else:
+            ttl = nodes.Const(None)
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        name = parser.name or ''
+        # the token identifies the body, such that the entries produced
+        # by a previous version of the template will not be used.
+        token = sha256(repr(body).encode('utf8')).hexdigest()
+        args = [
+            nodes.Const(name_to_mold_id(name)), nodes.Const(name),
+            nodes.Const(token), key, ttl,
+        ]
+        return nodes.CallBlock(
+            self.call_method('_cache', args), [], [], body).set_lineno(lineno)
+
+    def _cache(self, mold_id, name, token, key, ttl, caller):
+        cache = self.environment.block_cache
+        if cache is None:
+            return caller()
+
+        cache_key = (mold_id, name, key)
+        value = cache.get(cache_key, token)
+        if value is not None:
+            return value
+
+        if self.environment.is_async:
+            return self._cache_async(cache, cache_key, token, ttl, caller)
+
+        value = caller()
+        cache.set(cache_key, token, value, ttl)
+        return value
+
+    def _cache_async(self, cache, cache_key, token, ttl, caller):
+        # caller returns an awaitable for async environments; this is
+        # written without the async syntax to remain importable on the
+        # versions of Python without it.
+        def store(future):
+            if future.exception() is None:
+                cache.set(cache_key, token, future.result(), ttl)
+
+        import asyncio
+        future = asyncio.ensure_future(caller())
+        future.add_done_callback(store)
+        return future
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Templates compiled ahead of time into Python modules.
+
+The templates provided by a registry may be compiled into a directory of
+Python modules, or a zip file of them, through the environment of the
+engine that would render them, such that the lexing, parsing and
+compiling of the templates are skipped at runtime.  The CompiledLoader
+loads the templates from those modules, with the templates that are
+missing loaded from the source through the fallback loader.
+
+The templates for a registry may be compiled as a script, e.g.::
+
+    $ python -m nunja.compiled templates.zip nunja.mold
+
+As the compiled templates depend on the options for the environment
+(e.g. autoescape and the extensions), they must be compiled with the
+same options as the environment that will load them, and also through
+the same version of Jinja2.
+"""
+
+import sys
+from logging import getLogger
+
+from jinja2.loaders import BaseLoader
+from jinja2.loaders import ModuleLoader
+from jinja2.loaders import TemplateNotFound
+
+from calmjs.registry import get
+
+logger = getLogger(__name__)
+
+
+def compile_templates(env, target, zip='deflated'):
+    """
+    Compile all the templates provided by the loader of the env into
+    the target, which will be a zip file unless zip is None, in which
+    case the target will be a directory of the modules.
+
+    Returns a 2-tuple of the number of templates compiled and the list
+    of messages for the templates that failed to compile.
+    """
+
+    compiled = []
+    failures = []
+
+    def log_function(msg):
+        if msg.startswith('Compiled '):
+            compiled.append(msg)
+        elif msg.startswith('Could not compile '):
+            logger.warning(msg)
+            failures.append(msg)
+        else:
+            logger.debug(msg)
+
+    env.compile_templates(
+        target, zip=zip, log_function=log_function, ignore_errors=True)
+    logger.info(
+        "compiled %d templates into '%s' with %d failures",
+        len(compiled), target, len(failures),
+    )
+    return len(compiled), failures
+
+
+class CompiledLoader(BaseLoader):
+    """
+    Load the templates from the modules compiled by compile_templates
+    at path, with the templates that are missing from there loaded
+    through the fallback loader, which will also provide the source of
+    the templates.  The compiled templates are never reloaded.
+    """
+
+    def __init__(self, path, fallback):
+        self.path = path
+        self.module_loader = ModuleLoader(path)
+        self.fallback = fallback
+
+    def get_source(self, environment, template):
+        return self.fallback.get_source(environment, template)
+
+    def list_templates(self):
+        return self.fallback.list_templates()
+
+    def load(self, environment, name, globals=None):
+        try:
+            return self.module_loader.load(environment, name, globals)
+        except TemplateNotFound:
+            logger.debug(
+                "template '%s' not found in the compiled templates at '%s'; "
+                "loading from source", name, self.path,
+            )
+            return self.fallback.load(environment, name, globals)
+
+
+def main(args=None):
+    """
+    Compile the templates from the registry with the name provided
+    after the target into the target, which will be a zip file if it
+    ends with .zip, otherwise a directory.
+    """
+
+    from nunja.engine import JinjaEngine
+    from nunja.registry import JinjaTemplateRegistry
+    from nunja.registry import MoldRegistry
+
+    args = sys.argv[1:] if args is None else args
+    if len(args) != 2:
+        sys.stderr.write(
+            'usage: python -m nunja.compiled target registry_name\n')
+        return 2
+
+    target, name = args
+    registry = get(name)
+    if registry is None:
+        sys.stderr.write("registry '%s' not found\n" % name)
+        return 1
+    if not isinstance(registry, (MoldRegistry, JinjaTemplateRegistry)):
+        sys.stderr.write("registry '%s' does not provide templates\n" % name)
+        return 1
+
+    # the environment is the same as the one for the Engine, but without
+    # requiring the wrapper from the _core_ mold to be available.
+    engine = JinjaEngine(registry)
+    count, failures = compile_templates(
+        engine.env, target,
+        zip='deflated' if target.endswith('.zip') else None,
+    )
+    sys.stdout.write('compiled %d templates into %s\n' % (count, target))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
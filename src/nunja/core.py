@@ -1,4 +1,45 @@
 # -*- coding: utf-8 -*-
-from .engine import Engine
+"""
+The default engine.
 
-engine = Engine()
+The engine is constructed when it is first used rather than when this
+module is imported, as that requires the default registry to be built
+and the core template to be loaded, which would be a cost paid by every
+user of this module (e.g. command line tools) even if nothing is to be
+rendered.
+"""
+
+from threading import Lock
+
+_engine = None
+_lock = Lock()
+
+
+def get_engine():
+    """
+    Return the default engine, which is constructed on the first call.
+    """
+
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                from nunja.engine import Engine
+                _engine = Engine()
+    return _engine
+
+
+class EngineProxy(object):
+    """
+    Provide access to the attributes of the default engine, such that it
+    will only be constructed once any of them is accessed.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_engine(), name)
+
+    def __repr__(self):
+        return '<%s for %r>' % (type(self).__name__, _engine)
+
+
+engine = EngineProxy()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Backends for the dump filter.
+
+The dump filter is to match with the nunjucks version, which calls
+JSON.stringify in JavaScript.  The output of the default backend is
+produced by json.dumps with parameters that mimic that, and any other
+backends must produce output that is identical to that.
+"""
+
+import json
+import re
+from functools import partial
+from json.encoder import encode_basestring_ascii
+from math import isinf
+from math import isnan
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# the name of the backend that will select the fastest one available.
+DUMP_BACKEND_AUTO = 'auto'
+
+json_dumps = partial(json.dumps, sort_keys=True, separators=(',', ':'))
+
+# the values that orjson would dump differently from json_dumps, which
+# are the numbers with an exponent, and null as that may be produced from
+# the non-finite numbers (or None).  As the output is compact, those
+# values are followed by the structural characters, such that text in
+# strings (e.g. hexadecimal identifiers) will not normally be matched.
+_exponent_patt = re.compile(br'e-?[0-9]+(?=[,\]}]|$)')
+_null_patt = re.compile(br'null(?=[,\]}]|$)')
+# the numbers below 1e-4 that json_dumps would format with an exponent.
+_small_number = b'0.0000'
+
+if orjson is not None:
+    # the values that orjson would dump differently from json_dumps (or
+    # would dump where json_dumps raises TypeError) are passed through
+    # to the default, which rejects them.
+    _orjson_option = (
+        orjson.OPT_SORT_KEYS |
+        orjson.OPT_PASSTHROUGH_DATETIME |
+        orjson.OPT_PASSTHROUGH_DATACLASS |
+        orjson.OPT_PASSTHROUGH_SUBCLASS
+    )
+
+
+def _orjson_default(obj):
+    raise TypeError
+
+
+def _has_non_finite(obj):
+    # as the object was accepted by orjson with the subclasses passed
+    # through, the containers can only be of the exact builtin types.
+    pending = [obj]
+    pop = pending.pop
+    extend = pending.extend
+    while pending:
+        value = pop()
+        value_type = type(value)
+        if value_type is float:
+            if isinf(value) or isnan(value):
+                return True
+        elif value_type is dict:
+            extend(value.values())
+        elif value_type is list or value_type is tuple:
+            extend(value)
+    return False
+
+
+def _escape_non_ascii(text):
+    # as every quote and backslash was escaped by orjson, the additional
+    # escapes for those are removed after the whole text is escaped.
+    return encode_basestring_ascii(text)[1:-1].replace(
+        u'\\"', u'"').replace(u'\\\\', u'\\')
+
+
+def orjson_dumps(obj):
+    """
+    Dump the object through orjson, with the non-ASCII characters then
+    escaped to match json_dumps.
+
+    The values that orjson would dump differently are dumped by
+    json_dumps instead, which are the ones unsupported by orjson (e.g.
+    integers beyond 64-bit or non-string keys), the subclasses of the
+    builtin types (e.g. OrderedDict), the datetime and dataclass
+    instances (which json_dumps rejects), the floats that would be
+    formatted differently, and the non-finite floats, which orjson turns
+    into null; the object is only searched for those if a null is in
+    the output.  Note that UUID and Enum values are still dumped by
+    orjson, where json_dumps would reject them.
+    """
+
+    try:
+        result = orjson.dumps(
+            obj, default=_orjson_default, option=_orjson_option)
+    except TypeError:
+        return json_dumps(obj)
+
+    if (_small_number in result or _exponent_patt.search(result) or (
+            _null_patt.search(result) and _has_non_finite(obj))):
+        return json_dumps(obj)
+    result = result.decode('utf-8')
+    if not result.isascii() or u'\x7f' in result:
+        result = _escape_non_ascii(result)
+    return result
+
+
+backends = {
+    'json': json_dumps,
+}
+
+if orjson is not None:
+    backends['orjson'] = orjson_dumps
+
+
+def get_dump(backend=DUMP_BACKEND_AUTO):
+    """
+    Return the dump function for the backend, which may be a name from
+    the backends, or a callable that will be returned as is.  The auto
+    backend will select orjson if available, otherwise json.
+    """
+
+    if callable(backend):
+        return backend
+
+    if backend == DUMP_BACKEND_AUTO:
+        return backends.get('orjson', json_dumps)
+
+    try:
+        return backends[backend]
+    except KeyError:
+        raise ValueError(
+            "unknown dump backend '%s'; available backends are: %s" % (
+                backend, ', '.join(sorted(backends))))
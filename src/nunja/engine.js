@@ -3,6 +3,7 @@
 var nunjucks = require('nunjucks');
 var registry = require('nunja/registry');
 var loader = require('nunja/loader');
+var cache = require('nunja/cache');
 var utils = require('nunja/utils');
 
 var $ = utils.$;
@@ -17,15 +18,42 @@ catch(e) {
         'precompiled core templates missing; performance hit may result');
 }
 
+// The mapping of mold_id to the path of the script providing the
+// precompiled templates for the mold that is to be loaded on demand,
+// which is provided by the lazy module generated for webpack builds.
+var lazy_molds = {};
+var lazy_module = '__nunja__/__lazy__';
+
+/* istanbul ignore next */
+try {
+    // not a static import as the module is optional.
+    lazy_molds = require(lazy_module);
+}
+catch(e) {
+    // nothing is to be loaded lazily.
+}
+
+// The scripts are served relative to the script that provided this.
+/* istanbul ignore next */
+var lazy_base_url = (
+    typeof document !== 'undefined' && document.currentScript &&
+    document.currentScript.src ?
+    document.currentScript.src.replace(/[^\/]*$/, '') : ''
+);
+
 var _registry = new registry.Registry();
 
 // Default environment that includes the nunja specific loader, and
 // make use of autoescape as it's better to untrust templates by
 // default.  To do unsafe actions one must include the safe filter,
 // and this should stick out in auditing while keeping safety first.
-var env = new nunjucks.Environment(new loader.NunjaLoader(_registry), {
-    'autoescape': true,
-});
+// The extensions for the tags supported by the Python engine are also
+// installed, such that the same templates may be used.
+var env = cache.install(
+    new nunjucks.Environment(new loader.NunjaLoader(_registry), {
+        'autoescape': true,
+    })
+);
 
 // If any of these are overridden, we don't really support them but
 // it's there if this later gets extended to do whatever other stuff
@@ -36,6 +64,8 @@ var default_kwargs = {
     '_wrapper_tag_': registry.DEFAULT_WRAPPER_TAG,
     'env': env,
     'registry': _registry,
+    'lazy_molds': lazy_molds,
+    'lazy_base_url': lazy_base_url,
 };
 
 var Engine = function(kwargs) {
@@ -43,6 +73,12 @@ var Engine = function(kwargs) {
         this[key] = kwargs[key] || default_kwargs[key];
     }
 
+    // the lazily loaded scripts, keyed by src, with the callbacks
+    // waiting on them until they are loaded, and the molds with all of
+    // their scripts loaded.
+    this._lazy_scripts = {};
+    this._lazy_loaded = {};
+
     // Load the default template.
     this['_core_template_'] = this.load_mold(this._wrapper_name);
 };
@@ -81,12 +117,89 @@ Engine.prototype.load_template = function (name, cb) {
     return this.env.getTemplate(name, cb);
 };
 
+Engine.prototype.load_script = function (src, cb) {
+    /*
+    Load the script from the src relative to the lazy_base_url once,
+    before triggering the callback.  Failure to load the script will
+    also trigger the callback.
+    */
+    var self = this;
+    var state = this._lazy_scripts[src];
+
+    if (state === true) {
+        cb();
+        return;
+    }
+
+    if (state) {
+        state.push(cb);
+        return;
+    }
+    this._lazy_scripts[src] = [cb];
+
+    var done = function() {
+        var callbacks = self._lazy_scripts[src];
+        self._lazy_scripts[src] = true;
+        callbacks.forEach(function(callback) {
+            callback();
+        });
+    };
+
+    var script = document.createElement('script');
+    script.src = this.lazy_base_url + src;
+    script.onload = done;
+    script.onerror = done;
+    document.head.appendChild(script);
+};
+
+Engine.prototype.load_lazy = function (mold_id, cb) {
+    /*
+    Load the scripts with the precompiled templates for the mold, if it
+    is to be loaded lazily, before triggering the callback.  These are
+    the script for the mold, and the scripts for the other molds that
+    provide the templates that may be referenced by its templates, as
+    the templates are loaded synchronously while rendering.  Failure to
+    load the scripts will also trigger the callback, such that the usual
+    loader will be used.
+    */
+    var self = this;
+    var scripts = this.lazy_molds[mold_id];
+
+    if (!scripts || this._lazy_loaded[mold_id]) {
+        cb();
+        return;
+    }
+
+    // a single script may also be specified.
+    scripts = [].concat(scripts);
+    var remaining = scripts.length;
+    var done = function() {
+        remaining -= 1;
+        if (remaining === 0) {
+            self._lazy_loaded[mold_id] = true;
+            cb();
+        }
+    };
+
+    scripts.forEach(function(src) {
+        self.load_script(src, done);
+    });
+};
+
 Engine.prototype.load_mold = function (mold_id, cb) {
     /*
     Loads the default template for the mold identified by mold_id
     */
-    return this.load_template(
-        mold_id + '/' + this._required_template_name, cb);
+    var self = this;
+    var name = mold_id + '/' + this._required_template_name;
+
+    if (cb instanceof Function) {
+        this.load_lazy(mold_id, function() {
+            self.load_template(name, cb);
+        });
+        return;
+    }
+    return this.load_template(name, cb);
 };
 
 Engine.prototype.load_element = function(element, cb) {
@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 import codecs
-import json
 from functools import partial
+from logging import getLogger
+try:
+    from collections import ChainMap
+except ImportError:  # pragma: no cover
+    # layered contexts are unavailable; fall back to copying.
+    ChainMap = None
+from multiprocessing import Pool
 
 from jinja2 import Environment
+from jinja2 import TemplateError
 
 from calmjs.registry import get
 from nunja.registry import REQ_TMPL_NAME
@@ -13,6 +20,18 @@ from nunja.registry import JINJA_TEMPLATE_REGISTRY_NAME
 from nunja.registry import MoldRegistry
 from nunja.registry import JinjaTemplateRegistry
 from nunja.loader import NunjaLoader
+from nunja.compiled import CompiledLoader
+from nunja.cache import CacheExtension
+from nunja.cache import fingerprint
+from nunja.cache import get_bytecode_cache
+from nunja.cache import prewarm
+from nunja.cache import warm_bytecode_cache
+from nunja.dump import DUMP_BACKEND_AUTO
+from nunja.dump import get_dump
+from nunja.analysis import find_template_references
+from nunja.watcher import watch
+
+logger = getLogger(__name__)
 
 
 def join(*p):
@@ -22,6 +41,52 @@ def join(*p):
     return '/'.join(p)
 
 
+def buffer_stream(stream, buffer_size=None, encoding=None):
+    """
+    Return a generator that yield the non-empty chunks from the stream
+    of text, which are encoded if encoding is specified.  If buffer_size
+    is specified, the chunks will be joined together until the length
+    (in bytes if encoded, otherwise characters) reaches that size.
+    """
+
+    if encoding:
+        stream = (chunk.encode(encoding) for chunk in stream)
+        empty = b''
+    else:
+        empty = u''
+
+    buf = []
+    size = 0
+    for chunk in stream:
+        if not chunk:
+            continue
+        if not buffer_size:
+            yield chunk
+            continue
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield empty.join(buf)
+            buf = []
+            size = 0
+
+    if buf:
+        yield empty.join(buf)
+
+
+# the engine for the worker processes of Engine.render_many
+_render_many_engine = None
+
+
+def _render_many_init(registry, kwargs):
+    global _render_many_engine
+    _render_many_engine = Engine(registry, **kwargs)
+
+
+def _render_many_worker(args):
+    return list(_render_many_engine.render_many(*args))
+
+
 class Engine(object):
     """
     Nunja core engine
@@ -30,12 +95,23 @@ class Engine(object):
     rendering of templates through nunja identifiers.
     """
 
+    # additional keyword arguments for the default environment.
+    environment_options = {}
+
     def __init__(
             self,
             registry=DEFAULT_REGISTRY_NAME,
             env=None,
             _wrapper_name=DEFAULT_WRAPPER_NAME,
             _required_template_name=REQ_TMPL_NAME,
+            production=False,
+            bytecode_cache=None,
+            dump=DUMP_BACKEND_AUTO,
+            fragment_cache=None,
+            block_cache=None,
+            auto_reload=True,
+            loader=None,
+            compiled_templates=None,
             ):
         """
         By default, the engine can be created without arguments which
@@ -44,21 +120,80 @@ class Engine(object):
         It is possible to initialize using other arguments, but this is
         unsupported by the main system, and only useful for certain
         specialized implementations.
+
+        If production is True, the templates for the molds will not be
+        checked for modifications once loaded until they are explicitly
+        invalidated; the environment created by default will also not
+        automatically reload any templates.
+
+        Otherwise, auto_reload determines how the templates are checked
+        for modifications by the loader of the environment created by
+        default, as documented for nunja.loader.NunjaLoader; notably, a
+        number will limit the checks to at most once for that many
+        seconds for each template.
+
+        The loader for the default environment may be specified, such
+        as a nunja.archive.ArchiveLoader, replacing the NunjaLoader for
+        the registry.  If the path to the templates compiled through
+        nunja.compiled.compile_templates is provided as
+        compiled_templates, those will be used, with the templates that
+        are missing from there loaded through the loader.
+
+        The bytecode_cache for the environment may be specified as any
+        value accepted by nunja.cache.get_bytecode_cache.
+
+        The backend for the dump filter may be specified as any value
+        accepted by nunja.dump.get_dump.
+
+        If a nunja.cache.FragmentCache is provided as fragment_cache,
+        the output from execute and render will be cached by the
+        fingerprint of the data as produced by nunja.cache.fingerprint,
+        or the cache_key provided for the call; without a cache_key, the
+        data that cannot be fingerprinted will not be cached.  The
+        entries will no longer be used once any of the templates
+        referenced by the mold are modified, unless in production mode.
+        As the templates referenced through dynamic references cannot be
+        tracked, the molds with those will only be cached outside of
+        production mode with a cache_key, and the modifications to the
+        templates referenced through them will not be tracked.
+
+        The default environment provides the cache tag through the
+        nunja.cache.CacheExtension, with the block_cache replacing the
+        FragmentCache it uses by default if provided; its entries will be
+        discarded by invalidate only if it also provides an invalidate
+        method like the FragmentCache.
         """
 
         self.registry = (
             registry if isinstance(registry, MoldRegistry) else get(registry))
+        self.fragment_cache = fragment_cache
+        # the names of the templates referenced by the template for the
+        # mold, along with the template.
+        self._mold_references = {}
+        self.production = production
+        if production:
+            auto_reload = False
+        loader = loader or NunjaLoader(self.registry, auto_reload=auto_reload)
+        if compiled_templates:
+            loader = CompiledLoader(compiled_templates, loader)
         self.env = env if env else Environment(
             autoescape=True,
-            loader=NunjaLoader(self.registry)
+            auto_reload=auto_reload is not False,
+            loader=loader,
+            extensions=[CacheExtension],
+            **self.environment_options
         )
+        if block_cache is not None:
+            self.env.block_cache = block_cache
+        if bytecode_cache is not None:
+            self.env.bytecode_cache = get_bytecode_cache(bytecode_cache)
+        # the loaded default template for each of the mold_id.
+        self._molds = {}
         # this filter is to match with nunjucks version (which calls
-        # JSON.stringify in JavaScript); construct a partial which is a
-        # callable to json.dumps with default parameters that mimic the
-        # JavaScript version of the called function.
-        self.env.filters['dump'] = partial(
-            json.dumps, sort_keys=True, separators=(',', ':'))
+        # JSON.stringify in JavaScript); see nunja.dump for details.
+        self.env.filters['dump'] = get_dump(dump)
         self._required_template_name = _required_template_name
+        self._wrapper_name = _wrapper_name
 
         self._core_template_ = self.load_mold(_wrapper_name)
 
@@ -87,6 +222,39 @@ class Engine(object):
 
         return self.env.get_template(name)
 
+    def warm_bytecode_cache(self):
+        """
+        Compile all the templates for all the molds in the registry
+        ahead of time into the bytecode cache of the environment.
+        """
+
+        return warm_bytecode_cache(self.env, self.registry)
+
+    def prewarm(self):
+        """
+        Load and compile every template for every mold in the registry,
+        including the templates that are not the default template for
+        their molds, and load the default templates for the molds.
+
+        Returns the report as produced by nunja.cache.prewarm.  As the
+        compiled templates are kept in the memory of this process, this
+        may be called in the master process before worker processes are
+        forked, such that they will inherit the compiled templates.
+        """
+
+        report = prewarm(self.env, self.registry)
+        for mold_id in sorted(self.registry.molds):
+            name = join(mold_id, self._required_template_name)
+            if name in report['failures']:
+                continue
+            try:
+                self.load_mold(mold_id)
+            except TemplateError as e:
+                logger.warning(
+                    "failed to prewarm mold '%s': %s", mold_id, e)
+                report['failures'][name] = str(e)
+        return report
+
     def load_mold(self, mold_id):
         """
         Load the default, required template from the mold `mold_id`.
@@ -96,11 +264,152 @@ class Engine(object):
         execution hooks.  Example:
 
             engine.load_mold('nunja.molds/html5').render(title='Hello')
+
+        The loaded template is cached by the mold_id; unless the engine
+        is in production mode, it will be loaded again if the template
+        was modified.
         """
 
-        return self.load_template(join(mold_id, self._required_template_name))
+        template = self._molds.get(mold_id)
+        if template is None or not (
+                self.production or template.is_up_to_date):
+            template = self._molds[mold_id] = self.load_template(
+                join(mold_id, self._required_template_name))
+        return template
 
-    def execute(self, mold_id, data, wrapper_tag='div'):
+    def invalidate(self, mold_id=None):
+        """
+        Invalidate the cached template for the mold `mold_id`, or for
+        all molds if not specified.  As templates may include templates
+        from other molds, the cache of the environment is also cleared.
+        The output cached for the mold by the fragment_cache and the
+        cache tags is also discarded.
+        """
+
+        if mold_id is None:
+            self._molds.clear()
+            self._mold_references.clear()
+        else:
+            self._molds.pop(mold_id, None)
+            self._mold_references.pop(mold_id, None)
+
+        if self.fragment_cache is not None:
+            self.fragment_cache.invalidate(mold_id)
+
+        # invalidate is optional for the block_cache, as only get and set
+        # are required for the cache tag.
+        invalidate = getattr(
+            getattr(self.env, 'block_cache', None), 'invalidate', None)
+        if invalidate is not None:
+            invalidate(mold_id)
+
+        if self.env.cache is not None:
+            self.env.cache.clear()
+
+        if mold_id in (None, self._wrapper_name):
+            self._core_template_ = self.load_mold(self._wrapper_name)
+
+    def watch(self):
+        """
+        Watch the directories of the registry for modifications through
+        a nunja.watcher.TemplateWatcher, such that the molds will be
+        invalidated as their templates are modified rather than having
+        the loader check the templates for modifications on every use.
+
+        Returns the watcher, which should be stopped once no longer
+        needed, or None if it cannot be started (e.g. where inotify is
+        unavailable), in which case the templates will continue to be
+        checked by the loader as before.
+        """
+
+        loader = self.env.loader
+        return watch(self.registry, self.invalidate, loader=(
+            loader if isinstance(loader, NunjaLoader) else None))
+
+    def _find_references(self, name):
+        """
+        Return a 2-tuple of the names of the templates that may be
+        referenced by the template through the include, import, from and
+        extends tags, and whether any of the references are dynamic, in
+        which case their targets cannot be determined.
+        """
+
+        names = set()
+        dynamic = False
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in names:
+                continue
+            names.add(current)
+            try:
+                source = self.env.loader.get_source(self.env, current)[0]
+                references, current_dynamic = find_template_references(
+                    source, self.env)
+            except TemplateError:
+                continue
+            pending.extend(references)
+            dynamic = dynamic or current_dynamic
+
+        names.discard(name)
+        return sorted(names), dynamic
+
+    def _fragment_token(self, mold_id):
+        """
+        Return a 2-tuple of the tuple of templates used for rendering the
+        mold, which will no longer be identical if any of them were
+        reloaded due to modification, and whether the mold has dynamic
+        references, in which case the token will not cover the templates
+        referenced through them.
+        """
+
+        template = self.load_mold(mold_id)
+        if self.production:
+            return (self._core_template_, template), False
+
+        cached = self._mold_references.get(mold_id)
+        if cached is None or cached[0] is not template:
+            cached = self._mold_references[mold_id] = (
+                (template,) + self._find_references(template.name))
+
+        token = [self._core_template_, template]
+        for name in cached[1]:
+            try:
+                token.append(self.env.get_template(name))
+            except TemplateError:
+                token.append(None)
+        return tuple(token), cached[2]
+
+    def _fragment(self, key, mold_id, data, cache_key, renderer):
+        """
+        Return the output from the renderer through the fragment cache.
+        """
+
+        if self.fragment_cache is None:
+            return renderer()
+
+        token, dynamic = self._fragment_token(mold_id)
+        if cache_key is None:
+            if dynamic:
+                # the modifications to the templates that may be
+                # referenced cannot be tracked.
+                return renderer()
+            try:
+                cache_key = ('data', fingerprint(data))
+            except TypeError:
+                # not cacheable without a lossless fingerprint.
+                return renderer()
+        else:
+            cache_key = ('key', cache_key)
+
+        key = (mold_id,) + key + cache_key
+        result = self.fragment_cache.get(key, token)
+        if result is None:
+            result = renderer()
+            self.fragment_cache.set(key, token, result)
+        return result
+
+    def execute(self, mold_id, data, wrapper_tag='div', cache_key=None):
         """
         Execute a mold `mold_id` by rendering through ``env``.
 
@@ -111,8 +420,36 @@ class Engine(object):
         the client-side on-load script trigger will execute the index.js
         defined for this mold; if this is not desired, simply call the
         render method instead.
+
+        If the engine has a fragment_cache, the cache_key may be used
+        in place of the fingerprint for the data.
         """
 
+        return self._fragment(
+            ('execute', wrapper_tag), mold_id, data, cache_key,
+            partial(self._execute, mold_id, data, wrapper_tag),
+        )
+
+    def _execute(self, mold_id, data, wrapper_tag):
+        if ChainMap is None or getattr(self.env, 'is_async', False):
+            return self._core_template_.render(
+                **self._execute_kwargs(mold_id, data, wrapper_tag))
+
+        # layer the wrapper variables and the globals for the template
+        # with the data, such that it will be used without being copied
+        # for the context shared with the template.
+        core_template = self._core_template_
+        context = core_template.new_context(ChainMap({
+            '_nunja_data_': 'data-nunja="%s"' % mold_id,
+            '_template_': self.load_mold(mold_id),
+            '_wrapper_tag_': wrapper_tag,
+        }, data, core_template.globals), shared=True)
+        try:
+            return u''.join(core_template.root_render_func(context))
+        except Exception:
+            return self.env.handle_exception()
+
+    def _execute_kwargs(self, mold_id, data, wrapper_tag):
         template = self.load_mold(mold_id)
 
         kwargs = {}
@@ -120,28 +457,160 @@ class Engine(object):
         kwargs['_nunja_data_'] = 'data-nunja="%s"' % mold_id
         kwargs['_template_'] = template
         kwargs['_wrapper_tag_'] = wrapper_tag
+        return kwargs
 
-        return self._core_template_.render(**kwargs)
+    def execute_stream(
+            self, mold_id, data, wrapper_tag='div',
+            buffer_size=None, encoding=None):
+        """
+        Execute a mold `mold_id` like execute, but return a generator
+        that yield the output in chunks as it is rendered, such that the
+        complete output is never held in memory.
 
-    def render(self, mold_id, data):
+        The chunks may be buffered to at least buffer_size and encoded
+        with the encoding; the result of specifying an encoding (e.g.
+        'utf-8') may be returned as the iterable for a WSGI application.
+        """
+
+        return buffer_stream(
+            self._core_template_.generate(
+                **self._execute_kwargs(mold_id, data, wrapper_tag)),
+            buffer_size=buffer_size, encoding=encoding,
+        )
+
+    def render(self, mold_id, data, cache_key=None):
         """
         Render a mold `mold_id`.  No wrappers are applied as only the
         default template defined for the mold is rendered.
+
+        If the engine has a fragment_cache, the cache_key may be used
+        in place of the fingerprint for the data.
         """
 
+        return self._fragment(
+            ('render',), mold_id, data, cache_key,
+            partial(self._render, mold_id, data),
+        )
+
+    def _render(self, mold_id, data):
         template = self.load_mold(mold_id)
         return template.render(**data)
 
+    def render_many(
+            self, mold_id, iterable, wrapped=False, wrapper_tag='div',
+            processes=None, chunksize=64):
+        """
+        Render the mold `mold_id` with every data from the iterable,
+        and return a generator that yield the results in order.  The
+        template is resolved only once for the entire batch.
+
+        If wrapped is True, the results will be wrapped like execute.
+
+        If processes is specified, the rendering will be done by a pool
+        of that many worker processes in batches of chunksize, which
+        requires the data to be picklable; note that the workers will
+        make use of an environment created by default for the registry.
+        """
+
+        if processes:
+            return self._render_many_pool(
+                mold_id, iterable, wrapped, wrapper_tag, processes, chunksize)
+
+        template = self.load_mold(mold_id)
+        if not wrapped:
+            return self._render_each(template, iterable)
+
+        return self._render_each(self._core_template_, iterable, {
+            '_nunja_data_': 'data-nunja="%s"' % mold_id,
+            '_template_': template,
+            '_wrapper_tag_': wrapper_tag,
+        })
+
+    def _render_each(self, template, iterable, variables=None):
+        """
+        Render the template with every data from the iterable, with the
+        variables layered over the data.
+        """
+
+        if ChainMap is None or getattr(self.env, 'is_async', False):
+            for data in iterable:
+                if variables:
+                    yield template.render(data, **variables)
+                else:
+                    yield template.render(data)
+            return
+
+        # like _execute, the context is built directly from the layers,
+        # without copying every data.
+        layers = (variables,) if variables else ()
+        new_context = template.new_context
+        root_render_func = template.root_render_func
+        template_globals = template.globals
+        for data in iterable:
+            context = new_context(
+                ChainMap(*(layers + (data, template_globals))), shared=True)
+            try:
+                yield u''.join(root_render_func(context))
+            except Exception:
+                self.env.handle_exception()
+
+    def _render_many_pool(
+            self, mold_id, iterable, wrapped, wrapper_tag, processes,
+            chunksize):
+        def batches():
+            batch = []
+            for data in iterable:
+                batch.append(data)
+                if len(batch) >= chunksize:
+                    yield (mold_id, batch, wrapped, wrapper_tag)
+                    batch = []
+            if batch:
+                yield (mold_id, batch, wrapped, wrapper_tag)
+
+        pool = Pool(processes, _render_many_init, (self.registry, {
+            '_wrapper_name': self._wrapper_name,
+            '_required_template_name': self._required_template_name,
+            'production': self.production,
+        }))
+        try:
+            for results in pool.imap(_render_many_worker, batches()):
+                for result in results:
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def render_stream(self, mold_id, data, buffer_size=None, encoding=None):
+        """
+        Render a mold `mold_id` like render, but return a generator that
+        yield the output in chunks, with the buffer_size and encoding
+        arguments applied like execute_stream.
+        """
+
+        template = self.load_mold(mold_id)
+        return buffer_stream(
+            template.generate(**data),
+            buffer_size=buffer_size, encoding=encoding,
+        )
+
 
 class JinjaEngine(object):
     """
     Jinja only engine.
 
     This takes a jinja template registry for use of loading and
-    rendering of templates.
+    rendering of templates.  A MoldRegistry may also be provided, for
+    the rendering of the templates within the molds by their names
+    without the wrapper used by the Engine.
     """
 
-    def __init__(self, registry=JINJA_TEMPLATE_REGISTRY_NAME, env=None):
+    # additional keyword arguments for the default environment.
+    environment_options = {}
+
+    def __init__(
+            self, registry=JINJA_TEMPLATE_REGISTRY_NAME, env=None,
+            bytecode_cache=None, dump=DUMP_BACKEND_AUTO, block_cache=None,
+            auto_reload=True, loader=None, compiled_templates=None):
         """
         By default, the engine can be created without arguments which
         will initialize using the default registry.
@@ -149,22 +618,47 @@ class JinjaEngine(object):
         It is possible to initialize using other arguments, but this is
         unsupported by the main system, and only useful for certain
         specialized implementations.
+
+        The bytecode_cache for the environment may be specified as any
+        value accepted by nunja.cache.get_bytecode_cache.
+
+        The backend for the dump filter may be specified as any value
+        accepted by nunja.dump.get_dump.
+
+        The default environment provides the cache tag through the
+        nunja.cache.CacheExtension, with the block_cache replacing the
+        FragmentCache it uses by default if provided.
+
+        The auto_reload argument determines how the templates are checked
+        for modifications by the loader of the environment created by
+        default, as documented for nunja.loader.NunjaLoader.  The loader
+        may also be replaced, such as by a nunja.archive.ArchiveLoader,
+        and the templates compiled through nunja.compiled may be used
+        through compiled_templates, as documented for Engine.
         """
 
         self.registry = (
             registry
-            if isinstance(registry, JinjaTemplateRegistry) else get(registry)
+            if isinstance(registry, (JinjaTemplateRegistry, MoldRegistry))
+            else get(registry)
         )
+        loader = loader or NunjaLoader(self.registry, auto_reload=auto_reload)
+        if compiled_templates:
+            loader = CompiledLoader(compiled_templates, loader)
         self.env = env if env else Environment(
             autoescape=True,
-            loader=NunjaLoader(self.registry)
+            auto_reload=auto_reload is not False,
+            loader=loader,
+            extensions=[CacheExtension],
+            **self.environment_options
         )
+        if block_cache is not None:
+            self.env.block_cache = block_cache
         # this filter is to match with nunjucks version (which calls
-        # JSON.stringify in JavaScript); construct a partial which is a
-        # callable to json.dumps with default parameters that mimic the
-        # JavaScript version of the called function.
-        self.env.filters['dump'] = partial(
-            json.dumps, sort_keys=True, separators=(',', ':'))
+        # JSON.stringify in JavaScript); see nunja.dump for details.
+        self.env.filters['dump'] = get_dump(dump)
+        if bytecode_cache is not None:
+            self.env.bytecode_cache = get_bytecode_cache(bytecode_cache)
 
     def lookup_path(self, name):
         """
@@ -191,6 +685,54 @@ class JinjaEngine(object):
 
         return self.env.get_template(name)
 
+    def warm_bytecode_cache(self):
+        """
+        Compile all the templates in the registry ahead of time into the
+        bytecode cache of the environment.
+        """
+
+        return warm_bytecode_cache(self.env, self.registry)
+
+    def prewarm(self):
+        """
+        Load and compile every template in the registry.
+
+        Returns the report as produced by nunja.cache.prewarm.  As the
+        compiled templates are kept in the memory of this process, this
+        may be called in the master process before worker processes are
+        forked, such that they will inherit the compiled templates.
+        """
+
+        return prewarm(self.env, self.registry)
+
+    def invalidate(self, mold_id=None):
+        """
+        Invalidate the loaded templates.  As templates may include other
+        templates, the cache of the environment is cleared entirely; the
+        output cached by the cache tags for the templates with the names
+        prefixed by mold_id is also discarded, or all if not specified.
+        """
+
+        if self.env.cache is not None:
+            self.env.cache.clear()
+
+        # invalidate is optional for the block_cache, as only get and set
+        # are required for the cache tag.
+        invalidate = getattr(
+            getattr(self.env, 'block_cache', None), 'invalidate', None)
+        if invalidate is not None:
+            invalidate(mold_id)
+
+    def watch(self):
+        """
+        Watch the directories of the registry for modifications, see
+        Engine.watch.
+        """
+
+        loader = self.env.loader
+        return watch(self.registry, self.invalidate, loader=(
+            loader if isinstance(loader, NunjaLoader) else None))
+
     def render_template(self, name, data):
         """
         Render a template.
@@ -8,6 +8,12 @@ appropriate invocation which is done inside the process function.
 */
 
 var NUNJA_PRECOMP_NS = '__nunja__';
+// the module that provides the precompiled templates that are shared by
+// multiple molds.
+var NUNJA_PRECOMP_SHARED = NUNJA_PRECOMP_NS + '/__shared__';
+// the module that maps the precompiled modules to the names of the
+// templates they provide, like the requirejs bundles configuration.
+var NUNJA_PRECOMP_INDEX = NUNJA_PRECOMP_NS + '/__index__';
 
 var SimpleLoader = function(registry) {
     this.registry = registry;
@@ -47,6 +53,36 @@ var RequireJSLoader = function(registry) {
     // this should trigger typical loading all the time under dev?
     // TODO figure this one out.
     this.noCache = true;
+
+    // set once the shared precompiled module is found to be missing.
+    this.shared_missing = false;
+
+    // the mapping of template names to the precompiled module that
+    // provides them, from the index module; null if it is missing.
+    this.index = undefined;
+};
+
+RequireJSLoader.prototype.loadIndex = function(callback) {
+    var self = this;
+
+    if (self.index !== undefined) {
+        callback(self.index);
+        return;
+    }
+
+    require([NUNJA_PRECOMP_INDEX], function(bundles) {
+        var index = {};
+        Object.keys(bundles).forEach(function(module_name) {
+            bundles[module_name].forEach(function(name) {
+                index[name] = module_name;
+            });
+        });
+        self.index = index;
+        callback(self.index);
+    }, function() {
+        self.index = null;
+        callback(self.index);
+    });
 };
 
 RequireJSLoader.prototype.getSource = function(name, callback) {
@@ -70,7 +106,7 @@ RequireJSLoader.prototype.getSource = function(name, callback) {
         });
     };
 
-    var get_precompiled = function(precompiled) {
+    var from_precompiled = function(precompiled) {
         if (precompiled && precompiled[name]) {
             callback(null, {
                 'src': {
@@ -81,15 +117,57 @@ RequireJSLoader.prototype.getSource = function(name, callback) {
             });
             return true;
         }
-        compile_template();
+        return false;
     };
 
-    if (!require.defined(template_path)) {
-        // require([template_path], process)
-        require([module_name], get_precompiled, function() {
-            // retry with just the template_path
+    var get_shared = function() {
+        if (self.shared_missing) {
+            compile_template();
+            return;
+        }
+        require([NUNJA_PRECOMP_SHARED], function(precompiled) {
+            if (!from_precompiled(precompiled)) {
+                compile_template();
+            }
+        }, function() {
+            // don't bother with trying this again.
+            self.shared_missing = true;
             compile_template();
         });
+    };
+
+    var get_precompiled = function(precompiled) {
+        if (!from_precompiled(precompiled)) {
+            // the template may be provided by the shared module.
+            get_shared();
+        }
+    };
+
+    var get_indexed = function(index) {
+        if (!index) {
+            // without the index, go through the possible modules.
+            require([module_name], get_precompiled, function() {
+                // retry with the shared module, then the template_path
+                get_shared();
+            });
+        }
+        else if (index[name]) {
+            require([index[name]], function(precompiled) {
+                if (!from_precompiled(precompiled)) {
+                    compile_template();
+                }
+            }, function() {
+                compile_template();
+            });
+        }
+        else {
+            // not precompiled, so don't bother with any of the modules.
+            compile_template();
+        }
+    };
+
+    if (!require.defined(template_path)) {
+        self.loadIndex(get_indexed);
     }
     else {
         // it's already loaded, call the callback directly.
@@ -2,6 +2,7 @@
 import codecs
 
 from os.path import getmtime
+from timeit import default_timer
 
 from jinja2.loaders import BaseLoader
 from jinja2.loaders import TemplateNotFound
@@ -9,22 +10,55 @@ from jinja2.loaders import TemplateNotFound
 from .exc import FileNotFoundError
 
 
-def uptodate_checker(filename):
+def uptodate_checker(filename, interval=0, timer=default_timer):
+    """
+    Return a checker for whether the file has not been modified since
+    this was called.  If an interval in seconds is provided, the file
+    will only be checked at most once for that interval, with the file
+    assumed to be unmodified in between.
+    """
+
     mtime = getmtime(filename)
 
-    def checker():
+    def check():
         try:
             return getmtime(filename) == mtime
         except OSError:
             return False
 
+    if not interval:
+        return check
+
+    state = {'next': timer() + interval}
+
+    def checker():
+        now = timer()
+        if now < state['next']:
+            return True
+        state['next'] = now + interval
+        return check()
+
     return checker
 
 
+def always_uptodate():
+    return True
+
+
 class NunjaLoader(BaseLoader):
 
-    def __init__(self, registry):
+    def __init__(self, registry, auto_reload=True, timer=default_timer):
+        """
+        The auto_reload argument determines how the templates are to be
+        checked for modifications; if True, the file for the template
+        will be checked every time, if False, it will never be checked,
+        and if it is a number, the file will be checked at most once for
+        that many seconds.
+        """
+
         self.registry = registry
+        self.auto_reload = auto_reload
+        self.timer = timer
 
     def get_source(self, environment, template):
         try:
@@ -34,4 +68,13 @@ class NunjaLoader(BaseLoader):
 
         with codecs.open(path, encoding='utf-8') as f:
             source = f.read()
-        return source, path, uptodate_checker(path)
+
+        if self.auto_reload is False:
+            return source, path, always_uptodate
+        if self.auto_reload is True:
+            return source, path, uptodate_checker(path)
+        return source, path, uptodate_checker(
+            path, self.auto_reload, self.timer)
+
+    def list_templates(self):
+        return sorted(self.registry.iter_template_names())
@@ -217,6 +217,17 @@ class MoldRegistry(NunjaModuleRegistry):
 
         return result
 
+    def update_mold(self, mold_id, path):
+        """
+        Register the directory at path as the mold `mold_id` if it has
+        the default template, otherwise remove the mold.
+        """
+
+        if exists(join(path, self.req_tmpl_name)):
+            self.molds[mold_id] = path
+        else:
+            self.molds.pop(mold_id, None)
+
     def _entry_point_to_path(self, entry_point):
         return join(resource_filename_mod_entry_point(
             entry_point.module_name, entry_point), entry_point.attrs[0])
@@ -277,6 +288,20 @@ class MoldRegistry(NunjaModuleRegistry):
         return join(path, *subpath)
         # TODO Should a lookup_template be implemented?
 
+    def iter_template_names(self):
+        """
+        Iterate through the names of all the templates provided by the
+        molds in this registry.
+        """
+
+        for mold_id, record in self.iter_records():
+            if mold_id not in self.molds:
+                continue
+            for modname in sorted(record):
+                if (modname.startswith(self.text_prefix) and
+                        modname.endswith(self.fext)):
+                    yield modname[len(self.text_prefix):]
+
     def verify_path(self, mold_id_path):
         """
         Lookup and verify path.
@@ -347,6 +372,24 @@ class JinjaTemplateRegistry(NunjaModuleRegistry):
                 raise
             return default
 
+    def update_template(self, name, path):
+        """
+        Register the file at path as the template `name` if it exists,
+        otherwise remove the template.
+        """
+
+        if exists(path):
+            self.templates[name] = path
+        else:
+            self.templates.pop(name, None)
+
+    def iter_template_names(self):
+        """
+        Iterate through the names of all the templates in this registry.
+        """
+
+        return iter(sorted(self.templates))
+
     def verify_path(self, mold_id_path):
         """
         Lookup and verify path.
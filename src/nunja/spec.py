@@ -1,12 +1,31 @@
 # -*- coding: utf-8 -*-
 import logging
+import json
 import re
 
 import codecs
-from collections import defaultdict
+from collections import OrderedDict
+from hashlib import sha256
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os import fdopen
+from os import makedirs
+from os import remove
+from os import rename
+from shutil import copyfile
 from os.path import dirname
+from os.path import exists
+from os.path import isdir
+from os.path import getsize
 from os.path import join
+from subprocess import Popen
+from subprocess import PIPE
+from tempfile import mkstemp
+from threading import Lock
+from threading import local
+from timeit import default_timer
 
+from calmjs.cli import NodeDriver
 from calmjs.cli import node
 from calmjs.exc import AdviceAbort
 
@@ -18,10 +37,49 @@ except ImportError:  # pragma: no cover
 
 from calmjs.toolchain import BEFORE_COMPILE
 from calmjs.toolchain import BUILD_DIR
+from calmjs.toolchain import EXPORT_TARGET
+from calmjs.utils import finalize_env
 from calmjs.utils import json_dumps
 
+from nunja.analysis import build_reference_graph
+from nunja.analysis import find_reachable
+from nunja.analysis import find_shared
+
 # TODO figure out where to stash this value
 NUNJA_PRECOMP_NS = '__nunja__'
+# spec key for selecting the precompile backend, with the value being
+# one of the following backend names.
+NUNJA_PRECOMP_BACKEND = 'nunja_precompile_backend'
+NUNJA_PRECOMP_BACKEND_WORKER = 'worker'
+NUNJA_PRECOMP_BACKEND_PROCESS = 'process'
+# spec key for the number of concurrent precompile jobs; a value of 0
+# will use the number of available CPUs.
+NUNJA_PRECOMP_JOBS = 'nunja_precompile_jobs'
+# spec key for the directory for caching of the precompiled templates.
+NUNJA_PRECOMP_CACHE_DIR = 'nunja_precompile_cache_dir'
+# the name of the manifest file written to the build directory, which
+# records the inputs of every precompiled mold for incremental builds.
+NUNJA_PRECOMP_MANIFEST = 'nunja_precompile_manifest.json'
+# the name of the report on the precompilation written to the build
+# directory, listing the time taken and size of every template and mold.
+NUNJA_PRECOMP_REPORT = 'nunja_precompile_report.json'
+# spec key for enabling the pruning of templates that are not reachable
+# from the default template of any of the molds.
+NUNJA_PRECOMP_PRUNE = 'nunja_precompile_prune'
+# spec key for enabling the splitting of templates referenced by multiple
+# molds into the shared module, which will be identified by the id.
+NUNJA_PRECOMP_SHARED = 'nunja_precompile_shared'
+NUNJA_PRECOMP_SHARED_ID = '__shared__'
+# the id for the module that maps the precompiled modules to the names of
+# the templates that they provide.
+NUNJA_PRECOMP_INDEX_ID = '__index__'
+# spec key for enabling the lazy loading of the precompiled molds for
+# webpack, and the directory where the scripts are to be written to,
+# which defaults to the directory of the export_target.  The module with
+# the id provides the mapping of the molds to the scripts.
+NUNJA_PRECOMP_LAZY = 'nunja_precompile_lazy'
+NUNJA_PRECOMP_LAZY_DIR = 'nunja_precompile_lazy_dir'
+NUNJA_PRECOMP_LAZY_ID = '__lazy__'
 nunjucks_nja_patt = re.compile(
     '^text!(?P<name>(?P<mold_id>[^!\\/]+\\/[^!\\/]+)\\/[^!]*\\.nja)$')
 
@@ -32,10 +90,20 @@ def to_hex(s):
     return codecs.encode(s.encode('utf8'), 'hex_codec').decode('utf8')
 
 
+# The source for creating the nunjucks environment that provides the
+# extensions from nunja/cache.js for precompiling, such that the tags
+# provided by those will be understood.
+nunjucks_env_js = (
+    'var env = require(%s).install(new nunjucks.Environment([]));\n' %
+    json_dumps(join(dirname(__file__), 'cache.js'))
+)
+
+
 def nunjucks_precompile(path, name):
-    require_stmt = 'var nunjucks = require("nunjucks");\n'
+    require_stmt = 'var nunjucks = require("nunjucks");\n' + nunjucks_env_js
     stdout, stderr = node(
-        '%sprocess.stdout.write(nunjucks.precompile(%s, {"name": %s}));'
+        '%sprocess.stdout.write(nunjucks.precompile(%s, '
+        '{"name": %s, "env": env}));'
         % (require_stmt, json_dumps(path), json_dumps(name))
     )
     if stderr:
@@ -45,6 +113,595 @@ def nunjucks_precompile(path, name):
         return stdout
 
 
+# The source for the long-lived node process; requests are the JSON
+# encoded [path, name] pairs, one per line, and every response is also
+# a single line of JSON, with the very first line being a header that
+# reports the version of nunjucks (or the error if it cannot be loaded).
+nunjucks_precompile_worker_js = """
+var write = function(obj) {
+    process.stdout.write(JSON.stringify(obj) + '\\n');
+};
+
+var nunjucks;
+try {
+    nunjucks = require('nunjucks');
+}
+catch (e) {
+    write({'error': String(e.stack || e)});
+    process.exit(1);
+}
+
+var version = null;
+try {
+    version = require('nunjucks/package.json').version;
+}
+catch (e) {
+}
+write({'version': version});
+""" + nunjucks_env_js + """
+require('readline').createInterface({
+    'input': process.stdin,
+    'terminal': false,
+}).on('line', function(line) {
+    var request = JSON.parse(line);
+    try {
+        write({'code': nunjucks.precompile(
+            request[0], {'name': request[1], 'env': env})});
+    }
+    catch (e) {
+        write({'error': String(e.stack || e)});
+    }
+});
+"""
+
+
+class NunjucksPrecompileWorker(object):
+    """
+    A long-lived node process for precompiling nunjucks templates.
+
+    Rather than paying for the startup of node and the loading of the
+    nunjucks module for every single template like what the function
+    nunjucks_precompile does, the template paths and names are streamed
+    to a single worker process.  Should the worker fail to start or die
+    unexpectedly, the per-process nunjucks_precompile will be used for
+    the remaining templates.
+
+    Instances are callable with the same signature and return values as
+    the nunjucks_precompile function.
+    """
+
+    def __init__(self, driver=None):
+        self.driver = driver or NodeDriver()
+        self.process = None
+        self.version = None
+        self.failed = False
+
+    def start(self):
+        """
+        Start the worker process.  Returns True if the worker is ready
+        for precompiling templates.
+        """
+
+        binary = self.driver.which()
+        if binary is None:
+            logger.warning(
+                'failed to start precompile worker: %s not found',
+                self.driver.binary,
+            )
+            return self._fail()
+
+        env = {}
+        if self.driver.node_path is not None:
+            env['NODE_PATH'] = self.driver.node_path
+        try:
+            self.process = Popen([
+                binary, '-e', nunjucks_precompile_worker_js,
+            ], stdin=PIPE, stdout=PIPE, env=finalize_env(env),
+                cwd=self.driver.working_dir or None)
+        except (IOError, OSError) as e:
+            logger.warning('failed to start precompile worker: %s', e)
+            return self._fail()
+
+        header = self._read()
+        if header is None or 'error' in header:
+            logger.warning(
+                'precompile worker failed to initialize: %s',
+                (header or {}).get('error', 'no output'),
+            )
+            return self._fail()
+
+        self.version = header.get('version')
+        logger.debug(
+            'precompile worker started with nunjucks version %s',
+            self.version,
+        )
+        return True
+
+    def _fail(self):
+        self.close()
+        self.failed = True
+        logger.warning(
+            'falling back to one node process per template for '
+            'precompilation'
+        )
+        return False
+
+    def _read(self):
+        line = self.process.stdout.readline()
+        if not line:
+            return None
+        return json.loads(line.decode('utf8'))
+
+    def __call__(self, path, name):
+        if self.failed or (self.process is None and not self.start()):
+            return nunjucks_precompile(path, name)
+
+        request = json.dumps([path, name]) + '\n'
+        try:
+            self.process.stdin.write(request.encode('utf8'))
+            self.process.stdin.flush()
+            response = self._read()
+        except (IOError, OSError):
+            response = None
+
+        if response is None:
+            logger.warning(
+                "precompile worker terminated while processing '%s'", path)
+            self._fail()
+            return nunjucks_precompile(path, name)
+
+        if 'error' in response:
+            logger.error(
+                "failed to precompile '%s'\n%s'", path, response['error'])
+            return None
+        return response['code']
+
+    def close(self):
+        """
+        Terminate the worker process.
+        """
+
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except (IOError, OSError):  # pragma: no cover
+            pass
+        process.stdout.close()
+        process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_nunjucks_version(driver=None):
+    """
+    Return the version of the nunjucks package that node will resolve
+    for the driver, without having to invoke node.  Returns None if it
+    cannot be found.
+    """
+
+    driver = driver or NodeDriver()
+    for basedir in driver.find_node_modules_basedir():
+        target = join(basedir, 'nunjucks', 'package.json')
+        if not exists(target):
+            continue
+        try:
+            with codecs.open(target, encoding='utf8') as fd:
+                return json.load(fd).get('version')
+        except (IOError, OSError, ValueError):
+            logger.warning("failed to read version from '%s'", target)
+    return None
+
+
+def precompile_key(path, name, version):
+    """
+    Generate the key for the precompiled output of the template at path
+    for the provided name and version of nunjucks.
+    """
+
+    with open(path, 'rb') as fd:
+        source = fd.read()
+    digest = sha256()
+    for value in (version, name):
+        digest.update(value.encode('utf8'))
+        digest.update(b'\0')
+    digest.update(source)
+    return digest.hexdigest()
+
+
+class PrecompileCache(object):
+    """
+    A content-addressed cache for precompiled templates, stored in a
+    plain directory that may be shared by multiple builds.
+    """
+
+    def __init__(self, cache_dir, version):
+        self.cache_dir = cache_dir
+        self.version = version
+
+    def key(self, path, name):
+        return precompile_key(path, name, self.version)
+
+    def path(self, key):
+        return join(self.cache_dir, key[:2], key + '.js')
+
+    def get(self, key):
+        """
+        Return the cached precompiled output for key, or None.
+        """
+
+        try:
+            with codecs.open(self.path(key), encoding='utf8') as fd:
+                return fd.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, code):
+        """
+        Store the precompiled code under key.
+
+        The entry is written to a temporary file and then renamed to its
+        final location, such that concurrent builds sharing the same
+        directory will never see a partially written entry.
+        """
+
+        target = self.path(key)
+        target_dir = dirname(target)
+        try:
+            if not exists(target_dir):
+                makedirs(target_dir)
+        except OSError:
+            # may have been created concurrently
+            if not exists(target_dir):
+                logger.warning(
+                    "failed to create cache directory '%s'", target_dir)
+                return
+
+        try:
+            fd, tmp = mkstemp(dir=target_dir, suffix='.tmp')
+        except OSError as e:
+            logger.warning(
+                "failed to create cache entry in '%s': %s", target_dir, e)
+            return
+
+        try:
+            with fdopen(fd, 'wb') as stream:
+                stream.write(code.encode('utf8'))
+        except (IOError, OSError) as e:
+            logger.warning("failed to write cache entry '%s': %s", tmp, e)
+            try:
+                remove(tmp)
+            except OSError:
+                pass
+            return
+
+        try:
+            rename(tmp, target)
+        except OSError:
+            # the target already existed for certain platforms; the
+            # content would have been identical anyway.
+            remove(tmp)
+
+
+class CachedPrecompiler(object):
+    """
+    Wraps a precompiler such that the precompiled results are served
+    from the provided cache whenever possible.
+    """
+
+    def __init__(self, precompiler, cache):
+        self.precompiler = precompiler
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, path, name):
+        try:
+            key = self.cache.key(path, name)
+        except (IOError, OSError):
+            # let the underlying precompiler report the problem.
+            return self.precompiler(path, name)
+
+        code = self.cache.get(key)
+        if code is not None:
+            self.hits += 1
+            return code
+
+        self.misses += 1
+        code = self.precompiler(path, name)
+        if code:
+            self.cache.set(key, code)
+        return code
+
+    def close(self):
+        logger.debug(
+            'precompile cache had %d hits and %d misses',
+            self.hits, self.misses,
+        )
+        close = getattr(self.precompiler, 'close', None)
+        if close:
+            close()
+
+
+def get_precompiler(spec):
+    """
+    Return the precompiler as selected by the spec.
+    """
+
+    backend = spec.get(NUNJA_PRECOMP_BACKEND, NUNJA_PRECOMP_BACKEND_WORKER)
+    if backend == NUNJA_PRECOMP_BACKEND_PROCESS:
+        precompiler = nunjucks_precompile
+    else:
+        if backend != NUNJA_PRECOMP_BACKEND_WORKER:
+            logger.warning(
+                "unknown precompile backend '%s'; using '%s'",
+                backend, NUNJA_PRECOMP_BACKEND_WORKER,
+            )
+        precompiler = NunjucksPrecompileWorker()
+
+    cache_dir = spec.get(NUNJA_PRECOMP_CACHE_DIR)
+    if not cache_dir:
+        return precompiler
+
+    version = get_nunjucks_version()
+    if version is None:
+        logger.warning(
+            'cannot determine the version of nunjucks; precompile cache '
+            "at '%s' will not be used", cache_dir,
+        )
+        return precompiler
+
+    return CachedPrecompiler(precompiler, PrecompileCache(cache_dir, version))
+
+
+def get_precompile_jobs(spec):
+    """
+    Return the number of concurrent precompile jobs specified by spec.
+    """
+
+    value = spec.get(NUNJA_PRECOMP_JOBS, 1)
+    try:
+        jobs = int(value)
+    except (TypeError, ValueError):
+        logger.warning(
+            "invalid value '%s' for '%s'; precompiling serially",
+            value, NUNJA_PRECOMP_JOBS,
+        )
+        return 1
+    if jobs < 1:
+        return cpu_count()
+    return jobs
+
+
+def timed_precompile(precompiler, path, name):
+    """
+    Return a 2-tuple of the result of precompiler along with the time
+    taken in seconds.
+    """
+
+    start = default_timer()
+    result = precompiler(path, name)
+    return result, default_timer() - start
+
+
+def iter_precompiled(spec, templates):
+    """
+    Precompile the templates, which is a list of (path, name) tuples,
+    and yield the results along with the time taken for each of them as
+    2-tuples, in the same order as the input, such that the output stay
+    identical regardless of the number of jobs.
+
+    If more than one job is specified, the templates will be fanned out
+    to a pool of threads, with each one driving its own precompiler.
+    As the actual work is done by the node processes, threads are used
+    to avoid the cost of forking the build process itself.
+    """
+
+    jobs = min(get_precompile_jobs(spec), len(templates))
+    precompilers = []
+    pool = None
+
+    if jobs <= 1:
+        precompiler = get_precompiler(spec)
+        precompilers.append(precompiler)
+        results = (
+            timed_precompile(precompiler, path, name)
+            for path, name in templates
+        )
+    else:
+        thread_local = local()
+        lock = Lock()
+
+        def precompile(template):
+            precompiler = getattr(thread_local, 'precompiler', None)
+            if precompiler is None:
+                precompiler = thread_local.precompiler = get_precompiler(spec)
+                with lock:
+                    precompilers.append(precompiler)
+            return timed_precompile(precompiler, *template)
+
+        logger.debug('precompiling templates using %d jobs', jobs)
+        pool = ThreadPool(jobs)
+        results = pool.imap(precompile, templates)
+
+    try:
+        for result in results:
+            yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for precompiler in precompilers:
+            close = getattr(precompiler, 'close', None)
+            if close:
+                close()
+
+
+def fingerprint_templates(templates, version):
+    """
+    Produce the list of [modname, path, key] for the list of templates,
+    which is a list of (modname, path, name) tuples.  Returns None if
+    any of the templates cannot be read.
+    """
+
+    try:
+        return [
+            [modname, path, precompile_key(path, name, version or '')]
+            for modname, path, name in templates
+        ]
+    except (IOError, OSError):
+        return None
+
+
+def load_manifest(build_dir, version):
+    """
+    Load the molds recorded by the manifest in the build directory, if
+    it was produced using the same version of nunjucks.
+    """
+
+    target = join(build_dir, NUNJA_PRECOMP_MANIFEST)
+    if not exists(target):
+        return {}
+
+    try:
+        with codecs.open(target, encoding='utf8') as fd:
+            manifest = json.load(fd)
+    except (IOError, OSError, ValueError):
+        logger.warning("ignoring unreadable manifest at '%s'", target)
+        return {}
+
+    if manifest.get('nunjucks') != version:
+        logger.debug(
+            "ignoring manifest at '%s' as it was produced using a different "
+            "version of nunjucks", target,
+        )
+        return {}
+    return manifest.get('molds', {})
+
+
+def write_manifest(build_dir, version, molds):
+    target = join(build_dir, NUNJA_PRECOMP_MANIFEST)
+    with codecs.open(target, 'w', encoding='utf8') as fd:
+        json.dump({
+            'nunjucks': version,
+            'molds': molds,
+        }, fd, indent=4, sort_keys=True)
+
+
+def write_report(build_dir, report):
+    """
+    Write the report to the build directory and log a short summary.
+    """
+
+    templates = [
+        (details['time'], name)
+        for mold in report['molds'].values()
+        for name, details in mold['templates'].items()
+    ]
+    logger.info(
+        'precompiled %d templates into %d molds totalling %d bytes in '
+        '%.3f seconds',
+        len(templates), len(report['molds']),
+        sum(mold['size'] for mold in report['molds'].values()),
+        report['time'],
+    )
+    if templates:
+        elapsed, name = max(templates)
+        logger.info(
+            "slowest template was '%s' at %.3f seconds", name, elapsed)
+
+    target = join(build_dir, NUNJA_PRECOMP_REPORT)
+    with codecs.open(target, 'w', encoding='utf8') as fd:
+        json.dump(report, fd, indent=4, sort_keys=True)
+
+
+def build_mold_templates_graph(mold_templates):
+    """
+    Build the reference graph for mold_templates, which is a mapping of
+    the mold_id to the list of (modname, path, name) of its templates.
+    """
+
+    return build_reference_graph({
+        name: path
+        for templates in mold_templates.values()
+        for modname, path, name in templates
+    })
+
+
+def prune_unreachable(mold_templates, graph):
+    """
+    Remove the templates that cannot be reached from the default template
+    of any of the molds in the reference graph from mold_templates.
+
+    Returns the list of modnames that were pruned.
+    """
+
+    reachable = find_reachable(graph)
+
+    pruned = []
+    for mold_id in list(mold_templates):
+        templates = mold_templates[mold_id]
+        pruned.extend(
+            modname for modname, path, name in templates
+            if name not in reachable
+        )
+        templates = [
+            template for template in templates if template[2] in reachable]
+        if templates:
+            mold_templates[mold_id] = templates
+        else:
+            mold_templates.pop(mold_id)
+    return pruned
+
+
+def split_shared(mold_templates, graph):
+    """
+    Move the templates that are referenced by multiple molds in the
+    reference graph from their molds in mold_templates to the shared
+    module.
+
+    Returns the list of modnames that were moved.
+    """
+
+    shared = find_shared(graph)
+    shared_templates = []
+    for mold_id in list(mold_templates):
+        templates = mold_templates[mold_id]
+        shared_templates.extend(
+            template for template in templates if template[2] in shared)
+        templates = [
+            template for template in templates if template[2] not in shared]
+        if templates:
+            mold_templates[mold_id] = templates
+        else:
+            mold_templates.pop(mold_id)
+
+    if shared_templates:
+        mold_templates[NUNJA_PRECOMP_SHARED_ID] = shared_templates
+    return [modname for modname, path, name in shared_templates]
+
+
+def apply_extras(spec, extras):
+    """
+    Apply the extras that configure the precompile process to the spec.
+    """
+
+    for key in extras:
+        if key.startswith('jobs_'):
+            spec[NUNJA_PRECOMP_JOBS] = key.split('_', 1)[1]
+        elif key == 'prune':
+            spec[NUNJA_PRECOMP_PRUNE] = True
+        elif key == 'shared':
+            spec[NUNJA_PRECOMP_SHARED] = True
+        elif key == 'lazy':
+            spec[NUNJA_PRECOMP_LAZY] = True
+
+
 def precompile_nunja(
         spec, slim,
         base_sourcepath_key, bundle_sourcepath_key, omit_paths=()):
@@ -60,10 +717,13 @@ def precompile_nunja(
                 sorted(missing)))
 
     base_sourcepath = spec[base_sourcepath_key]
+    build_dir = spec[BUILD_DIR]
     precompiled_modnames = []
-    molds = defaultdict(list)
     slim_bundle_modnames = []
 
+    # the list of (modname, path, name) for each of the mold_id.
+    mold_templates = OrderedDict()
+
     for modname, path in base_sourcepath.items():
         # could express this more succinctly with regex, probably
         if path in omit_paths:
@@ -74,43 +734,291 @@ def precompile_nunja(
             logger.debug("'%s' is an incompatible nunja template name", path)
             continue
 
-        mold = nunjucks_precompile(path, match.group('name'))
-        if mold:
-            molds[match.group('mold_id')].append(mold)
+        mold_templates.setdefault(match.group('mold_id'), []).append(
+            (modname, path, match.group('name')))
+
+    pruned_modnames = []
+    if spec.get(NUNJA_PRECOMP_PRUNE) or spec.get(NUNJA_PRECOMP_SHARED):
+        graph = build_mold_templates_graph(mold_templates)
+
+    if spec.get(NUNJA_PRECOMP_PRUNE):
+        pruned_modnames = prune_unreachable(mold_templates, graph)
+        logger.info(
+            'pruned %d templates unreachable from the default template of '
+            'any mold', len(pruned_modnames),
+        )
+
+    if spec.get(NUNJA_PRECOMP_SHARED):
+        logger.info(
+            'moved %d templates referenced by multiple molds to the shared '
+            'module', len(split_shared(mold_templates, graph)),
+        )
+
+    # figure out which of the molds recorded by the manifest from the
+    # previous build are still current, such that they are reused.
+    version = get_nunjucks_version()
+    recorded = load_manifest(build_dir, version)
+    manifest = {}
+    current = set()
+    for mold_id, templates in mold_templates.items():
+        fingerprints = fingerprint_templates(templates, version)
+        if fingerprints is None:
+            continue
+        manifest[mold_id] = {
+            'target': to_hex(mold_id) + '.js',
+            'templates': fingerprints,
+        }
+        if (recorded.get(mold_id) == manifest[mold_id] and
+                exists(join(build_dir, manifest[mold_id]['target']))):
+            current.add(mold_id)
+
+    if current:
+        logger.info(
+            'reusing %d of %d precompiled molds from previous build',
+            len(current), len(mold_templates),
+        )
+
+    matches = [
+        (mold_id, template)
+        for mold_id, templates in mold_templates.items()
+        if mold_id not in current
+        for template in templates
+    ]
+    start = default_timer()
+    results = iter_precompiled(spec, [
+        (path, name) for mold_id, (modname, path, name) in matches])
+
+    failed = set()
+    written = set()
+    # the names of the templates provided by each of the molds.
+    provided = {}
+    report = {'molds': {}}
+    # as the templates are grouped by their mold, the output for each
+    # mold can be streamed into its bundle as they become available, one
+    # mold at a time, rather than holding on to all of them in memory.
+    fd = None
+    try:
+        for (mold_id, (modname, path, name)), (mold, elapsed) in zip(
+                matches, results):
+            report['molds'].setdefault(mold_id, {
+                'reused': False,
+                'size': 0,
+                'templates': {},
+            })['templates'][name] = {
+                'time': elapsed,
+                'size': len(mold.encode('utf8')) if mold else None,
+            }
+            if not mold:
+                failed.add(mold_id)
+                continue
+            if mold_id not in written:
+                if fd is not None:
+                    fd.close()
+                # use a surrogate name as the bundle process in calmjs
+                # will copy that into the final location.
+                fd = codecs.open(
+                    join(build_dir, to_hex(mold_id) + '.js'), 'w',
+                    encoding='utf8')
+                written.add(mold_id)
+            fd.write(mold)
             precompiled_modnames.append(modname)
+            provided.setdefault(mold_id, []).append(name)
+    finally:
+        if fd is not None:
+            fd.close()
+    report['time'] = default_timer() - start
 
-    for mold_id, precompiled in molds.items():
-        # use a surrogate name as the bundle process in calmjs will
-        # copy that into the final location.
-        f = join(spec['build_dir'], to_hex(mold_id) + '.js')
-        with codecs.open(f, 'w', encoding='utf8') as fd:
-            for stdout in precompiled:
-                fd.write(stdout)
+    # the mapping of the precompiled modules to the names of templates
+    # provided by each of them.
+    bundles = {}
+    for mold_id, templates in mold_templates.items():
+        f = join(build_dir, to_hex(mold_id) + '.js')
+        if mold_id in current:
+            precompiled_modnames.extend(
+                modname for modname, path, name in templates)
+            provided[mold_id] = [name for modname, path, name in templates]
+            report['molds'][mold_id] = {
+                'reused': True,
+                'templates': {},
+            }
+        elif mold_id not in written:
+            continue
+        report['molds'][mold_id]['size'] = getsize(f)
         modname = '/'.join([NUNJA_PRECOMP_NS, mold_id])
         slim_bundle_modnames.append(modname)
         spec[bundle_sourcepath_key][modname] = f
+        bundles[modname] = provided[mold_id]
+
+    # only record the molds that are completely precompiled, such that
+    # the failures will be reported again on the subsequent build.
+    if mold_templates:
+        write_manifest(build_dir, version, {
+            mold_id: record for mold_id, record in manifest.items()
+            if mold_id not in failed
+        })
+        write_report(build_dir, report)
 
     if slim:
-        for modname in precompiled_modnames:
+        # the pruned templates are also removed, as they are not going
+        # to be usable without the full nunjucks runtime anyway.
+        for modname in precompiled_modnames + pruned_modnames:
             base_sourcepath.pop(modname)
         nunjucks_path = spec[bundle_sourcepath_key].get('nunjucks')
         if nunjucks_path and nunjucks_path not in omit_paths:
             spec[bundle_sourcepath_key]['nunjucks'] = join(
                 dirname(nunjucks_path), 'nunjucks-slim.js')
 
-    return slim_bundle_modnames,
+    return slim_bundle_modnames, bundles
+
+
+def write_data_module(build_dir, module_id, data):
+    """
+    Write out a module that simply provides the data, for the module_id
+    under the precompiled namespace.  Returns the path to the module.
+    """
+
+    target = join(build_dir, to_hex(module_id) + '.js')
+    with codecs.open(target, 'w', encoding='utf8') as fd:
+        fd.write('define([], function() {\n    return ')
+        fd.write(json.dumps(data, sort_keys=True, indent=4).replace(
+            '\n', '\n    '))
+        fd.write(';\n});\n')
+    return target
 
 
 def precompile_nunja_rjs(spec, slim=False):
-    slim_bundle_modnames = precompile_nunja(
+    slim_bundle_modnames, bundles = precompile_nunja(
         spec, slim, 'plugin_sourcepath', 'bundle_sourcepath',
         omit_paths=(EMPTY,)
-    )[0]
+    )
 
     shim = spec['shim'] = spec.get('shim', {})
     for modname in slim_bundle_modnames:
         shim[modname] = {'exports': 'nunjucksPrecompiled'}
 
+    # the loader will use the index to go directly to the module that
+    # provides the template, or straight to the raw template otherwise;
+    # the index is in the same form as the bundles config for requirejs.
+    if bundles:
+        spec['bundle_sourcepath'][
+            '/'.join([NUNJA_PRECOMP_NS, NUNJA_PRECOMP_INDEX_ID])
+        ] = write_data_module(spec[BUILD_DIR], NUNJA_PRECOMP_INDEX_ID, bundles)
+
+
+def find_lazy_dependencies(bundles, graph):
+    """
+    Return the mapping of the modnames in bundles to the list of other
+    modnames in bundles that provide the templates which may be reached
+    from the templates of the modname through the reference graph.
+    """
+
+    providers = {
+        name: modname
+        for modname, names in bundles.items()
+        for name in names
+    }
+    dependencies = {}
+    for modname, names in bundles.items():
+        dependencies[modname] = sorted({
+            providers[name] for name in find_reachable(graph, roots=names)
+            if name in providers
+        }.difference([modname]))
+    return dependencies
+
+
+def split_lazy(spec, modnames, bundle_sourcepath_key, bundles=None,
+               graph=None):
+    """
+    Move the precompiled modules for the molds out of the bundle and
+    into standalone scripts, such that they may be loaded on demand by
+    the engine through the generated lazy module.  The shared module is
+    left in the bundle as it may be required by any of the molds.
+
+    The generated module maps each mold_id to the list of the paths of
+    the scripts to be loaded for it, relative to the lazy directory:
+    the script for the mold, followed by the scripts for the other molds
+    that provide the templates its templates may reference, as found
+    through the reference graph for the templates provided by bundles.
+
+    Returns the generated mapping.
+    """
+
+    lazy_dir = spec.get(NUNJA_PRECOMP_LAZY_DIR)
+    if not lazy_dir:
+        if not spec.get(EXPORT_TARGET):
+            logger.warning(
+                "unable to load precompiled molds lazily as neither '%s' "
+                "nor '%s' is specified", NUNJA_PRECOMP_LAZY_DIR, EXPORT_TARGET,
+            )
+            return {}
+        lazy_dir = dirname(spec[EXPORT_TARGET])
+
+    bundle_sourcepath = spec[bundle_sourcepath_key]
+    scripts = {}
+    for modname in modnames:
+        mold_id = modname[len(NUNJA_PRECOMP_NS) + 1:]
+        if mold_id == NUNJA_PRECOMP_SHARED_ID:
+            continue
+        scripts[modname] = modname + '.js'
+        target = join(lazy_dir, *scripts[modname].split('/'))
+        if not isdir(dirname(target)):
+            makedirs(dirname(target))
+        copyfile(bundle_sourcepath.pop(modname), target)
+
+    dependencies = (
+        find_lazy_dependencies(bundles, graph)
+        if bundles and graph is not None else {}
+    )
+    lazy_molds = {}
+    for modname, script in scripts.items():
+        lazy_molds[modname[len(NUNJA_PRECOMP_NS) + 1:]] = [script] + [
+            scripts[dependency]
+            for dependency in dependencies.get(modname, ())
+            if dependency in scripts
+        ]
+
+    if lazy_molds:
+        logger.info(
+            "precompiled molds will be loaded lazily from %d scripts "
+            "written to '%s'", len(lazy_molds), lazy_dir,
+        )
+        bundle_sourcepath['/'.join([
+            NUNJA_PRECOMP_NS, NUNJA_PRECOMP_LAZY_ID])] = write_data_module(
+                spec[BUILD_DIR], NUNJA_PRECOMP_LAZY_ID, lazy_molds)
+    return lazy_molds
+
+
+def build_sourcepath_graph(sourcepath):
+    """
+    Build the reference graph for the nunja templates in sourcepath.
+    """
+
+    return build_reference_graph({
+        match.group('name'): path
+        for match, path in (
+            (nunjucks_nja_patt.match(modname), path)
+            for modname, path in sourcepath.items()
+        )
+        if match
+    })
+
+
+def precompile_nunja_webpack(spec, slim=False):
+    graph = None
+    if spec.get(NUNJA_PRECOMP_LAZY):
+        # the templates may be removed from the sourcepath when slim.
+        graph = build_sourcepath_graph(spec.get('loaderplugin_sourcepath', {}))
+
+    slim_bundle_modnames, bundles = precompile_nunja(
+        spec, slim, 'loaderplugin_sourcepath', 'bundle_sourcepath',
+    )
+
+    if spec.get(NUNJA_PRECOMP_LAZY):
+        split_lazy(
+            spec, slim_bundle_modnames, 'bundle_sourcepath',
+            bundles=bundles, graph=graph,
+        )
+
 
 def rjs(spec, extras):
     if 'raw' in extras:
@@ -118,6 +1026,7 @@ def rjs(spec, extras):
             'nunja will be skipping precompilation for rjs toolchain')
         return
     slim = 'slim' in extras
+    apply_extras(spec, extras)
     spec.advise(BEFORE_COMPILE, precompile_nunja_rjs, spec, slim)
 
 
@@ -126,7 +1035,5 @@ def webpack(spec, extras):
         logger.warning(
             'nunja cannot skip precompilation for webpack toolchain')
     slim = 'slim' in extras
-    spec.advise(
-        BEFORE_COMPILE, precompile_nunja,
-        spec, slim, 'loaderplugin_sourcepath', 'bundle_sourcepath',
-    )
+    apply_extras(spec, extras)
+    spec.advise(BEFORE_COMPILE, precompile_nunja_webpack, spec, slim)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the rendering through the engine.
+
+These can be executed as a script, for example::
+
+    $ python -m nunja.testing.benchmark render_many
+"""
+
+import sys
+from subprocess import check_call
+from timeit import default_timer
+
+from nunja.testing import model
+
+
+def table_row_data(count):
+    """
+    Return a list of count data sets for the table mold, each with a
+    single row.
+    """
+
+    return [model.DummyTableData([
+        ['id', 'Id'],
+        ['name', 'Given Name'],
+    ], [
+        [str(i), 'Name %d' % i],
+    ]).to_jsonable() for i in range(count)]
+
+
+def best_of(repeat, f):
+    """
+    Return the lowest time taken for the function f from repeat runs.
+    """
+
+    results = []
+    for i in range(repeat):
+        start = default_timer()
+        f()
+        results.append(default_timer() - start)
+    return min(results)
+
+
+def bench_render_many(
+        engine=None, mold_id='nunja.molds/table', datasets=None, count=2000,
+        repeat=3, processes=None):
+    """
+    Compare the rendering of the mold for every data set through the
+    render method in a loop against the render_many method.  Returns a
+    dict with the best time taken for each in seconds.
+    """
+
+    if engine is None:
+        from nunja.engine import Engine
+        engine = Engine()
+    datasets = table_row_data(count) if datasets is None else datasets
+
+    results = {
+        'loop': best_of(repeat, lambda: [
+            engine.render(mold_id, data) for data in datasets]),
+        'render_many': best_of(repeat, lambda: list(
+            engine.render_many(mold_id, datasets))),
+    }
+    if processes:
+        results['render_many_processes'] = best_of(repeat, lambda: list(
+            engine.render_many(mold_id, datasets, processes=processes)))
+    return results
+
+
+def bench_import(repeat=3):
+    """
+    Compare the time taken by a new Python process that imports
+    nunja.core against one that also makes use of the default engine,
+    which is constructed on first use.  Returns a dict with the best
+    time taken for each in seconds.
+    """
+
+    def run(source):
+        return lambda: check_call([sys.executable, '-c', source])
+
+    return {
+        'import': best_of(repeat, run('import nunja.core')),
+        'import_and_engine': best_of(repeat, run(
+            'import nunja.core; nunja.core.engine.registry')),
+    }
+
+
+benchmarks = {
+    'import': bench_import,
+    'render_many': bench_render_many,
+}
+
+
+def main(args=None):
+    names = (sys.argv[1:] if args is None else args) or sorted(benchmarks)
+    for name in names:
+        for label, value in sorted(benchmarks[name]().items()):
+            sys.stdout.write('%s: %s: %.6f\n' % (name, label, value))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
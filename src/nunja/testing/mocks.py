@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import sys
+from os import chdir
+from os import makedirs
 from os import mkdir
 from os import utime
 from os.path import join
@@ -9,8 +11,43 @@ import pkg_resources
 from pkg_resources import resource_filename
 from pkg_resources import Requirement
 
+from calmjs.testing.utils import mkdtemp
 from calmjs.testing.utils import mkdtemp_singleton
 from calmjs.testing.utils import make_dummy_dist
+from calmjs.testing.utils import remember_cwd
+
+# A stand-in for the real nunjucks module, for testing the precompile
+# process without needing the actual package to be installed.  Sources
+# that contain the ``{%World%}`` tag will be treated as invalid.
+fake_nunjucks_js = """
+var fs = require('fs');
+
+var Environment = function() {
+    this.extensions = {};
+};
+
+Environment.prototype.addExtension = function(name, extension) {
+    this.extensions[name] = extension;
+};
+
+exports.Environment = Environment;
+
+exports.precompile = function(path, opts) {
+    var src = fs.readFileSync(path, 'utf8');
+    if (src.indexOf('{%World%}') >= 0) {
+        throw new Error('Template render error: (' + opts.name + ')');
+    }
+    if (src.indexOf('{% cache ') >= 0 &&
+            !(opts.env && opts.env.extensions.CacheExtension)) {
+        throw new Error('unknown block tag: cache (' + opts.name + ')');
+    }
+    return (
+        '(function() {(window.nunjucksPrecompiled = ' +
+        'window.nunjucksPrecompiled || {})[' + JSON.stringify(opts.name) +
+        '] = ' + JSON.stringify(src) + ';})();\\n'
+    );
+};
+"""
 
 
 class MockResourceManager(object):
@@ -188,3 +225,26 @@ def setup_testing_mold_templates_registry(testcase_inst):
     })
 
     return MoldRegistry('nunja.mold', _working_set=working_set)
+
+
+def setup_fake_nunjucks(testcase_inst, version='0.0.0'):
+    """
+    Set up a working directory with a fake nunjucks node module and
+    change into it for the duration of the test.
+
+    Return the path to that working directory.
+    """
+
+    root = mkdtemp(testcase_inst)
+    target = join(root, 'node_modules', 'nunjucks')
+    makedirs(target)
+
+    with open(join(target, 'package.json'), 'w') as fd:
+        fd.write('{"name": "nunjucks", "version": "%s"}' % version)
+
+    with open(join(target, 'index.js'), 'w') as fd:
+        fd.write(fake_nunjucks_js)
+
+    remember_cwd(testcase_inst)
+    chdir(root)
+    return root
@@ -72,6 +72,24 @@ describe('nunja/loader async path test case', function() {
             return nunjucksPrecompiled;
         });
 
+        define('__nunja__/__shared__', [], function() {
+            var nunjucksPrecompiled = window.nunjucksPrecompiled;
+            nunjucksPrecompiled["mock.molds/precompiled/shared.nja"] = (
+                function() { function root(env, context, frame, runtime, cb) {
+                    var output = "shared";
+                    cb(null, output);
+                } return {root: root};}
+            )();
+            nunjucksPrecompiled["mock.molds/sharedonly/row.nja"] = (
+                function() { function root(env, context, frame, runtime, cb) {
+                    var output = "row";
+                    cb(null, output);
+                } return {root: root};}
+            )();
+            window.nunjucksPrecompiled = nunjucksPrecompiled;
+            return nunjucksPrecompiled;
+        });
+
         // Finally, the objects from our library to test with.
         this.registry = new registry.Registry();
         this.loader = new loader.NunjaLoader(this.registry);
@@ -82,6 +100,8 @@ describe('nunja/loader async path test case', function() {
         requirejs.undef('text!mock.molds/precompiled/raw.nja');
         requirejs.undef('__nunja__/mock.molds/preload');
         requirejs.undef('__nunja__/mock.molds/precompiled');
+        requirejs.undef('__nunja__/__shared__');
+        requirejs.undef('__nunja__/__index__');
         this.server.restore();
         document.body.innerHTML = "";
         window.nunjucksPrecompiled = this.nunjucksPrecompiled;
@@ -141,6 +161,34 @@ describe('nunja/loader async path test case', function() {
         });
     });
 
+    it('test getSource async precompiled shared', function(done) {
+        var self = this;
+        this.loader.getSource('mock.molds/precompiled/shared.nja', function(
+            err, value
+        ) {
+            expect(err).to.be.null;
+            expect(value['src']['type']).to.equal('code');
+            expect(value['path']).to.equal(
+                'mock.molds/precompiled/shared.nja');
+            expect(self.loader.shared_missing).to.be.false;
+            done();
+        });
+    });
+
+    it('test getSource async shared without mold module', function(done) {
+        // the mold itself has no precompiled module at all.
+        this.loader.getSource('mock.molds/sharedonly/row.nja', function(
+            err, value
+        ) {
+            expect(err).to.be.null;
+            expect(value['src']['type']).to.equal('code');
+            expect(window.nunjucksPrecompiled[
+                'mock.molds/sharedonly/row.nja']).to.equal(
+                    value['src']['obj']);
+            done();
+        });
+    });
+
     it('test getSource async precompiled but recovered', function(done) {
         // try the rendering again
         define('text!mock.molds/precompiled/raw.nja', [], function() {
@@ -157,6 +205,49 @@ describe('nunja/loader async path test case', function() {
         });
     });
 
+    it('test getSource async indexed', function(done) {
+        var self = this;
+        define('__nunja__/__index__', [], function() {
+            return {
+                '__nunja__/__shared__': ['mock.molds/sharedonly/row.nja'],
+                '__nunja__/mock.molds/precompiled': [
+                    'mock.molds/precompiled/template.nja'],
+            };
+        });
+
+        this.loader.getSource('mock.molds/sharedonly/row.nja', function(
+            err, value
+        ) {
+            expect(err).to.be.null;
+            expect(value['src']['type']).to.equal('code');
+            expect(self.loader.index).to.deep.equal({
+                'mock.molds/sharedonly/row.nja': '__nunja__/__shared__',
+                'mock.molds/precompiled/template.nja':
+                    '__nunja__/mock.molds/precompiled',
+            });
+            done();
+        });
+    });
+
+    it('test getSource async not indexed', function(done) {
+        define('__nunja__/__index__', [], function() {
+            return {};
+        });
+        // while provided by the shared module, the index is trusted.
+        define('text!mock.molds/sharedonly/row.nja', [], function() {
+            return 'raw row';
+        });
+
+        this.loader.getSource('mock.molds/sharedonly/row.nja', function(
+            err, value
+        ) {
+            requirejs.undef('text!mock.molds/sharedonly/row.nja');
+            expect(err).to.be.null;
+            expect(value['src']).to.equal('raw row');
+            done();
+        });
+    });
+
     it('test getSource async fresh rendering', function(done) {
         // try the rendering again
         var env = new nunjucks.Environment(this.loader);
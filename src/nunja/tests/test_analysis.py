@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os.path import dirname
+from os.path import join
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.utils import pretty_logging
+
+from nunja import testing
+from nunja.analysis import build_reference_graph
+from nunja.analysis import find_reachable
+from nunja.analysis import find_shared
+from nunja.analysis import find_template_references
+from nunja.analysis import name_to_mold_id
+
+
+def _mold_template_paths(*names):
+    root = join(dirname(testing.__file__), 'mold')
+    return {
+        'nunja.testing.mold/' + name: join(root, *name.split('/'))
+        for name in names
+    }
+
+
+class AnalysisTestCase(unittest.TestCase):
+
+    def test_name_to_mold_id(self):
+        self.assertEqual(
+            name_to_mold_id('nunja.molds/table/template.nja'),
+            'nunja.molds/table',
+        )
+        self.assertEqual(
+            name_to_mold_id('nunja.molds/table/nested/row.nja'),
+            'nunja.molds/table',
+        )
+
+    def test_find_template_references(self):
+        self.assertEqual(
+            find_template_references('<p>{{ value }}</p>'), (set(), False))
+        self.assertEqual(find_template_references(
+            '{% extends "a/b/base.nja" %}'
+            '{% import "a/b/macros.nja" as macros %}'
+            '{% from "a/c/forms.nja" import field %}'
+            '{% include "a/b/row.nja" %}'
+        ), ({
+            'a/b/base.nja', 'a/b/macros.nja', 'a/c/forms.nja', 'a/b/row.nja',
+        }, False))
+        self.assertEqual(find_template_references(
+            '{% include "a/b/row.nja" %}{% include list_template %}'
+        ), ({'a/b/row.nja'}, True))
+
+    def test_build_reference_graph_testing_molds(self):
+        graph = build_reference_graph(_mold_template_paths(
+            'include_by_name/template.nja',
+            'include_by_name/empty.nja',
+            'include_by_value/template.nja',
+            'itemlist/template.nja',
+        ))
+        self.assertEqual(
+            graph['nunja.testing.mold/include_by_name/template.nja'],
+            ({'nunja.testing.mold/itemlist/template.nja'}, False),
+        )
+        self.assertEqual(
+            graph['nunja.testing.mold/include_by_value/template.nja'],
+            (set(), True),
+        )
+        self.assertEqual(
+            graph['nunja.testing.mold/itemlist/template.nja'], (set(), False))
+
+    def test_build_reference_graph_wrapper(self):
+        wrapper = join(
+            dirname(dirname(testing.__file__)),
+            '_core_', '_default_wrapper_', 'template.nja')
+        graph = build_reference_graph({
+            '_core_/_default_wrapper_/template.nja': wrapper,
+            'nunja.testing.mold/other/template.nja': wrapper,
+        })
+        # only the wrapper is known to include the default templates.
+        self.assertEqual(graph, {
+            '_core_/_default_wrapper_/template.nja': (set(), False),
+            'nunja.testing.mold/other/template.nja': (set(), True),
+        })
+
+    def test_build_reference_graph_failures(self):
+        root = mkdtemp(self)
+        bad = join(root, 'bad.nja')
+        with open(bad, 'w') as fd:
+            fd.write('{% include %}')
+
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            graph = build_reference_graph({
+                'a/b/bad.nja': bad,
+                'a/b/missing.nja': join(root, 'missing.nja'),
+            })
+
+        self.assertEqual(graph, {
+            'a/b/bad.nja': (set(), True),
+            'a/b/missing.nja': (set(), True),
+        })
+        self.assertIn(
+            "failed to analyse template 'a/b/bad.nja'", stream.getvalue())
+
+    def test_find_reachable(self):
+        graph = {
+            'a/b/template.nja': ({'a/b/row.nja', 'x/y/external.nja'}, False),
+            'a/b/row.nja': ({'a/c/cell.nja'}, False),
+            'a/b/unused.nja': ({'a/c/orphan.nja'}, False),
+            'a/c/cell.nja': (set(), False),
+            'a/c/orphan.nja': (set(), False),
+            'a/d/template.nja': (set(), False),
+            'a/d/partial.nja': (set(), False),
+        }
+        self.assertEqual(find_reachable(graph), {
+            'a/b/template.nja', 'a/b/row.nja', 'a/c/cell.nja',
+            'a/d/template.nja',
+        })
+        self.assertEqual(find_reachable(graph, roots=['a/b/unused.nja']), {
+            'a/b/unused.nja', 'a/c/orphan.nja',
+        })
+
+    def test_find_reachable_dynamic(self):
+        graph = {
+            'a/b/template.nja': ({'a/b/row.nja'}, False),
+            'a/b/row.nja': (set(), False),
+            'a/b/unused.nja': (set(), False),
+            'a/c/orphan.nja': (set(), False),
+            'a/d/template.nja': (set(), True),
+            'a/e/partial.nja': (set(), False),
+        }
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            reachable = find_reachable(graph)
+
+        # the dynamic reference may be to any template.
+        self.assertEqual(reachable, set(graph))
+        self.assertIn(
+            "template 'a/d/template.nja' has dynamic references; treating "
+            "all templates as reachable", stream.getvalue()
+        )
+
+        # unless the template with it is not reachable.
+        self.assertEqual(find_reachable(graph, roots=['a/b/template.nja']), {
+            'a/b/template.nja', 'a/b/row.nja',
+        })
+
+    def test_find_shared(self):
+        graph = {
+            'a/b/template.nja': ({'a/c/row.nja', 'a/d/cell.nja'}, False),
+            'a/b/other.nja': ({'a/d/cell.nja'}, False),
+            'a/c/template.nja': ({'a/c/row.nja', 'x/y/external.nja'}, False),
+            'a/c/row.nja': ({'x/y/external.nja'}, False),
+            'a/d/cell.nja': (set(), False),
+        }
+        self.assertEqual(find_shared(graph), {'a/c/row.nja'})
+        self.assertEqual(find_shared(graph, threshold=1), {
+            'a/c/row.nja', 'a/d/cell.nja'})
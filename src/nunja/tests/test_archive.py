@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import codecs
+import unittest
+from os.path import join
+
+from jinja2 import TemplateNotFound
+
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_stdouts
+
+from nunja import archive
+from nunja.archive import ArchiveLoader
+from nunja.archive import pack
+from nunja.engine import Engine
+from nunja.engine import JinjaEngine
+from nunja.testing import mocks
+
+
+def fail_open(*a, **kw):
+    raise AssertionError('no files should be opened')
+
+
+class StubRegistry(object):
+
+    registry_name = 'stub'
+
+    def __init__(self, templates):
+        self.templates = templates
+
+    def iter_template_names(self):
+        return iter(sorted(self.templates))
+
+    def lookup_path(self, name):
+        return self.templates[name]
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        (self.registry, self.main_template,
+            self.sub_template) = mocks.setup_tmp_mold_templates_registry(self)
+        self.target = join(mkdtemp(self), 'templates.nja-archive')
+
+    def test_pack_and_load(self):
+        with codecs.open(self.sub_template, 'w', encoding='utf-8') as fd:
+            fd.write(u'<span>☃ {{ data }}</span>')
+        count = pack([self.registry], self.target)
+        self.assertEqual(count, len(list(self.registry.iter_template_names())))
+
+        loader = ArchiveLoader(self.target)
+        self.addCleanup(loader.close)
+        self.assertIn('tmp/mold/sub.nja', loader.list_templates())
+        source, filename, uptodate = loader.get_source(
+            None, 'tmp/mold/sub.nja')
+        self.assertEqual(source, u'<span>☃ {{ data }}</span>')
+        self.assertEqual(
+            filename, join(self.target, 'tmp/mold/sub.nja'))
+        self.assertTrue(uptodate())
+
+        with self.assertRaises(TemplateNotFound):
+            loader.get_source(None, 'tmp/mold/nothere.nja')
+
+    def test_engine(self):
+        pack([self.registry], self.target)
+        loader = ArchiveLoader(self.target)
+        self.addCleanup(loader.close)
+        engine = Engine(self.registry, loader=loader)
+        self.assertIs(engine.env.loader, loader)
+
+        self.addCleanup(setattr, codecs, 'open', codecs.open)
+        codecs.open = fail_open
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+    def test_multiple_registries(self):
+        override = join(mkdtemp(self), 'sub.nja')
+        with open(override, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+        registry = StubRegistry({
+            'tmp/mold/sub.nja': override,
+            'tmp/other/template.nja': override,
+        })
+        count = pack([registry, self.registry], self.target)
+        loader = ArchiveLoader(self.target)
+        self.addCleanup(loader.close)
+        self.assertEqual(count, len(loader.index))
+        self.assertIn('tmp/other/template.nja', loader.index)
+        # the registry listed first takes precedence.
+        self.assertEqual(
+            loader.get_source(None, 'tmp/mold/sub.nja')[0],
+            '<p>{{ data }}</p>')
+
+    def test_not_archive(self):
+        with self.assertRaises(ValueError):
+            ArchiveLoader(self.main_template)
+
+    def test_main(self):
+        stub_stdouts(self)
+        self.addCleanup(setattr, archive, 'get', archive.get)
+        archive.get = {'tmp.mold': self.registry}.get
+        self.assertEqual(archive.main([self.target]), 2)
+        self.assertEqual(archive.main([self.target, 'no.such']), 1)
+        self.assertEqual(archive.main([self.target, 'tmp.mold']), 0)
+        self.assertIn('packed', archive.sys.stdout.getvalue())
+        loader = ArchiveLoader(self.target)
+        self.addCleanup(loader.close)
+        self.assertIn('tmp/mold/template.nja', loader.index)
+
+
+class JinjaArchiveTestCase(unittest.TestCase):
+
+    def test_jinja_engine(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        target = join(mkdtemp(self), 'templates.nja-archive')
+        pack([registry], target)
+        loader = ArchiveLoader(target)
+        self.addCleanup(loader.close)
+        engine = JinjaEngine(registry, loader=loader)
+        self.assertEqual(
+            engine.render_template(
+                'templates/mold/template.nja', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
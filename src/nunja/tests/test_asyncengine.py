@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import unittest
+from timeit import default_timer
+
+from nunja.testing import mocks
+
+try:
+    import asyncio
+    from nunja.asyncengine import AsyncEngine
+    from nunja.asyncengine import AsyncJinjaEngine
+    from nunja.asyncengine import resolve_data
+except (ImportError, SyntaxError):  # pragma: no cover
+    AsyncEngine = None
+
+
+def collect(loop, agen):
+    results = []
+    while True:
+        try:
+            results.append(loop.run_until_complete(agen.__anext__()))
+        except StopAsyncIteration:
+            return results
+
+
+@unittest.skipIf(AsyncEngine is None, 'asyncio rendering is unsupported')
+class AsyncEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        registry, self.main_template, self.sub_template = (
+            mocks.setup_tmp_mold_templates_registry(self))
+        self.engine = AsyncEngine(registry)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_resolve_data(self):
+        data = {'a': 1}
+        self.assertIs(self.loop.run_until_complete(resolve_data(data)), data)
+        data = {'a': 1, 'b': asyncio.sleep(0, result=2)}
+        self.assertEqual(
+            self.loop.run_until_complete(resolve_data(data)),
+            {'a': 1, 'b': 2},
+        )
+
+    def test_resolve_data_concurrent(self):
+        data = {
+            str(i): asyncio.sleep(0.2, result=i) for i in range(5)
+        }
+        start = default_timer()
+        result = self.loop.run_until_complete(resolve_data(data))
+        self.assertLess(default_timer() - start, 0.6)
+        self.assertEqual(result, {str(i): i for i in range(5)})
+
+    def test_render_async(self):
+        self.assertEqual(self.loop.run_until_complete(
+            self.engine.render_async('tmp/mold', {
+                'data': asyncio.sleep(0, result='Hello')})
+        ), '<div><span>Hello</span></div>')
+
+    def test_execute_async(self):
+        self.assertEqual(self.loop.run_until_complete(
+            self.engine.execute_async('tmp/mold', {
+                'data': asyncio.sleep(0, result='Hello')})
+        ), self.engine.execute('tmp/mold', {'data': 'Hello'}))
+
+    def test_execute_stream_async(self):
+        chunks = collect(self.loop, self.engine.execute_stream_async(
+            'tmp/mold', {'data': asyncio.sleep(0, result='Hello')}))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(
+            ''.join(chunks),
+            self.engine.execute('tmp/mold', {'data': 'Hello'}),
+        )
+
+        chunks = collect(self.loop, self.engine.execute_stream_async(
+            'tmp/mold', {'data': u'\u3042'},
+            buffer_size=1024, encoding='utf-8',
+        ))
+        self.assertEqual(chunks, [
+            b'<div data-nunja="tmp/mold">\n'
+            b'<div><span>\xe3\x81\x82</span></div>\n</div>'
+        ])
+
+    def test_render_stream_async(self):
+        chunks = collect(self.loop, self.engine.render_stream_async(
+            'tmp/mold', {'data': 'Hello'}, buffer_size=10, encoding='utf-8'))
+        self.assertEqual(
+            chunks, [b'<div><span>', b'Hello</span>', b'</div>'])
+
+
+@unittest.skipIf(AsyncEngine is None, 'asyncio rendering is unsupported')
+class AsyncJinjaEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        registry, self.main_template, self.sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        self.engine = AsyncJinjaEngine(registry)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_render_template_async(self):
+        self.assertEqual(self.loop.run_until_complete(
+            self.engine.render_template_async('templates/mold/template.nja', {
+                'data': asyncio.sleep(0, result='Hello')})
+        ), '<div><span>Hello</span></div>')
+
+    def test_render_template_stream_async(self):
+        chunks = collect(self.loop, self.engine.render_template_stream_async(
+            'templates/mold/template.nja', {'data': 'Hello'}))
+        self.assertEqual(''.join(chunks), '<div><span>Hello</span></div>')
@@ -0,0 +1,34 @@
+'use strict';
+
+var cache = require('nunja/cache');
+var nunjucks = require('nunjucks');
+
+window.mocha.setup('bdd');
+
+describe('nunja/cache extension test case', function() {
+
+    beforeEach(function() {
+        this.env = cache.install(new nunjucks.Environment([], {
+            'autoescape': true,
+        }));
+    });
+
+    it('renders the body as is', function() {
+        var template = (
+            '{% cache key, 10 %}<p>{{ value }}</p>{% endcache %}');
+        expect(this.env.renderString(template, {
+            'key': 1, 'value': '<1>'
+        })).to.equal('<p>&lt;1&gt;</p>');
+        // nothing is cached.
+        expect(this.env.renderString(template, {
+            'key': 1, 'value': '2'
+        })).to.equal('<p>2</p>');
+    });
+
+    it('renders the body without ttl', function() {
+        expect(this.env.renderString(
+            '{% cache "key" %}{{ value }}{% endcache %}!', {'value': 'v'}
+        )).to.equal('v!');
+    });
+
+});
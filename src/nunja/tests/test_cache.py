@@ -0,0 +1,574 @@
+# -*- coding: utf-8 -*-
+import unittest
+from collections import OrderedDict
+from datetime import date
+from os import listdir
+from os import utime
+from os.path import exists
+from os.path import join
+
+from jinja2 import DictLoader
+from jinja2 import Environment
+from jinja2.exceptions import TemplateNotFound
+from jinja2.bccache import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.utils import pretty_logging
+
+from nunja.cache import BYTECODE_CACHE_MEMORY
+from nunja.cache import CacheExtension
+from nunja.cache import FragmentCache
+from nunja.cache import MemoryBytecodeCache
+from nunja.cache import fingerprint
+from nunja.cache import get_bytecode_cache
+from nunja.cache import memory_bytecode_cache
+from nunja.cache import prewarm
+from nunja.engine import Engine
+from nunja.engine import JinjaEngine
+from nunja.loader import NunjaLoader
+from nunja.testing import mocks
+
+
+def fail_compile(*a, **kw):
+    raise AssertionError('template should not be compiled')
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class GetSetCache(object):
+    """
+    A block_cache with only the required get and set methods.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key, token):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == token:
+            return entry[1]
+        return None
+
+    def set(self, key, token, value, ttl=None):
+        self.entries[key] = (token, value)
+
+
+class GetBytecodeCacheTestCase(unittest.TestCase):
+
+    def test_get_bytecode_cache(self):
+        self.assertIsNone(get_bytecode_cache(None))
+        cache = MemoryBytecodeCache()
+        self.assertIs(get_bytecode_cache(cache), cache)
+        self.assertIs(
+            get_bytecode_cache(BYTECODE_CACHE_MEMORY), memory_bytecode_cache)
+
+    def test_get_bytecode_cache_filesystem(self):
+        target = join(mkdtemp(self), 'cache', 'dir')
+        cache = get_bytecode_cache(target)
+        self.assertTrue(isinstance(cache, FileSystemBytecodeCache))
+        self.assertTrue(exists(target))
+
+
+class EngineBytecodeCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        (self.registry, self.main_template,
+            self.sub_template) = mocks.setup_tmp_mold_templates_registry(self)
+
+    def test_memory_shared(self):
+        cache = MemoryBytecodeCache()
+        engine = Engine(self.registry, bytecode_cache=cache)
+        self.assertIs(engine.env.bytecode_cache, cache)
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+        # the core template, the mold template and the included one.
+        self.assertEqual(len(cache._buckets), 3)
+
+        # a separate engine with its own environment will not need to
+        # compile the templates again.
+        engine = Engine(self.registry, bytecode_cache=cache)
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+        cache.clear()
+        self.assertEqual(cache._buckets, {})
+
+    def test_memory_modified_source(self):
+        cache = MemoryBytecodeCache()
+        engine = Engine(self.registry, bytecode_cache=cache)
+        engine.render('tmp/mold', {'data': 'Hello'})
+
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+
+        # the checksum of the source no longer match.
+        engine = Engine(self.registry, bytecode_cache=cache)
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><p>Hello</p></div>')
+
+    def test_warm_filesystem(self):
+        cache_dir = mkdtemp(self)
+        engine = Engine(self.registry, bytecode_cache=cache_dir)
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            count = engine.warm_bytecode_cache()
+
+        # template.nja, sub.nja and filter_dump.nja from tmp/mold, plus
+        # the templates from the molds provided by nunja.
+        self.assertGreaterEqual(count, 3)
+        self.assertIn('into the bytecode cache', stream.getvalue())
+        self.assertEqual(len(listdir(cache_dir)), count)
+
+        engine = Engine(self.registry, bytecode_cache=cache_dir)
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+    def test_warm_failure(self):
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{% if %}</p>')
+
+        engine = Engine(self.registry, bytecode_cache=MemoryBytecodeCache())
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            engine.warm_bytecode_cache()
+        self.assertIn(
+            "failed to compile template 'tmp/mold/sub.nja'", stream.getvalue())
+
+
+class JinjaEngineBytecodeCacheTestCase(unittest.TestCase):
+
+    def test_warm_memory(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        cache = MemoryBytecodeCache()
+        engine = JinjaEngine(registry, bytecode_cache=cache)
+        with pretty_logging('nunja', stream=StringIO()):
+            count = engine.warm_bytecode_cache()
+        self.assertEqual(count, len(registry.templates))
+        self.assertEqual(len(cache._buckets), count)
+
+        engine = JinjaEngine(registry, bytecode_cache=cache)
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render_template(
+                'templates/mold/template.nja', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+
+class PrewarmTestCase(unittest.TestCase):
+
+    def setUp(self):
+        (self.registry, self.main_template,
+            self.sub_template) = mocks.setup_tmp_mold_templates_registry(self)
+
+    def test_prewarm(self):
+        engine = Engine(self.registry)
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            report = engine.prewarm()
+        self.assertIn('tmp/mold/template.nja', report['templates'])
+        # the templates that are not the default ones are included.
+        self.assertIn('tmp/mold/sub.nja', report['templates'])
+        self.assertEqual(report['failures'], {})
+        self.assertGreaterEqual(
+            report['elapsed'], sum(report['templates'].values()))
+        self.assertIn("prewarmed", stream.getvalue())
+        self.assertIn('tmp/mold', engine._molds)
+
+        # nothing needs to be compiled or loaded again.
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+    def test_prewarm_failures(self):
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{% if %}</p>')
+
+        engine = Engine(self.registry)
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            report = engine.prewarm()
+        self.assertEqual(list(report['failures']), ['tmp/mold/sub.nja'])
+        self.assertNotIn('tmp/mold/sub.nja', report['templates'])
+        self.assertIn(
+            "failed to prewarm template 'tmp/mold/sub.nja'", stream.getvalue())
+
+    def test_prewarm_missing_mold_template(self):
+        engine = Engine(self.registry)
+
+        def load_template(name):
+            if name == 'tmp/mold/template.nja':
+                raise TemplateNotFound(name)
+            return engine.env.get_template(name)
+
+        engine.load_template = load_template
+        engine.invalidate()
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            report = engine.prewarm()
+        self.assertIn('tmp/mold/template.nja', report['failures'])
+        self.assertIn("failed to prewarm mold 'tmp/mold'", stream.getvalue())
+
+    def test_prewarm_cache_capacity(self):
+        engine = Engine(self.registry, env=Environment(
+            loader=NunjaLoader(self.registry), cache_size=1))
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            prewarm(engine.env, self.registry)
+        self.assertIn("cannot hold all", stream.getvalue())
+
+
+class JinjaEnginePrewarmTestCase(unittest.TestCase):
+
+    def test_prewarm(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        engine = JinjaEngine(registry)
+        with pretty_logging('nunja', stream=StringIO()):
+            report = engine.prewarm()
+        self.assertEqual(
+            sorted(report['templates']), sorted(registry.templates))
+
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render_template(
+                'templates/mold/template.nja', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = FragmentCache()
+        token = (object(),)
+        self.assertIsNone(cache.get(('a/b', 1), token))
+        cache.set(('a/b', 1), token, 'value')
+        self.assertEqual(cache.get(('a/b', 1), token), 'value')
+        # a different token will not be used, and is dropped.
+        self.assertIsNone(cache.get(('a/b', 1), (object(),)))
+        self.assertIsNone(cache.get(('a/b', 1), token))
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'misses': 3, 'evictions': 0, 'size': 0})
+
+    def test_lru_eviction(self):
+        cache = FragmentCache(maxsize=2)
+        cache.set(('a/b', 1), None, '1')
+        cache.set(('a/b', 2), None, '2')
+        # make 1 the most recently used.
+        self.assertEqual(cache.get(('a/b', 1), None), '1')
+        cache.set(('a/b', 3), None, '3')
+        self.assertIsNone(cache.get(('a/b', 2), None))
+        self.assertEqual(cache.get(('a/b', 1), None), '1')
+        self.assertEqual(cache.get(('a/b', 3), None), '3')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_ttl_entry(self):
+        timer = FakeTimer()
+        cache = FragmentCache(ttl=10, timer=timer)
+        cache.set(('a/b', 1), None, '1', ttl=1)
+        cache.set(('a/b', 2), None, '2')
+        timer.now = 1
+        self.assertIsNone(cache.get(('a/b', 1), None))
+        self.assertEqual(cache.get(('a/b', 2), None), '2')
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        cache = FragmentCache(ttl=10, timer=timer)
+        cache.set(('a/b', 1), None, '1')
+        timer.now = 9
+        self.assertEqual(cache.get(('a/b', 1), None), '1')
+        timer.now = 10
+        self.assertIsNone(cache.get(('a/b', 1), None))
+
+    def test_invalidate(self):
+        cache = FragmentCache()
+        cache.set(('a/b', 1), None, '1')
+        cache.set(('a/c', 1), None, '1')
+        cache.invalidate('a/b')
+        self.assertIsNone(cache.get(('a/b', 1), None))
+        self.assertEqual(cache.get(('a/c', 1), None), '1')
+        cache.invalidate()
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class FingerprintTestCase(unittest.TestCase):
+
+    def test_fingerprint_stable(self):
+        self.assertEqual(
+            fingerprint({'a': [1, 2.5, None, True], 'b': u'\u2603'}),
+            fingerprint(OrderedDict([
+                ('a', [1, 2.5, None, True]), ('b', u'\u2603')])),
+        )
+
+    def test_fingerprint_mapping_order(self):
+        # the order of iteration is significant for the output.
+        self.assertNotEqual(
+            fingerprint(OrderedDict([('a', 1), ('b', 2)])),
+            fingerprint(OrderedDict([('b', 2), ('a', 1)])),
+        )
+
+    def test_fingerprint_types_distinct(self):
+        values = [
+            '<b>x</b>', Markup('<b>x</b>'), 1, 1.0, True, '1', None,
+            'None', [1], (1,), {'1': 1}, {1: 1}, {'a': [1, 2]},
+            {'a': [1], '2': []},
+        ]
+        fingerprints = [fingerprint(value) for value in values]
+        self.assertEqual(len(set(fingerprints)), len(values))
+
+    def test_fingerprint_unsupported(self):
+        for value in (object(), date(2020, 1, 1), {'a': set()}, b'x'):
+            if isinstance(value, str):
+                # bytes are text on Python 2.
+                continue
+            with self.assertRaises(TypeError):
+                fingerprint(value)
+
+    def test_fingerprint_recursive(self):
+        value = []
+        value.append(value)
+        with self.assertRaises(TypeError):
+            fingerprint(value)
+
+
+class EngineFragmentCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        (self.registry, self.main_template,
+            self.sub_template) = mocks.setup_tmp_mold_templates_registry(self)
+        self.cache = FragmentCache()
+        self.engine = Engine(self.registry, fragment_cache=self.cache)
+
+    def test_execute_render_cached(self):
+        result = self.engine.execute('tmp/mold', {'data': 'Hello'})
+        self.assertEqual(result, self.engine.execute(
+            'tmp/mold', {'data': 'Hello'}))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        # different data, wrapper tag and method are separate entries.
+        self.engine.execute('tmp/mold', {'data': 'Hi'})
+        self.engine.execute('tmp/mold', {'data': 'Hello'}, wrapper_tag='p')
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>',
+        )
+        self.assertEqual(self.cache.stats(), {
+            'hits': 1, 'misses': 4, 'evictions': 0, 'size': 4})
+
+    def test_cache_key(self):
+        self.engine.render('tmp/mold', {'data': 'Hello'}, cache_key='k')
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': 'Other'}, cache_key='k'),
+            '<div><span>Hello</span></div>',
+        )
+
+    def test_mapping_order(self):
+        with open(self.sub_template, 'w') as fd:
+            fd.write(
+                '{% for k, v in data.items() %}{{ k }}={{ v }};{% endfor %}')
+        self.assertEqual(self.engine.render(
+            'tmp/mold', {'data': OrderedDict([('a', 1), ('b', 2)])}),
+            '<div>a=1;b=2;</div>')
+        self.assertEqual(self.engine.render(
+            'tmp/mold', {'data': OrderedDict([('b', 2), ('a', 1)])}),
+            '<div>b=2;a=1;</div>')
+
+    def test_unfingerprintable_data(self):
+        data = {'data': object()}
+        self.engine.render('tmp/mold', data)
+        self.engine.render('tmp/mold', data)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_markup_not_shared_with_text(self):
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': Markup('<b>x</b>')}),
+            '<div><span><b>x</b></span></div>',
+        )
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': '<b>x</b>'}),
+            '<div><span>&lt;b&gt;x&lt;/b&gt;</span></div>',
+        )
+
+    def test_date_not_cached(self):
+        self.engine.render('tmp/mold', {'data': date(2020, 1, 1)})
+        self.assertEqual(self.cache.stats()['size'], 0)
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': '2020-01-01'}),
+            '<div><span>2020-01-01</span></div>',
+        )
+
+    def test_modified_dynamically_included_template(self):
+        with open(self.main_template, 'w') as fd:
+            fd.write('<div>{% include data %}</div>')
+        data = {'data': 'tmp/mold/sub.nja'}
+        self.assertEqual(
+            self.engine.render('tmp/mold', data),
+            '<div><span>tmp/mold/sub.nja</span></div>')
+        # not cached as the modifications cannot be tracked.
+        self.assertEqual(self.cache.stats()['size'], 0)
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+        self.assertEqual(
+            self.engine.render('tmp/mold', data),
+            '<div><p>tmp/mold/sub.nja</p></div>')
+
+        # unless explicitly keyed.
+        self.engine.render('tmp/mold', data, cache_key='sub')
+        self.assertEqual(self.cache.stats()['size'], 1)
+        self.assertEqual(
+            self.engine.render('tmp/mold', data, cache_key='sub'),
+            '<div><p>tmp/mold/sub.nja</p></div>')
+
+    def test_modified_included_template(self):
+        self.assertEqual(
+            self.engine.execute('tmp/mold', {'data': 'Hello'}),
+            '<div data-nunja="tmp/mold">\n<div><span>Hello</span></div>\n'
+            '</div>'
+        )
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+        utime(self.sub_template, (0, 0))
+        self.assertEqual(
+            self.engine.execute('tmp/mold', {'data': 'Hello'}),
+            '<div data-nunja="tmp/mold">\n<div><p>Hello</p></div>\n'
+            '</div>'
+        )
+        self.assertEqual(self.cache.stats()['hits'], 0)
+
+    def test_production_invalidate(self):
+        engine = Engine(
+            self.registry, fragment_cache=self.cache, production=True)
+        engine.render('tmp/mold', {'data': 'Hello'})
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>',
+        )
+        engine.invalidate('tmp/mold')
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><p>Hello</p></div>',
+        )
+
+
+class CacheExtensionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.templates = {
+            'a/b/template.nja': (
+                '{% cache key %}<p>{{ value }}</p>{% endcache %}{{ value }}'),
+            'a/b/ttl.nja': '{% cache key, 10 %}{{ value }}{% endcache %}',
+        }
+        self.env = Environment(
+            autoescape=True, loader=DictLoader(self.templates),
+            extensions=[CacheExtension],
+        )
+        self.timer = FakeTimer()
+        self.env.block_cache = FragmentCache(timer=self.timer)
+
+    def render(self, name, **kw):
+        return self.env.get_template(name).render(**kw)
+
+    def test_default_block_cache(self):
+        env = Environment(extensions=[CacheExtension])
+        self.assertTrue(isinstance(env.block_cache, FragmentCache))
+
+    def test_cached(self):
+        self.assertEqual(self.render(
+            'a/b/template.nja', key=1, value='<1>'),
+            '<p>&lt;1&gt;</p>&lt;1&gt;')
+        self.assertEqual(self.render(
+            'a/b/template.nja', key=1, value='2'), '<p>&lt;1&gt;</p>2')
+        self.assertEqual(self.render(
+            'a/b/template.nja', key=2, value='2'), '<p>2</p>2')
+
+    def test_ttl(self):
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='1'), '1')
+        self.timer.now = 9
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='2'), '1')
+        self.timer.now = 10
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='2'), '2')
+
+    def test_disabled(self):
+        self.env.block_cache = None
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='1'), '1')
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='2'), '2')
+
+    def test_modified_template(self):
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='1'), '1')
+        self.templates['a/b/ttl.nja'] = (
+            '{% cache key, 10 %}<{{ value }}>{% endcache %}')
+        self.env.cache.clear()
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='1'), '<1>')
+
+    def test_invalidate(self):
+        self.render('a/b/ttl.nja', key=1, value='1')
+        self.env.block_cache.invalidate('a/c')
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='2'), '1')
+        self.env.block_cache.invalidate('a/b')
+        self.assertEqual(self.render('a/b/ttl.nja', key=1, value='2'), '2')
+
+    def test_engine(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_mold_templates_registry(self))
+        with open(sub_template, 'w') as fd:
+            fd.write('{% cache 1 %}<span>{{ data }}</span>{% endcache %}')
+        block_cache = FragmentCache()
+        engine = Engine(registry, block_cache=block_cache)
+        self.assertIs(engine.env.block_cache, block_cache)
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>',
+        )
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hi'}),
+            '<div><span>Hello</span></div>',
+        )
+        engine.invalidate('tmp/mold')
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hi'}),
+            '<div><span>Hi</span></div>',
+        )
+
+    def test_jinja_engine(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        engine = JinjaEngine(registry)
+        self.assertTrue(isinstance(engine.env.block_cache, FragmentCache))
+
+    def test_engine_get_set_only(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_mold_templates_registry(self))
+        with open(sub_template, 'w') as fd:
+            fd.write('{% cache 1 %}<span>{{ data }}</span>{% endcache %}')
+        block_cache = GetSetCache()
+        engine = Engine(registry, block_cache=block_cache)
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>',
+        )
+        self.assertEqual(len(block_cache.entries), 1)
+        engine.invalidate('tmp/mold')
+        engine.invalidate()
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hi'}),
+            '<div><span>Hello</span></div>',
+        )
+
+    def test_jinja_engine_get_set_only(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        engine = JinjaEngine(registry, block_cache=GetSetCache())
+        engine.invalidate('templates/mold')
+        engine.invalidate()
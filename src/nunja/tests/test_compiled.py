@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os import listdir
+from os.path import join
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_stdouts
+from calmjs.utils import pretty_logging
+from jinja2 import TemplateNotFound
+
+from nunja import compiled
+from nunja.compiled import CompiledLoader
+from nunja.compiled import compile_templates
+from nunja.engine import Engine
+from nunja.engine import JinjaEngine
+from nunja.testing import mocks
+
+
+def fail_compile(*a, **kw):
+    raise AssertionError('template should not be compiled')
+
+
+class CompiledTestCase(unittest.TestCase):
+
+    def setUp(self):
+        (self.registry, self.main_template,
+            self.sub_template) = mocks.setup_tmp_mold_templates_registry(self)
+        self.target_dir = mkdtemp(self)
+
+    def test_compile_zip(self):
+        target = join(self.target_dir, 'templates.zip')
+        engine = Engine(self.registry)
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            count, failures = compile_templates(engine.env, target)
+        self.assertEqual(
+            count, len(list(self.registry.iter_template_names())))
+        self.assertEqual(failures, [])
+        self.assertIn('compiled %d templates' % count, stream.getvalue())
+
+        engine = Engine(self.registry, compiled_templates=target)
+        self.assertTrue(isinstance(engine.env.loader, CompiledLoader))
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+        self.assertEqual(
+            engine.execute('tmp/mold', {'data': 'Hello'}),
+            '<div data-nunja="tmp/mold">\n<div><span>Hello</span></div>\n'
+            '</div>'
+        )
+        # the source remains available through the fallback.
+        self.assertEqual(
+            engine.env.loader.get_source(engine.env, 'tmp/mold/sub.nja')[0],
+            '<span>{{ data }}</span>')
+
+    def test_compile_directory_fallback(self):
+        engine = Engine(self.registry)
+        with pretty_logging('nunja', stream=StringIO()):
+            count, failures = compile_templates(
+                engine.env, self.target_dir, zip=None)
+        self.assertEqual(len(listdir(self.target_dir)), count)
+
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+
+        engine = Engine(self.registry, compiled_templates=self.target_dir)
+        # the compiled sub.nja is used, not the modified one.
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+        # templates missing from the compiled modules are from source.
+        with open(join(self.target_dir, 'template.nja'), 'w') as fd:
+            fd.write('<b>{{ data }}</b>')
+        self.registry.update_mold('tmp/new', self.target_dir)
+        self.assertEqual(
+            engine.render('tmp/new', {'data': 'Hello'}), '<b>Hello</b>')
+
+    def test_compile_failures(self):
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{% if %}</p>')
+        engine = Engine(self.registry)
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            count, failures = compile_templates(
+                engine.env, join(self.target_dir, 'templates.zip'))
+        self.assertEqual(len(failures), 1)
+        self.assertIn('tmp/mold/sub.nja', failures[0])
+        self.assertIn('Could not compile', stream.getvalue())
+
+    def test_main(self):
+        stub_stdouts(self)
+        self.addCleanup(setattr, compiled, 'get', compiled.get)
+        compiled.get = {'tmp.mold': self.registry}.get
+        target = join(self.target_dir, 'templates.zip')
+        self.assertEqual(compiled.main([target]), 2)
+        self.assertEqual(compiled.main([target, 'no.such']), 1)
+        with pretty_logging('nunja', stream=StringIO()):
+            self.assertEqual(compiled.main([target, 'tmp.mold']), 0)
+        self.assertIn('compiled', compiled.sys.stdout.getvalue())
+        self.assertEqual(listdir(self.target_dir), ['templates.zip'])
+
+    def test_main_without_core(self):
+        stub_stdouts(self)
+        self.registry.molds.pop('_core_/_default_wrapper_')
+        with self.assertRaises(TemplateNotFound):
+            Engine(self.registry)
+
+        self.addCleanup(setattr, compiled, 'get', compiled.get)
+        compiled.get = {'tmp.mold': self.registry, 'other': object()}.get
+        target = join(self.target_dir, 'templates.zip')
+        self.assertEqual(compiled.main([target, 'other']), 1)
+        self.assertIn(
+            "registry 'other' does not provide templates",
+            compiled.sys.stderr.getvalue())
+        with pretty_logging('nunja', stream=StringIO()):
+            self.assertEqual(compiled.main([target, 'tmp.mold']), 0)
+        self.assertIn(
+            'compiled %d templates' % len(list(
+                self.registry.iter_template_names())),
+            compiled.sys.stdout.getvalue())
+
+        engine = JinjaEngine(self.registry, compiled_templates=target)
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render_template('tmp/mold/template.nja', {'data': 'Hi'}),
+            '<div><span>Hi</span></div>')
+
+
+class JinjaCompiledTestCase(unittest.TestCase):
+
+    def test_jinja_engine(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        target = join(mkdtemp(self), 'templates.zip')
+        with pretty_logging('nunja', stream=StringIO()):
+            compile_templates(JinjaEngine(registry).env, target)
+        engine = JinjaEngine(registry, compiled_templates=target)
+        engine.env.compile = fail_compile
+        self.assertEqual(
+            engine.render_template(
+                'templates/mold/template.nja', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
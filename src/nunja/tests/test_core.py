@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import unittest
 from os.path import join
+from threading import Thread
+from time import sleep
 
+from nunja import core
 from nunja.core import engine
 from nunja.testing import model
 
@@ -70,3 +73,52 @@ class DefaultCoreEngineTestCase(unittest.TestCase):
             '</table>\n'
             '</div>'
         )
+
+
+class LazyCoreEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.original = core._engine
+        core._engine = None
+        self.created = []
+
+        import nunja.engine
+        self.original_engine_cls = nunja.engine.Engine
+
+        def slow_engine():
+            # give the other threads a chance to race.
+            sleep(0.01)
+            self.created.append(object())
+            return self.created[-1]
+
+        nunja.engine.Engine = slow_engine
+
+    def tearDown(self):
+        import nunja.engine
+        nunja.engine.Engine = self.original_engine_cls
+        core._engine = self.original
+
+    def test_get_engine_lazy(self):
+        self.assertIn('None', repr(engine))
+        self.assertEqual(self.created, [])
+        result = core.get_engine()
+        self.assertIs(result, self.created[0])
+        self.assertIs(core.get_engine(), result)
+        self.assertEqual(len(self.created), 1)
+
+    def test_get_engine_threads(self):
+        results = []
+        threads = [Thread(target=lambda: results.append(core.get_engine()))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(results, self.created * 8)
+
+    def test_proxy(self):
+        self.assertIs(engine.__class__, core.EngineProxy)
+        with self.assertRaises(AttributeError):
+            engine.no_such_attribute
+        self.assertEqual(len(self.created), 1)
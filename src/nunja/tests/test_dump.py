@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+from collections import OrderedDict
+from datetime import date
+from datetime import datetime
+from datetime import time
+from subprocess import PIPE
+from subprocess import Popen
+
+from calmjs.utils import which
+
+try:
+    from dataclasses import make_dataclass
+except ImportError:  # pragma: no cover
+    make_dataclass = None
+
+from nunja import dump as dump_module
+from nunja.dump import backends
+from nunja.dump import get_dump
+from nunja.dump import json_dumps
+from nunja.dump import orjson
+from nunja.dump import orjson_dumps
+from nunja.engine import Engine
+from nunja.testing import mocks
+from nunja.testing import model
+
+# values that are shared between Python and JavaScript, such that the
+# output should be identical between all the backends and JSON.stringify
+shared_values = [
+    None, True, False, 0, 1, -1, 9007199254740991, 0.5, -2.25, 0.1,
+    '', 'Hello', 'quote " and backslash \\ and /', 'tab\tnew\nline\r\x08\x0c',
+    '\x00\x01\x1f', '<script>alert("&")</script>',
+    [], {}, [1, [2, [3, []]]], ['a', None, {'b': [True]}],
+    {'a': 1, 'b': {'c': [1, 2], 'd': {}}},
+    {'z': 1, 'a': 2, 'm': {'y': None, 'b': 'c'}},
+    OrderedDict([('z', 1), ('a', 2)]),
+    model.DummyTableData([
+        ['id', 'Id'],
+        ['name', 'Given Name'],
+    ], [
+        ['1', 'John Smith'],
+        ['2', 'Eve Adams'],
+    ], css={'table': 'table'}).to_jsonable(),
+    {'itemlist': ['list_1', 'list_2'], 'list_template': 'itemlist.nja'},
+]
+
+# values with known differences from JSON.stringify.
+python_values = [
+    1.0, 1e16, 1e-7, 1.2345678901234568e+17, 5e-324, -0.0, 1e300,
+    float('nan'), float('inf'), float('-inf'), 2 ** 64, -2 ** 63,
+    u'あ', u'\x7f', u' ', u'\ud800', u'caf\xe9 1e5',
+    {1: 2, 3: 4}, {u'\xe9': 1, u'e': 2}, (1, 2), {'text': 'E1e9 e'},
+    {'value': None, 'number': 2e20},
+    1e-5, -2.5e-5, 9.99e-05, 0.0001, 1e15, [1e-5, '0.00001', 'x 1e5'],
+    {u'\xe9 1': [1.5e-7, u'\U0001f600'], u'e1e2': 3e40},
+]
+
+
+class DumpTestCase(unittest.TestCase):
+
+    def test_json_dumps(self):
+        self.assertEqual(
+            json_dumps({'b': [1, 'x'], 'a': None}), '{"a":null,"b":[1,"x"]}')
+
+    def test_get_dump(self):
+        self.assertIs(get_dump('json'), json_dumps)
+        self.assertIs(get_dump(len), len)
+        self.assertIs(get_dump(), backends.get('orjson', json_dumps))
+        with self.assertRaises(ValueError) as e:
+            get_dump('no_such_backend')
+        self.assertIn("unknown dump backend 'no_such_backend'", str(
+            e.exception))
+
+    def test_backends_parity(self):
+        for name, dump in backends.items():
+            for value in shared_values + python_values:
+                self.assertEqual(
+                    dump(value), json_dumps(value),
+                    'backend %s differs for %r' % (name, value))
+
+    def test_backends_unsupported(self):
+        values = [
+            object(), date(2000, 1, 1), datetime(2000, 1, 1), time(0, 0),
+            [date(2000, 1, 1)], {'a': {'b': datetime(2000, 1, 1)}},
+        ]
+        if make_dataclass is not None:
+            values.append(make_dataclass('Point', ['x'])(1))
+        for name, dump in backends.items():
+            for value in values:
+                with self.assertRaises(TypeError):
+                    dump(value)
+
+    def test_backends_subclass(self):
+        class Text(str):
+            def __str__(self):
+                return 'other'
+
+        class Number(int):
+            pass
+
+        for name, dump in backends.items():
+            self.assertEqual(dump([Text('a'), Number(1)]), '["a",1]')
+
+    @unittest.skipIf(orjson is None, 'orjson not available')
+    def test_orjson_dumps(self):
+        self.assertIs(backends['orjson'], orjson_dumps)
+        self.assertEqual(orjson_dumps({'b': 1, 'a': 0.5}), '{"a":0.5,"b":1}')
+
+    @unittest.skipIf(orjson is None, 'orjson not available')
+    def test_orjson_dumps_no_fallback(self):
+        def fallback(obj):
+            raise AssertionError('fell back to json_dumps for %r' % (obj,))
+
+        self.addCleanup(setattr, dump_module, 'json_dumps', json_dumps)
+        dump_module.json_dumps = fallback
+        # text that resembles the values that require the fallback.
+        self.assertEqual(orjson_dumps({
+            'id': '3e4f1e20', 'text': 'null and 1e5 nullable', 'n': 1e-4,
+        }), '{"id":"3e4f1e20","n":0.0001,"text":"null and 1e5 nullable"}')
+        self.assertEqual(
+            orjson_dumps([u'caf\xe9 \\ "\u3042"', u'\U0001f600\x7f']),
+            '["caf\\u00e9 \\\\ \\"\\u3042\\"","\\ud83d\\ude00\\u007f"]')
+        self.assertEqual(
+            orjson_dumps({'value': None, 'list': [1.5, None]}),
+            '{"list":[1.5,null],"value":null}')
+        with self.assertRaises(AssertionError):
+            orjson_dumps({'value': None, 'list': [(float('nan'),)]})
+
+    def test_engine_dump(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_mold_templates_registry(self))
+        engine = Engine(registry, dump='json')
+        self.assertIs(engine.env.filters['dump'], json_dumps)
+        engine = Engine(registry)
+        self.assertIs(engine.env.filters['dump'], get_dump())
+
+
+@unittest.skipIf(which('node') is None, 'node not found.')
+class JSONStringifyParityTestCase(unittest.TestCase):
+    """
+    Ensure that the output for the shared values are identical to the
+    output produced by JSON.stringify.
+    """
+
+    def test_parity(self):
+        # the values are provided with keys in the expected order.
+        source = '\n'.join(json_dumps(value) for value in shared_values)
+        proc = Popen(['node', '-e', (
+            'var lines = require("fs").readFileSync(0, "utf8").split("\\n");'
+            'process.stdout.write(JSON.stringify(lines.map(function(line) {'
+            '    return JSON.stringify(JSON.parse(line));'
+            '})));'
+        )], stdin=PIPE, stdout=PIPE)
+        stdout, stderr = proc.communicate(source.encode('utf8'))
+        results = json.loads(stdout.decode('utf8'))
+
+        for name, dump in backends.items():
+            for value, result in zip(shared_values, results):
+                self.assertEqual(
+                    dump(value), result,
+                    'backend %s differs from JSON.stringify for %r' % (
+                        name, value))
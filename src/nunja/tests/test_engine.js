@@ -70,3 +70,92 @@ describe('nunja/engine simple test case', function() {
     });
 
 });
+
+
+describe('nunja/engine lazy mold test case', function() {
+
+    var lazy_scripts = function() {
+        return Array.prototype.filter.call(
+            document.head.getElementsByTagName('script'), function(script) {
+                return script.src.indexOf('data:') === 0;
+            }
+        );
+    };
+
+    beforeEach(function() {
+        this.registry = new registry.Registry();
+        this.loader = new loader.NunjaLoader(this.registry);
+        this.env = new nunjucks.Environment(this.loader, {
+            'autoescape': true,
+        });
+        var script = function(name, output) {
+            return 'data:text/javascript,' + encodeURIComponent(
+                '(function() {(window.nunjucksPrecompiled = ' +
+                'window.nunjucksPrecompiled || {})["' + name + '"] = ' +
+                '(function() { function root(' +
+                'env, context, frame, runtime, cb) { cb(null, "' + output +
+                '"); } return {root: root};})();})();'
+            );
+        };
+        this.other_script = script('other/mold/template.nja', 'other');
+        this.engine = new engine.Engine({
+            'env': this.env,
+            'registry': this.registry,
+            'lazy_molds': {
+                'lazy/mold': script('lazy/mold/template.nja', 'lazy'),
+                'main/mold': [
+                    script('main/mold/template.nja', 'main'),
+                    this.other_script,
+                ],
+                'other/mold': [this.other_script],
+            },
+        });
+    });
+
+    afterEach(function() {
+        delete window.nunjucksPrecompiled['lazy/mold/template.nja'];
+        delete window.nunjucksPrecompiled['main/mold/template.nja'];
+        delete window.nunjucksPrecompiled['other/mold/template.nja'];
+        lazy_scripts().forEach(function(script) {
+            script.parentNode.removeChild(script);
+        });
+    });
+
+    it('test lazy load mold', function(done) {
+        var self = this;
+        expect(this.engine.query_template('lazy/mold/template.nja')).to.be
+            .false;
+        var results = [];
+        var cb = function(err, tmpl) {
+            results.push(tmpl.render());
+            if (results.length < 2) {
+                return;
+            }
+            expect(results).to.deep.equal(['lazy', 'lazy']);
+            // only loaded the once.
+            expect(lazy_scripts().length).to.equal(1);
+            expect(self.engine._lazy_loaded['lazy/mold']).to.be.true;
+            done();
+        };
+        this.engine.load_mold('lazy/mold', cb);
+        this.engine.load_mold('lazy/mold', cb);
+    });
+
+    it('test lazy load mold with referenced molds', function(done) {
+        var self = this;
+        this.engine.load_mold('main/mold', function(err, tmpl) {
+            expect(tmpl.render()).to.equal('main');
+            // the script for the referenced mold is also loaded.
+            expect(self.engine.query_template('other/mold/template.nja'))
+                .to.be.true;
+            expect(self.engine._lazy_scripts[self.other_script]).to.be
+                .true;
+            self.engine.load_mold('other/mold', function(err, tmpl) {
+                expect(tmpl.render()).to.equal('other');
+                expect(lazy_scripts().length).to.equal(2);
+                done();
+            });
+        });
+    });
+
+});
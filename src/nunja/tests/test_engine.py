@@ -1,14 +1,39 @@
 # -*- coding: utf-8 -*-
 import unittest
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
 from os import remove
+from os import utime
 
 from jinja2 import TemplateNotFound
+from jinja2 import UndefinedError
 
 from nunja.engine import Engine
 from nunja.engine import JinjaEngine
+from nunja.engine import buffer_stream
 from nunja.testing import mocks
 
 
+class BufferStreamTestCase(unittest.TestCase):
+
+    def test_unbuffered(self):
+        self.assertEqual(
+            list(buffer_stream(iter(['a', '', 'bc', 'd']))), ['a', 'bc', 'd'])
+
+    def test_buffered(self):
+        self.assertEqual(list(buffer_stream(
+            iter(['a', 'b', 'cde', 'f', '', 'g']), buffer_size=3,
+        )), ['abcde', 'fg'])
+        self.assertEqual(list(buffer_stream(iter([]), buffer_size=3)), [])
+
+    def test_encoded(self):
+        self.assertEqual(list(buffer_stream(
+            iter([u'\u3042', u'a', u'b']), buffer_size=4, encoding='utf-8',
+        )), [b'\xe3\x81\x82a', b'b'])
+
+
 class EngineTestCase(unittest.TestCase):
     """
     The core engine test case for testing the integration with the
@@ -50,6 +75,177 @@ class EngineTestCase(unittest.TestCase):
             # as that was removed
             template.render(data='Hello World!')
 
+    def test_load_mold_cached(self):
+        template = self.engine.load_mold('tmp/mold')
+        self.assertIs(template, self.engine.load_mold('tmp/mold'))
+
+        with open(self.main_template, 'w') as fd:
+            fd.write('<p>{% include "tmp/mold/sub.nja" %}</p>')
+        # ensure the modification is visible.
+        utime(self.main_template, (0, 0))
+
+        reloaded = self.engine.load_mold('tmp/mold')
+        self.assertIsNot(template, reloaded)
+        self.assertEqual(
+            reloaded.render(data='Hello'), '<p><span>Hello</span></p>')
+        self.assertEqual(
+            self.engine.execute('tmp/mold', {'data': 'Hello'}),
+            '<div data-nunja="tmp/mold">\n<p><span>Hello</span></p>\n'
+            '</div>'
+        )
+
+    def test_load_mold_production(self):
+        engine = Engine(self.engine.registry, production=True)
+        self.assertFalse(engine.env.auto_reload)
+        template = engine.load_mold('tmp/mold')
+
+        with open(self.main_template, 'w') as fd:
+            fd.write('<p>{% include "tmp/mold/sub.nja" %}</p>')
+        utime(self.main_template, (0, 0))
+
+        self.assertIs(template, engine.load_mold('tmp/mold'))
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+
+        engine.invalidate('tmp/mold')
+        self.assertEqual(
+            engine.render('tmp/mold', {'data': 'Hello'}),
+            '<p><span>Hello</span></p>')
+
+    def test_load_mold_no_auto_reload(self):
+        engine = Engine(self.engine.registry, auto_reload=False)
+        self.assertFalse(engine.env.auto_reload)
+        self.assertFalse(engine.env.loader.auto_reload)
+        template = engine.load_mold('tmp/mold')
+
+        with open(self.main_template, 'w') as fd:
+            fd.write('<p>{% include "tmp/mold/sub.nja" %}</p>')
+        utime(self.main_template, (0, 0))
+        self.assertIs(template, engine.load_mold('tmp/mold'))
+
+    def test_production_loader(self):
+        engine = Engine(
+            self.engine.registry, production=True, auto_reload=10)
+        self.assertFalse(engine.env.loader.auto_reload)
+
+    def test_load_mold_auto_reload_interval(self):
+        engine = Engine(self.engine.registry, auto_reload=3600)
+        self.assertTrue(engine.env.auto_reload)
+        self.assertEqual(engine.env.loader.auto_reload, 3600)
+        template = engine.load_mold('tmp/mold')
+
+        with open(self.main_template, 'w') as fd:
+            fd.write('<p>{% include "tmp/mold/sub.nja" %}</p>')
+        utime(self.main_template, (0, 0))
+        # not checked until the interval has passed.
+        self.assertIs(template, engine.load_mold('tmp/mold'))
+
+    def test_invalidate_all(self):
+        engine = Engine(self.engine.registry, production=True)
+        template = engine.load_mold('tmp/mold')
+        core_template = engine._core_template_
+        engine.invalidate()
+        self.assertIsNot(template, engine.load_mold('tmp/mold'))
+        self.assertIsNot(core_template, engine._core_template_)
+        self.assertEqual(
+            engine.execute('tmp/mold', {'data': 'Hello'}),
+            '<div data-nunja="tmp/mold">\n<div><span>Hello</span></div>\n'
+            '</div>'
+        )
+
+    def test_execute_data_not_copied(self):
+        class Data(Mapping):
+            # only lookups are permitted.
+            def __getitem__(self, key):
+                if key == 'data':
+                    return 'Hello'
+                raise KeyError(key)
+
+            def __iter__(self):
+                raise AssertionError('data should not be copied')
+
+            def __len__(self):
+                raise AssertionError('data should not be copied')
+
+        self.assertEqual(
+            self.engine.execute('tmp/mold', Data()),
+            '<div data-nunja="tmp/mold">\n<div><span>Hello</span></div>\n'
+            '</div>'
+        )
+
+    def test_execute_layered_context(self):
+        self.engine.env.globals['greeting'] = 'Hi'
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<span>{{ greeting }} {{ data }} {{ _wrapper_tag_ }}'
+                     '</span>')
+        data = {'data': 'there', '_wrapper_tag_': 'ignored'}
+        self.assertEqual(
+            self.engine.execute('tmp/mold', data, wrapper_tag='p'),
+            '<p data-nunja="tmp/mold">\n<div><span>Hi there p</span></div>\n'
+            '</p>'
+        )
+        self.assertEqual(data, {'data': 'there', '_wrapper_tag_': 'ignored'})
+
+    def test_execute_error(self):
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<span>{{ data.missing.value }}</span>')
+        with self.assertRaises(UndefinedError):
+            self.engine.execute('tmp/mold', {'data': {}})
+
+    def test_execute_stream(self):
+        chunks = list(self.engine.execute_stream('tmp/mold', {'data': 'Hi'}))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(
+            ''.join(chunks), self.engine.execute('tmp/mold', {'data': 'Hi'}))
+
+        chunks = list(self.engine.execute_stream(
+            'tmp/mold', {'data': u'\u3042'}, wrapper_tag='section',
+            buffer_size=1024, encoding='utf-8',
+        ))
+        self.assertEqual(chunks, [
+            b'<section data-nunja="tmp/mold">\n'
+            b'<div><span>\xe3\x81\x82</span></div>\n</section>'
+        ])
+
+    def test_render_stream(self):
+        chunks = list(self.engine.render_stream(
+            'tmp/mold', {'data': 'Hi'}, encoding='utf-8'))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), b'<div><span>Hi</span></div>')
+
+    def test_render_many(self):
+        datasets = [{'data': str(i)} for i in range(5)]
+        results = self.engine.render_many('tmp/mold', iter(datasets))
+        self.assertEqual(list(results), [
+            self.engine.render('tmp/mold', data) for data in datasets])
+        self.assertEqual(list(self.engine.render_many(
+            'tmp/mold', datasets, wrapped=True, wrapper_tag='li',
+        )), [
+            self.engine.execute('tmp/mold', data, wrapper_tag='li')
+            for data in datasets
+        ])
+        # data is not modified.
+        self.assertEqual(datasets[0], {'data': '0'})
+
+    def test_render_many_globals_errors(self):
+        with open(self.main_template, 'w') as fd:
+            fd.write('{{ prefix }}{{ data.value + 1 }}')
+        self.engine.env.globals['prefix'] = '>'
+        self.assertEqual(list(self.engine.render_many('tmp/mold', [
+            {'data': {'value': 1}}, {'data': {'value': 2}, 'prefix': '<'},
+        ])), ['&gt;2', '&lt;3'])
+        with self.assertRaises(TypeError):
+            list(self.engine.render_many('tmp/mold', [
+                {'data': {'value': 1}}, {'data': {'value': 'x'}}]))
+
+    def test_render_many_processes(self):
+        datasets = [{'data': str(i)} for i in range(10)]
+        self.assertEqual(list(self.engine.render_many(
+            'tmp/mold', iter(datasets), wrapped=True, processes=2,
+            chunksize=3,
+        )), [self.engine.execute('tmp/mold', data) for data in datasets])
+
     def test_fetch_path_basic(self):
         tmpl = self.engine.fetch_path('tmp/mold/template.nja')
         self.assertEqual('<div>{% include "tmp/mold/sub.nja" %}</div>', tmpl)
@@ -127,6 +323,18 @@ class JinjaEngineTestCase(unittest.TestCase):
             # as that was removed
             template.render(data='Hello World!')
 
+    def test_no_auto_reload(self):
+        engine = JinjaEngine(self.engine.registry, auto_reload=False)
+        template = engine.load_template('templates/mold/template.nja')
+        template.render(data='Hello World!')
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<div>{{ data }}</div>')
+        self.assertIs(
+            template, engine.load_template('templates/mold/template.nja'))
+        self.assertEqual(
+            template.render(data='Hello World!'),
+            '<div><span>Hello World!</span></div>')
+
     def test_fetch_path_basic(self):
         tmpl = self.engine.fetch_path('templates/mold/template.nja')
         self.assertEqual(
@@ -6,13 +6,41 @@ from os.path import dirname
 from os.path import pardir
 from os import remove
 
+from contextlib import contextmanager
+
 from jinja2 import TemplateNotFound
 
+from nunja import loader as nunja_loader
 from nunja.loader import NunjaLoader
 
 from nunja.testing.mocks import setup_tmp_mold_templates_registry
 
 
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@contextmanager
+def pretend_getmtime():
+    calls = []
+    getmtime = nunja_loader.getmtime
+
+    def counted(path):
+        calls.append(path)
+        return getmtime(path)
+
+    nunja_loader.getmtime = counted
+    try:
+        yield calls
+    finally:
+        nunja_loader.getmtime = getmtime
+
+
 class LoaderTestCase(unittest.TestCase):
     """
     There is a bit of coupling with registry as that is the only
@@ -28,6 +56,14 @@ class LoaderTestCase(unittest.TestCase):
         src, p, checker = loader.get_source(None, 'tmp/mold/sub.nja')
         self.assertEqual(src, '<span>{{ data }}</span>')
 
+    def test_loader_list_templates(self):
+        loader = NunjaLoader(self.registry)
+        self.assertEqual(
+            loader.list_templates(),
+            sorted(self.registry.iter_template_names()),
+        )
+        self.assertIn('tmp/mold/sub.nja', loader.list_templates())
+
     def test_loader_core_notfound_checks(self):
         loader = NunjaLoader(self.registry)
         with self.assertRaises(TemplateNotFound):
@@ -43,6 +79,35 @@ class LoaderTestCase(unittest.TestCase):
         remove(self.sub_template)
         self.assertFalse(checker())
 
+    def test_loader_no_reload_checker(self):
+        loader = NunjaLoader(self.registry, auto_reload=False)
+        src, p, checker = loader.get_source(None, 'tmp/mold/sub.nja')
+        remove(self.sub_template)
+        self.assertTrue(checker())
+
+    def test_loader_interval_reload_checker(self):
+        timer = FakeTimer()
+        loader = NunjaLoader(self.registry, auto_reload=10, timer=timer)
+        src, p, checker = loader.get_source(None, 'tmp/mold/sub.nja')
+        self.assertTrue(checker())
+        remove(self.sub_template)
+        timer.now = 9
+        # not checked yet.
+        self.assertTrue(checker())
+        timer.now = 10
+        self.assertFalse(checker())
+
+    def test_loader_interval_reload_checker_stats(self):
+        timer = FakeTimer()
+        loader = NunjaLoader(self.registry, auto_reload=10, timer=timer)
+        src, p, checker = loader.get_source(None, 'tmp/mold/sub.nja')
+        with pretend_getmtime() as calls:
+            for i in range(100):
+                timer.now = i
+                self.assertTrue(checker())
+        # once every 10 seconds from the first one at 10.
+        self.assertEqual(len(calls), 9)
+
     def test_loader_traversal_safety(self):
         loader = NunjaLoader(self.registry)
 
@@ -2,6 +2,8 @@
 import unittest
 
 from os import mkdir
+from os import remove
+from os.path import dirname
 from os.path import exists
 from os.path import join
 from os.path import sep
@@ -21,7 +23,9 @@ from calmjs.testing.utils import mkdtemp_singleton
 from calmjs.utils import pretty_logging
 
 from nunja.testing.mocks import setup_tmp_module
+from nunja.testing.mocks import setup_tmp_jinja_templates_registry
 from nunja.testing.mocks import setup_tmp_mold_templates
+from nunja.testing.mocks import setup_tmp_mold_templates_registry
 from nunja.testing.mocks import stub_mod_mock_resources_filename
 
 basic_tmpl_str = '<span>{{ value }}</span>\n'
@@ -147,6 +151,26 @@ class MoldRegistryTestCase(unittest.TestCase):
             ],
         )
 
+        self.assertEqual(sorted(registry.iter_template_names()), [
+            'nunja.testing.molds/basic/template.nja',
+            'nunja.testing.molds/include_by_name/empty.nja',
+            'nunja.testing.molds/include_by_name/template.nja',
+            'nunja.testing.molds/include_by_value/template.nja',
+            'nunja.testing.molds/itemlist/template.nja',
+            'nunja.testing.molds/noinit/template.nja',
+            'nunja.testing.molds/problem/template.nja',
+        ])
+
+    def test_update_mold(self):
+        registry, main_template, sub_template = (
+            setup_tmp_mold_templates_registry(self))
+        path = dirname(main_template)
+        registry.update_mold('tmp/other', path)
+        self.assertEqual(registry.molds['tmp/other'], path)
+        remove(main_template)
+        registry.update_mold('tmp/other', path)
+        self.assertNotIn('tmp/other', registry.molds)
+
     def test_registry_load_entry_point_missing_attrs(self):
         working_set = mocks.WorkingSet({
             'nunja.mold': [
@@ -409,6 +433,20 @@ class JinjaTemplateRegistryTestCase(unittest.TestCase):
             'nunja.testing.templates/noinit/template.nja',
             'nunja.testing.templates/problem/template.nja',
         ], sorted(registry.templates.keys()))
+        self.assertEqual(
+            sorted(registry.templates.keys()),
+            list(registry.iter_template_names()),
+        )
+
+    def test_update_template(self):
+        registry, main_template, sub_template = (
+            setup_tmp_jinja_templates_registry(self))
+        registry.update_template('templates/mold/other.nja', sub_template)
+        self.assertEqual(
+            registry.templates['templates/mold/other.nja'], sub_template)
+        remove(sub_template)
+        registry.update_template('templates/mold/other.nja', sub_template)
+        self.assertNotIn('templates/mold/other.nja', registry.templates)
 
     def test_incompat_with_molds(self):
         # molds will fail on this.
@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
+import json
 import unittest
+from errno import ENOSPC
+from collections import OrderedDict
 
 from os import chdir
+from os import listdir
+from os import remove
 from os.path import exists
+from os.path import getsize
 from os.path import join
 
 from pkg_resources import resource_filename
 from pkg_resources import Requirement
 
+from calmjs.cli import NodeDriver
 from calmjs.exc import AdviceAbort
 from calmjs.npm import Driver
 from calmjs.toolchain import Spec
@@ -15,12 +22,34 @@ from calmjs.toolchain import BEFORE_COMPILE
 from calmjs.utils import pretty_logging
 from calmjs.utils import which
 
+from nunja import spec as spec_module
+from nunja.spec import NUNJA_PRECOMP_BACKEND
+from nunja.spec import NUNJA_PRECOMP_CACHE_DIR
+from nunja.spec import NUNJA_PRECOMP_JOBS
+from nunja.spec import NUNJA_PRECOMP_LAZY
+from nunja.spec import NUNJA_PRECOMP_MANIFEST
+from nunja.spec import NUNJA_PRECOMP_PRUNE
+from nunja.spec import NUNJA_PRECOMP_REPORT
+from nunja.spec import NUNJA_PRECOMP_SHARED
+from nunja.spec import CachedPrecompiler
+from nunja.spec import NunjucksPrecompileWorker
+from nunja.spec import PrecompileCache
+from nunja.spec import apply_extras
+from nunja.spec import get_precompile_jobs
+from nunja.spec import get_nunjucks_version
+from nunja.spec import get_precompiler
 from nunja.spec import nunjucks_nja_patt
+from nunja.spec import nunjucks_precompile
+from nunja.spec import precompile_key
 from nunja.spec import precompile_nunja
+from nunja.spec import precompile_nunja_rjs
+from nunja.spec import precompile_nunja_webpack
 from nunja.spec import rjs
 from nunja.spec import webpack
 from nunja.spec import to_hex
 
+from nunja.testing.mocks import setup_fake_nunjucks
+
 from calmjs.testing.mocks import StringIO
 from calmjs.testing.utils import mkdtemp
 from calmjs.testing.utils import remember_cwd
@@ -77,6 +106,157 @@ class NameTestCase(unittest.TestCase):
         self.assertAllInvalid(nunjucks_nja_patt.match, invalid)
 
 
+class PrecompileJobsTestCase(unittest.TestCase):
+
+    def test_get_precompile_jobs(self):
+        self.assertEqual(get_precompile_jobs(Spec()), 1)
+        self.assertEqual(get_precompile_jobs(Spec(
+            nunja_precompile_jobs=4)), 4)
+        self.assertEqual(get_precompile_jobs(Spec(
+            nunja_precompile_jobs='8')), 8)
+        self.assertGreaterEqual(get_precompile_jobs(Spec(
+            nunja_precompile_jobs=0)), 1)
+
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            self.assertEqual(get_precompile_jobs(Spec(
+                nunja_precompile_jobs='many')), 1)
+        self.assertIn("invalid value 'many'", stream.getvalue())
+
+    def test_apply_extras(self):
+        spec = Spec()
+        apply_extras(spec, ['slim'])
+        self.assertNotIn(NUNJA_PRECOMP_JOBS, spec)
+        apply_extras(spec, ['jobs_16', 'slim'])
+        self.assertEqual(get_precompile_jobs(spec), 16)
+        self.assertNotIn(NUNJA_PRECOMP_PRUNE, spec)
+        apply_extras(spec, ['prune'])
+        self.assertTrue(spec[NUNJA_PRECOMP_PRUNE])
+        self.assertNotIn(NUNJA_PRECOMP_SHARED, spec)
+        apply_extras(spec, ['shared'])
+        self.assertTrue(spec[NUNJA_PRECOMP_SHARED])
+        apply_extras(spec, ['lazy'])
+        self.assertTrue(spec[NUNJA_PRECOMP_LAZY])
+
+    def test_rjs_webpack_advice_jobs(self):
+        spec = Spec()
+        rjs(spec, ['jobs_3'])
+        self.assertEqual(get_precompile_jobs(spec), 3)
+        spec = Spec()
+        webpack(spec, ['jobs_5'])
+        self.assertEqual(get_precompile_jobs(spec), 5)
+
+
+class PrecompileCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.src_dir = mkdtemp(self)
+        self.template = join(self.src_dir, 'template.nja')
+        with open(self.template, 'w') as fd:
+            fd.write('<p>Hello</p>')
+
+    def test_precompile_key(self):
+        key = precompile_key(self.template, 'some/mold/template.nja', '3.0.0')
+        self.assertEqual(key, precompile_key(
+            self.template, 'some/mold/template.nja', '3.0.0'))
+        self.assertNotEqual(key, precompile_key(
+            self.template, 'some/mold/template.nja', '3.0.1'))
+        self.assertNotEqual(key, precompile_key(
+            self.template, 'some/mold/other.nja', '3.0.0'))
+        with open(self.template, 'w') as fd:
+            fd.write('<p>Hello!</p>')
+        self.assertNotEqual(key, precompile_key(
+            self.template, 'some/mold/template.nja', '3.0.0'))
+
+    def test_cache_get_set(self):
+        cache = PrecompileCache(mkdtemp(self), '3.0.0')
+        key = cache.key(self.template, 'some/mold/template.nja')
+        self.assertIsNone(cache.get(key))
+        cache.set(key, u'compiled \u306a')
+        self.assertEqual(cache.get(key), u'compiled \u306a')
+        self.assertTrue(exists(cache.path(key)))
+        # replacing existing entries is fine.
+        cache.set(key, u'compiled')
+        self.assertEqual(cache.get(key), u'compiled')
+
+    def test_cache_set_failures(self):
+        cache_dir = mkdtemp(self)
+        cache = PrecompileCache(cache_dir, '3.0.0')
+        key = cache.key(self.template, 'some/mold/template.nja')
+        # a file in place of the directory for the entry.
+        with open(join(cache_dir, key[:2]), 'w') as fd:
+            fd.write('')
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            cache.set(key, u'compiled')
+        self.assertIn('failed to create cache entry', stream.getvalue())
+        self.assertIsNone(cache.get(key))
+
+    def test_cache_set_write_failure(self):
+        original_fdopen = spec_module.fdopen
+
+        class FullStream(object):
+            def __init__(self, fd, mode):
+                self.stream = original_fdopen(fd, mode)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                self.stream.close()
+
+            def write(self, data):
+                raise IOError(ENOSPC, 'No space left on device')
+
+        self.addCleanup(setattr, spec_module, 'fdopen', original_fdopen)
+        spec_module.fdopen = FullStream
+        cache_dir = mkdtemp(self)
+        cache = PrecompileCache(cache_dir, '3.0.0')
+        key = cache.key(self.template, 'some/mold/template.nja')
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            cache.set(key, u'compiled')
+        self.assertIn('failed to write cache entry', stream.getvalue())
+        self.assertIsNone(cache.get(key))
+        # the temporary file is removed.
+        self.assertEqual(listdir(join(cache_dir, key[:2])), [])
+
+    def test_cached_precompiler(self):
+        calls = []
+
+        def precompiler(path, name):
+            calls.append(name)
+            return None if name.endswith('bad.nja') else 'code:' + name
+
+        cached = CachedPrecompiler(
+            precompiler, PrecompileCache(mkdtemp(self), '3.0.0'))
+        self.assertEqual(cached(self.template, 'a/b/t.nja'), 'code:a/b/t.nja')
+        self.assertEqual(cached(self.template, 'a/b/t.nja'), 'code:a/b/t.nja')
+        self.assertIsNone(cached(self.template, 'a/b/bad.nja'))
+        self.assertIsNone(cached(self.template, 'a/b/bad.nja'))
+        missing = join(self.src_dir, 'missing.nja')
+        self.assertIsNone(cached(missing, 'a/b/bad.nja'))
+        self.assertEqual(calls, [
+            'a/b/t.nja', 'a/b/bad.nja', 'a/b/bad.nja', 'a/b/bad.nja'])
+        self.assertEqual(cached.hits, 1)
+        self.assertEqual(cached.misses, 3)
+        cached.close()
+
+    def test_get_nunjucks_version(self):
+        setup_fake_nunjucks(self, version='3.0.1')
+        self.assertEqual(get_nunjucks_version(), '3.0.1')
+        chdir(self.src_dir)
+        self.assertIsNone(get_nunjucks_version())
+
+    def test_get_precompiler_no_version(self):
+        remember_cwd(self)
+        chdir(self.src_dir)
+        spec = Spec()
+        spec[NUNJA_PRECOMP_CACHE_DIR] = mkdtemp(self)
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompiler = get_precompiler(spec)
+        self.assertTrue(isinstance(precompiler, NunjucksPrecompileWorker))
+        self.assertIn(
+            'cannot determine the version of nunjucks', stream.getvalue())
+
+
 class SpecGeneralTestCase(unittest.TestCase):
     """
     Test out the precompile template process using the generic function.
@@ -193,6 +373,614 @@ class SpecGeneralTestCase(unittest.TestCase):
         self.assertNotIn('nunjucks', spec['bundle_sourcepath'])
 
 
+@unittest.skipIf(which('node') is None, 'node not found.')
+class PrecompileWorkerTestCase(unittest.TestCase):
+    """
+    Test the long-lived precompile worker against a fake nunjucks.
+    """
+
+    def setUp(self):
+        self.root = setup_fake_nunjucks(self, version='3.0.1')
+        self.src_dir = mkdtemp(self)
+        self.good = join(self.src_dir, 'good.nja')
+        self.bad = join(self.src_dir, 'bad.nja')
+        with open(self.good, 'w') as fd:
+            fd.write('<p>Hello</p>')
+        with open(self.bad, 'w') as fd:
+            fd.write('<p>Hello {%World%}</p>')
+
+    def test_get_precompiler(self):
+        self.assertTrue(isinstance(
+            get_precompiler(Spec()), NunjucksPrecompileWorker))
+        self.assertIs(get_precompiler(Spec(
+            nunja_precompile_backend='process')), nunjucks_precompile)
+
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompiler = get_precompiler(Spec(
+                nunja_precompile_backend='no_such_backend'))
+        self.assertTrue(isinstance(precompiler, NunjucksPrecompileWorker))
+        self.assertIn("unknown precompile backend", stream.getvalue())
+
+    def test_worker_matches_process(self):
+        with NunjucksPrecompileWorker() as worker:
+            self.assertEqual(
+                worker(self.good, 'some/mold/good.nja'),
+                nunjucks_precompile(self.good, 'some/mold/good.nja'),
+            )
+            self.assertEqual(worker.version, '3.0.1')
+            process = worker.process
+            self.assertIn('"some/mold/good.nja"', worker(
+                self.good, 'some/mold/good.nja'))
+            # still the same process.
+            self.assertIs(worker.process, process)
+        self.assertIsNone(worker.process)
+
+    def test_worker_cache_extension(self):
+        target = join(self.src_dir, 'cache.nja')
+        with open(target, 'w') as fd:
+            fd.write('{% cache 1 %}<p>Hello</p>{% endcache %}')
+        with NunjucksPrecompileWorker() as worker:
+            self.assertIn('<p>Hello</p>', worker(target, 'some/mold/c.nja'))
+        self.assertIn('<p>Hello</p>', nunjucks_precompile(
+            target, 'some/mold/c.nja'))
+
+    def test_worker_error(self):
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            with NunjucksPrecompileWorker() as worker:
+                self.assertIsNone(worker(self.bad, 'some/mold/bad.nja'))
+                # the worker survives the failure.
+                self.assertIsNotNone(worker(self.good, 'some/mold/good.nja'))
+
+        err = stream.getvalue()
+        self.assertIn('failed to precompile', err)
+        self.assertIn('Template render error: (some/mold/bad.nja)', err)
+
+    def test_worker_fallback_startup_failure(self):
+        # moving out of the working directory will hide nunjucks.
+        chdir(self.src_dir)
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            with NunjucksPrecompileWorker() as worker:
+                self.assertIsNone(worker(self.good, 'some/mold/good.nja'))
+                self.assertTrue(worker.failed)
+
+        err = stream.getvalue()
+        self.assertIn('precompile worker failed to initialize', err)
+        self.assertIn('falling back to one node process per template', err)
+
+    def test_worker_fallback_binary_missing(self):
+        driver = NodeDriver(node_bin='no_such_node_binary')
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            with NunjucksPrecompileWorker(driver=driver) as worker:
+                self.assertFalse(worker.start())
+                self.assertIsNone(worker.process)
+                self.assertTrue(worker.failed)
+
+        err = stream.getvalue()
+        self.assertIn(
+            'failed to start precompile worker: no_such_node_binary '
+            'not found', err)
+        self.assertIn('falling back to one node process per template', err)
+
+    def test_worker_fallback_terminated(self):
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            with NunjucksPrecompileWorker() as worker:
+                self.assertTrue(worker.start())
+                worker.process.kill()
+                worker.process.wait()
+                result = worker(self.good, 'some/mold/good.nja')
+                self.assertTrue(worker.failed)
+
+        self.assertIn('"some/mold/good.nja"', result)
+        self.assertIn(
+            "precompile worker terminated while processing", stream.getvalue())
+
+    def test_precompile_nunja_backends(self):
+        results = []
+        for backend in ('worker', 'process'):
+            build_dir = mkdtemp(self)
+            spec = Spec(
+                build_dir=build_dir,
+                plugin_sourcepath={
+                    'text!some/mold/template.nja': self.good,
+                    'text!some/mold/bad.nja': self.bad,
+                    'text!other/mold/template.nja': self.good,
+                },
+                bundle_sourcepath={},
+            )
+            spec[NUNJA_PRECOMP_BACKEND] = backend
+            with pretty_logging('nunja', stream=StringIO()):
+                precompile_nunja(
+                    spec, False, 'plugin_sourcepath', 'bundle_sourcepath')
+            with open(spec['bundle_sourcepath']['__nunja__/some/mold']) as fd:
+                results.append(fd.read())
+
+        self.assertEqual(results[0], results[1])
+        self.assertIn('"some/mold/template.nja"', results[0])
+        self.assertNotIn('"some/mold/bad.nja"', results[0])
+
+    def test_precompile_nunja_parallel_identical(self):
+        names = ['text!mold/m%d/t%d.nja' % (i % 3, i) for i in range(12)]
+        for idx, name in enumerate(names):
+            with open(join(self.src_dir, '%d.nja' % idx), 'w') as fd:
+                fd.write('<p>%d</p>' % idx)
+
+        def build(jobs):
+            build_dir = mkdtemp(self)
+            spec = Spec(
+                build_dir=build_dir,
+                plugin_sourcepath={
+                    name: join(self.src_dir, '%d.nja' % idx)
+                    for idx, name in enumerate(names)
+                },
+                bundle_sourcepath={},
+            )
+            spec[NUNJA_PRECOMP_JOBS] = jobs
+            precompile_nunja(
+                spec, True, 'plugin_sourcepath', 'bundle_sourcepath')
+            results = {}
+            for modname, path in spec['bundle_sourcepath'].items():
+                with open(path) as fd:
+                    results[modname] = fd.read()
+            return results
+
+        serial = build(1)
+        self.assertEqual(sorted(serial), [
+            '__nunja__/mold/m0', '__nunja__/mold/m1', '__nunja__/mold/m2'])
+        self.assertEqual(build(4), serial)
+        self.assertEqual(build(32), serial)
+
+    def test_precompile_nunja_streamed_interleaved(self):
+        names = [
+            'text!mold/a/1.nja', 'text!mold/b/2.nja',
+            'text!mold/a/3.nja', 'text!mold/b/4.nja',
+            'text!mold/a/5.nja',
+        ]
+        plugin_sourcepath = OrderedDict()
+        for name in names:
+            path = join(self.src_dir, name.split('/')[-1])
+            with open(path, 'w') as fd:
+                fd.write(name)
+            plugin_sourcepath[name] = path
+
+        spec = Spec(
+            build_dir=mkdtemp(self),
+            plugin_sourcepath=plugin_sourcepath,
+            bundle_sourcepath={},
+        )
+        precompile_nunja(spec, False, 'plugin_sourcepath', 'bundle_sourcepath')
+
+        with open(spec['bundle_sourcepath']['__nunja__/mold/a']) as fd:
+            mold_a = fd.read()
+        with open(spec['bundle_sourcepath']['__nunja__/mold/b']) as fd:
+            mold_b = fd.read()
+
+        self.assertEqual(mold_a.count('nunjucksPrecompiled = '), 3)
+        self.assertLess(mold_a.index('1.nja'), mold_a.index('3.nja'))
+        self.assertLess(mold_a.index('3.nja'), mold_a.index('5.nja'))
+        self.assertNotIn('mold/b', mold_a)
+        self.assertEqual(mold_b.count('nunjucksPrecompiled = '), 2)
+        self.assertLess(mold_b.index('2.nja'), mold_b.index('4.nja'))
+
+    def test_precompile_nunja_prune(self):
+        templates = {
+            'text!mold/a/template.nja': '{% include "mold/a/row.nja" %}',
+            'text!mold/a/row.nja': '{% include "mold/b/cell.nja" %}',
+            'text!mold/a/unused.nja': '<p>unused</p>',
+            'text!mold/b/template.nja': '<table></table>',
+            'text!mold/b/cell.nja': '<td></td>',
+            'text!mold/c/orphan.nja': '<p>orphan</p>',
+            'text!_core_/_default_wrapper_/template.nja': (
+                '<{{ _wrapper_tag_ }}>{% include _template_ %}'
+                '</{{ _wrapper_tag_ }}>'),
+        }
+        plugin_sourcepath = {}
+        for idx, (modname, source) in enumerate(templates.items()):
+            path = plugin_sourcepath[modname] = join(
+                self.src_dir, '%d.nja' % idx)
+            with open(path, 'w') as fd:
+                fd.write(source)
+
+        def build(slim, prune):
+            spec = Spec(
+                build_dir=mkdtemp(self),
+                plugin_sourcepath=dict(plugin_sourcepath),
+                bundle_sourcepath={},
+            )
+            spec[NUNJA_PRECOMP_PRUNE] = prune
+            with pretty_logging('nunja', stream=StringIO()) as stream:
+                precompile_nunja(
+                    spec, slim, 'plugin_sourcepath', 'bundle_sourcepath')
+            bundles = {}
+            for modname, path in spec['bundle_sourcepath'].items():
+                with open(path) as fd:
+                    bundles[modname] = fd.read()
+            return spec, bundles, stream.getvalue()
+
+        spec, bundles, log = build(False, False)
+        self.assertIn('__nunja__/mold/c', bundles)
+        self.assertIn('mold/a/unused.nja', bundles['__nunja__/mold/a'])
+
+        spec, bundles, log = build(False, True)
+        # the include in the wrapper does not prevent the pruning.
+        self.assertIn('pruned 2 templates', log)
+        self.assertEqual(sorted(bundles), [
+            '__nunja__/_core_/_default_wrapper_', '__nunja__/mold/a',
+            '__nunja__/mold/b',
+        ])
+        self.assertNotIn('mold/a/unused.nja', bundles['__nunja__/mold/a'])
+        self.assertIn('mold/a/row.nja', bundles['__nunja__/mold/a'])
+        self.assertIn('mold/b/cell.nja', bundles['__nunja__/mold/b'])
+        # non-slim builds will leave the raw templates alone.
+        self.assertEqual(spec['plugin_sourcepath'], plugin_sourcepath)
+
+        spec, bundles, log = build(True, True)
+        self.assertEqual(spec['plugin_sourcepath'], {})
+
+        # a dynamic reference may be to any template, so none are pruned.
+        with open(plugin_sourcepath['text!mold/b/template.nja'], 'w') as fd:
+            fd.write('{% include tmpl %}')
+        spec, bundles, log = build(True, True)
+        self.assertIn(
+            "template 'mold/b/template.nja' has dynamic references; "
+            "treating all templates as reachable", log)
+        self.assertIn('pruned 0 templates', log)
+        self.assertIn('__nunja__/mold/c', bundles)
+        self.assertIn('mold/a/unused.nja', bundles['__nunja__/mold/a'])
+
+    def test_precompile_nunja_shared(self):
+        templates = {
+            'text!mold/a/template.nja': '{% include "mold/c/row.nja" %}',
+            'text!mold/b/template.nja': (
+                '{% include "mold/c/row.nja" %}'
+                '{% include "mold/c/cell.nja" %}'
+            ),
+            'text!mold/c/template.nja': '{% include "mold/c/cell.nja" %}',
+            'text!mold/c/row.nja': '<tr></tr>',
+            'text!mold/c/cell.nja': '<td></td>',
+            'text!mold/d/only.nja': '{% include "mold/d/only.nja" %}',
+        }
+        plugin_sourcepath = {}
+        for idx, (modname, source) in enumerate(templates.items()):
+            path = plugin_sourcepath[modname] = join(
+                self.src_dir, '%d.nja' % idx)
+            with open(path, 'w') as fd:
+                fd.write(source)
+
+        spec = Spec(
+            build_dir=mkdtemp(self),
+            plugin_sourcepath=dict(plugin_sourcepath),
+            bundle_sourcepath={},
+        )
+        spec[NUNJA_PRECOMP_SHARED] = True
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompile_nunja(
+                spec, True, 'plugin_sourcepath', 'bundle_sourcepath')
+
+        self.assertIn('moved 2 templates', stream.getvalue())
+        bundles = {}
+        for modname, path in spec['bundle_sourcepath'].items():
+            with open(path) as fd:
+                bundles[modname] = fd.read()
+
+        self.assertEqual(sorted(bundles), [
+            '__nunja__/__shared__', '__nunja__/mold/a', '__nunja__/mold/b',
+            '__nunja__/mold/c', '__nunja__/mold/d',
+        ])
+        self.assertIn('mold/c/row.nja', bundles['__nunja__/__shared__'])
+        self.assertIn('mold/c/cell.nja', bundles['__nunja__/__shared__'])
+        self.assertNotIn('mold/c/row.nja', bundles['__nunja__/mold/c'])
+        self.assertIn('mold/c/template.nja', bundles['__nunja__/mold/c'])
+        # only referenced by itself, so not shared.
+        self.assertIn('mold/d/only.nja', bundles['__nunja__/mold/d'])
+        # shared templates are also removed from a slim build.
+        self.assertEqual(spec['plugin_sourcepath'], {})
+
+    def test_precompile_nunja_rjs_index(self):
+        build_dir = mkdtemp(self)
+        spec = Spec(
+            build_dir=build_dir,
+            plugin_sourcepath={
+                'text!some/mold/template.nja': self.good,
+                'text!some/mold/bad.nja': self.bad,
+                'text!other/mold/template.nja': self.good,
+                'text!third/mold/bad.nja': self.bad,
+            },
+            bundle_sourcepath={},
+        )
+        with pretty_logging('nunja', stream=StringIO()):
+            precompile_nunja_rjs(spec)
+
+        with open(spec['bundle_sourcepath']['__nunja__/__index__']) as fd:
+            source = fd.read()
+        self.assertTrue(source.startswith('define([], function() {'))
+        # only the templates that got precompiled are listed.
+        self.assertEqual(json.loads(
+            source[source.index('return ') + 7:source.rindex(';\n})')]), {
+                '__nunja__/other/mold': ['other/mold/template.nja'],
+                '__nunja__/some/mold': ['some/mold/template.nja'],
+            })
+        self.assertNotIn('__nunja__/__index__', spec['shim'])
+
+        # reused molds are also listed.
+        with pretty_logging('nunja', stream=StringIO()):
+            precompile_nunja_rjs(spec)
+        with open(spec['bundle_sourcepath']['__nunja__/__index__']) as fd:
+            self.assertEqual(source, fd.read())
+
+        # nothing precompiled, no index.
+        spec = Spec(
+            build_dir=mkdtemp(self),
+            plugin_sourcepath={'text!third/mold/bad.nja': self.bad},
+            bundle_sourcepath={},
+        )
+        with pretty_logging('nunja', stream=StringIO()):
+            precompile_nunja_rjs(spec)
+        self.assertEqual(spec['bundle_sourcepath'], {})
+
+    def test_precompile_nunja_webpack_lazy(self):
+        export_dir = mkdtemp(self)
+
+        def make_spec(**kw):
+            spec = Spec(
+                build_dir=mkdtemp(self),
+                loaderplugin_sourcepath={
+                    'text!some/mold/template.nja': self.good,
+                    'text!other/mold/template.nja': self.good,
+                },
+                bundle_sourcepath={},
+                **kw
+            )
+            spec[NUNJA_PRECOMP_LAZY] = True
+            return spec
+
+        spec = make_spec(export_target=join(export_dir, 'bundle.js'))
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompile_nunja_webpack(spec)
+        self.assertIn('loaded lazily from 2 scripts', stream.getvalue())
+
+        self.assertEqual(
+            sorted(spec['bundle_sourcepath']), ['__nunja__/__lazy__'])
+        with open(spec['bundle_sourcepath']['__nunja__/__lazy__']) as fd:
+            source = fd.read()
+        self.assertEqual(json.loads(
+            source[source.index('return ') + 7:source.rindex(';\n})')]), {
+                'other/mold': ['__nunja__/other/mold.js'],
+                'some/mold': ['__nunja__/some/mold.js'],
+            })
+        with open(join(export_dir, '__nunja__', 'some', 'mold.js')) as fd:
+            self.assertIn('"some/mold/template.nja"', fd.read())
+        self.assertTrue(exists(
+            join(export_dir, '__nunja__', 'other', 'mold.js')))
+
+        # explicit directory.
+        lazy_dir = mkdtemp(self)
+        spec = make_spec(nunja_precompile_lazy_dir=lazy_dir)
+        with pretty_logging('nunja', stream=StringIO()):
+            precompile_nunja_webpack(spec)
+        self.assertTrue(exists(
+            join(lazy_dir, '__nunja__', 'other', 'mold.js')))
+
+        # no location, molds remain bundled.
+        spec = make_spec()
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompile_nunja_webpack(spec)
+        self.assertIn(
+            'unable to load precompiled molds lazily', stream.getvalue())
+        self.assertEqual(sorted(spec['bundle_sourcepath']), [
+            '__nunja__/other/mold', '__nunja__/some/mold'])
+
+    def test_precompile_nunja_webpack_lazy_references(self):
+        templates = {
+            'text!mold/a/template.nja': '{% include "mold/b/row.nja" %}',
+            'text!mold/b/template.nja': '<table></table>',
+            'text!mold/b/row.nja': '{% include "mold/c/cell.nja" %}',
+            'text!mold/c/template.nja': '<p></p>',
+            'text!mold/c/cell.nja': '<td></td>',
+            'text!mold/d/template.nja': '<p></p>',
+            'text!_core_/_default_wrapper_/template.nja': (
+                '<div>{% include _template_ %}</div>'),
+        }
+        sourcepath = {}
+        for idx, (modname, source) in enumerate(templates.items()):
+            path = sourcepath[modname] = join(self.src_dir, '%d.nja' % idx)
+            with open(path, 'w') as fd:
+                fd.write(source)
+
+        def build(slim):
+            spec = Spec(
+                build_dir=mkdtemp(self),
+                export_target=join(mkdtemp(self), 'bundle.js'),
+                loaderplugin_sourcepath=dict(sourcepath),
+                bundle_sourcepath={},
+            )
+            spec[NUNJA_PRECOMP_LAZY] = True
+            with pretty_logging('nunja', stream=StringIO()) as stream:
+                precompile_nunja_webpack(spec, slim)
+            with open(spec['bundle_sourcepath']['__nunja__/__lazy__']) as fd:
+                source = fd.read()
+            return json.loads(source[
+                source.index('return ') + 7:source.rindex(';\n})')
+            ]), stream.getvalue()
+
+        # the scripts for the molds with the referenced templates are
+        # also loaded, even where the templates are removed when slim.
+        lazy_molds, log = build(True)
+        self.assertEqual(lazy_molds, {
+            'mold/a': [
+                '__nunja__/mold/a.js', '__nunja__/mold/b.js',
+                '__nunja__/mold/c.js',
+            ],
+            'mold/b': ['__nunja__/mold/b.js', '__nunja__/mold/c.js'],
+            'mold/c': ['__nunja__/mold/c.js'],
+            'mold/d': ['__nunja__/mold/d.js'],
+            '_core_/_default_wrapper_': [
+                '__nunja__/_core_/_default_wrapper_.js'],
+        })
+
+        # a dynamic reference may be to any of the molds.
+        with open(sourcepath['text!mold/d/template.nja'], 'w') as fd:
+            fd.write('{% include tmpl %}')
+        lazy_molds, log = build(False)
+        self.assertEqual(lazy_molds['mold/d'], [
+            '__nunja__/mold/d.js', '__nunja__/_core_/_default_wrapper_.js',
+            '__nunja__/mold/a.js', '__nunja__/mold/b.js',
+            '__nunja__/mold/c.js',
+        ])
+        self.assertEqual(lazy_molds['mold/c'], ['__nunja__/mold/c.js'])
+        self.assertIn(
+            "template 'mold/d/template.nja' has dynamic references", log)
+
+    def test_precompile_nunja_cached(self):
+        cache_dir = mkdtemp(self)
+
+        def build():
+            spec = Spec(
+                build_dir=mkdtemp(self),
+                plugin_sourcepath={
+                    'text!some/mold/template.nja': self.good,
+                },
+                bundle_sourcepath={},
+            )
+            spec[NUNJA_PRECOMP_CACHE_DIR] = cache_dir
+            with pretty_logging('nunja', stream=StringIO()) as stream:
+                precompile_nunja(
+                    spec, True, 'plugin_sourcepath', 'bundle_sourcepath')
+            with open(spec['bundle_sourcepath']['__nunja__/some/mold']) as fd:
+                return fd.read(), stream.getvalue()
+
+        first, log = build()
+        self.assertIn('"some/mold/template.nja"', first)
+        # break the fake nunjucks, leaving only the package.json
+        remove(join(self.root, 'node_modules', 'nunjucks', 'index.js'))
+        second, log = build()
+        self.assertEqual(first, second)
+        self.assertNotIn('precompile worker failed', log)
+
+    def test_precompile_nunja_incremental(self):
+        build_dir = mkdtemp(self)
+        mold_a = join(self.src_dir, 'a.nja')
+        mold_b = join(self.src_dir, 'b.nja')
+        for path in (mold_a, mold_b):
+            with open(path, 'w') as fd:
+                fd.write('<p>original</p>')
+
+        def build():
+            spec = Spec(
+                build_dir=build_dir,
+                plugin_sourcepath={
+                    'text!mold/a/template.nja': mold_a,
+                    'text!mold/b/template.nja': mold_b,
+                    'text!mold/bad/template.nja': self.bad,
+                },
+                bundle_sourcepath={},
+            )
+            with pretty_logging('nunja', stream=StringIO()) as stream:
+                precompile_nunja(
+                    spec, True, 'plugin_sourcepath', 'bundle_sourcepath')
+            return spec, stream.getvalue()
+
+        spec, log = build()
+        self.assertTrue(exists(join(build_dir, NUNJA_PRECOMP_MANIFEST)))
+        self.assertEqual(sorted(spec['bundle_sourcepath']), [
+            '__nunja__/mold/a', '__nunja__/mold/b'])
+        self.assertEqual(list(spec['plugin_sourcepath']), [
+            'text!mold/bad/template.nja'])
+        self.assertIn('failed to precompile', log)
+
+        # mark the existing bundles to detect the ones regenerated.
+        for path in spec['bundle_sourcepath'].values():
+            with open(path, 'w') as fd:
+                fd.write('reused')
+        with open(mold_a, 'w') as fd:
+            fd.write('<p>modified</p>')
+
+        spec, log = build()
+        with open(spec['bundle_sourcepath']['__nunja__/mold/a']) as fd:
+            self.assertIn('modified', fd.read())
+        with open(spec['bundle_sourcepath']['__nunja__/mold/b']) as fd:
+            self.assertEqual('reused', fd.read())
+        # templates in reused molds are still removed for slim builds
+        self.assertEqual(list(spec['plugin_sourcepath']), [
+            'text!mold/bad/template.nja'])
+        self.assertIn('reusing 1 of 3 precompiled molds', log)
+        # failures are reported again.
+        self.assertIn('failed to precompile', log)
+
+        # a different version of nunjucks invalidates everything.
+        setup_fake_nunjucks(self, version='3.0.2')
+        spec, log = build()
+        with open(spec['bundle_sourcepath']['__nunja__/mold/b']) as fd:
+            self.assertIn('original', fd.read())
+        self.assertNotIn('reusing', log)
+
+    def test_precompile_nunja_report(self):
+        build_dir = mkdtemp(self)
+        spec = Spec(
+            build_dir=build_dir,
+            plugin_sourcepath={
+                'text!some/mold/template.nja': self.good,
+                'text!some/mold/bad.nja': self.bad,
+                'text!other/mold/template.nja': self.good,
+            },
+            bundle_sourcepath={},
+        )
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompile_nunja(
+                spec, False, 'plugin_sourcepath', 'bundle_sourcepath')
+
+        log = stream.getvalue()
+        self.assertIn('precompiled 3 templates into 2 molds', log)
+        self.assertIn('slowest template was', log)
+
+        with open(join(build_dir, NUNJA_PRECOMP_REPORT)) as fd:
+            report = json.load(fd)
+
+        some_mold = report['molds']['some/mold']
+        self.assertFalse(some_mold['reused'])
+        self.assertEqual(
+            some_mold['size'],
+            getsize(spec['bundle_sourcepath']['__nunja__/some/mold']),
+        )
+        self.assertEqual(
+            some_mold['templates']['some/mold/template.nja']['size'],
+            some_mold['size'],
+        )
+        self.assertIsNone(some_mold['templates']['some/mold/bad.nja']['size'])
+        self.assertGreaterEqual(
+            some_mold['templates']['some/mold/bad.nja']['time'], 0)
+        self.assertGreaterEqual(report['time'], 0)
+
+        # the subsequent build will reuse the molds.
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompile_nunja(
+                spec, False, 'plugin_sourcepath', 'bundle_sourcepath')
+        with open(join(build_dir, NUNJA_PRECOMP_REPORT)) as fd:
+            report = json.load(fd)
+        self.assertTrue(report['molds']['other/mold']['reused'])
+        self.assertEqual(report['molds']['other/mold']['templates'], {})
+        self.assertEqual(
+            report['molds']['other/mold']['size'],
+            getsize(spec['bundle_sourcepath']['__nunja__/other/mold']),
+        )
+
+    def test_precompile_nunja_incremental_bad_manifest(self):
+        build_dir = mkdtemp(self)
+        with open(join(build_dir, NUNJA_PRECOMP_MANIFEST), 'w') as fd:
+            fd.write('{')
+        spec = Spec(
+            build_dir=build_dir,
+            plugin_sourcepath={
+                'text!some/mold/template.nja': self.good,
+            },
+            bundle_sourcepath={},
+        )
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            precompile_nunja(
+                spec, False, 'plugin_sourcepath', 'bundle_sourcepath')
+        self.assertIn('ignoring unreadable manifest', stream.getvalue())
+        self.assertIn('__nunja__/some/mold', spec['bundle_sourcepath'])
+
+
 @unittest.skipIf(which('npm') is None, 'npm not found.')
 class SpecIntegrationTestCase(unittest.TestCase):
     """
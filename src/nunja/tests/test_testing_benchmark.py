@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from calmjs.testing.utils import stub_stdouts
+
+from nunja.engine import Engine
+from nunja.testing import benchmark
+from nunja.testing import mocks
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_table_row_data(self):
+        datasets = benchmark.table_row_data(2)
+        self.assertEqual(len(datasets), 2)
+        self.assertEqual(datasets[1]['data'], [{'id': '1', 'name': 'Name 1'}])
+
+    def test_bench_render_many(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_mold_templates_registry(self))
+        results = benchmark.bench_render_many(
+            engine=Engine(registry), mold_id='tmp/mold',
+            datasets=[{'data': 'x'}] * 10, repeat=1, processes=2,
+        )
+        self.assertEqual(
+            sorted(results), ['loop', 'render_many', 'render_many_processes'])
+
+    def test_bench_import(self):
+        results = benchmark.bench_import(repeat=1)
+        self.assertEqual(sorted(results), ['import', 'import_and_engine'])
+
+    def test_main(self):
+        stub_stdouts(self)
+        self.addCleanup(
+            setattr, benchmark, 'benchmarks', benchmark.benchmarks)
+        benchmark.benchmarks = {'dummy': lambda: {'a': 1.0}}
+        benchmark.main([])
+        self.assertEqual(
+            benchmark.sys.stdout.getvalue(), 'dummy: a: 1.000000\n')
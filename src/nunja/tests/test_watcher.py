@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os import makedirs
+from os import remove
+from os.path import dirname
+from os.path import join
+from time import sleep
+
+from calmjs.testing.mocks import StringIO
+from calmjs.utils import pretty_logging
+
+from nunja import watcher
+from nunja.engine import Engine
+from nunja.engine import JinjaEngine
+from nunja.testing import mocks
+from nunja.watcher import TemplateWatcher
+from nunja.watcher import inotify_available
+
+
+def process_until(inst, condition, rounds=20):
+    # events for a single action may arrive across multiple reads.
+    invalidated = set()
+    for i in range(rounds):
+        invalidated.update(inst.process_events(timeout=0.05))
+        if condition():
+            break
+    return invalidated
+
+
+class WatcherUnavailableTestCase(unittest.TestCase):
+
+    def test_unavailable(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_mold_templates_registry(self))
+        engine = Engine(registry)
+        self.addCleanup(setattr, watcher, 'libc', watcher.libc)
+        watcher.libc = None
+        self.assertFalse(inotify_available())
+        with pretty_logging('nunja', stream=StringIO()) as stream:
+            self.assertIsNone(engine.watch())
+        self.assertIn('inotify is unavailable', stream.getvalue())
+        # the loader still checks the templates.
+        self.assertTrue(engine.env.loader.auto_reload)
+
+
+@unittest.skipIf(not inotify_available(), 'inotify is unavailable')
+class TemplateWatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        (self.registry, self.main_template,
+            self.sub_template) = mocks.setup_tmp_mold_templates_registry(self)
+        self.engine = Engine(self.registry)
+        self.invalidated = []
+
+        def callback(mold_id):
+            self.invalidated.append(mold_id)
+            self.engine.invalidate(mold_id)
+
+        self.watcher = TemplateWatcher(
+            self.registry, callback, loader=self.engine.env.loader)
+        with pretty_logging('nunja', stream=StringIO()):
+            self.assertTrue(self.watcher.start(background=False))
+        self.addCleanup(self.watcher.stop)
+
+    def test_start_stop(self):
+        self.assertEqual(self.invalidated, [None])
+        self.assertFalse(self.engine.env.loader.auto_reload)
+        self.assertIn(
+            dirname(self.sub_template),
+            [path for path, prefix in self.watcher.directories.values()])
+        self.watcher.stop()
+        self.assertEqual(self.invalidated, [None, None])
+        self.assertTrue(self.engine.env.loader.auto_reload)
+
+    def test_modified(self):
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><span>Hello</span></div>')
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+
+        invalidated = process_until(
+            self.watcher, lambda: 'tmp/mold' in self.invalidated)
+        self.assertEqual(invalidated, {'tmp/mold'})
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><p>Hello</p></div>')
+
+    def test_mold_added_removed(self):
+        root = dirname(dirname(self.main_template))
+        target = join(root, 'added')
+        makedirs(target)
+        with open(join(target, 'template.nja'), 'w') as fd:
+            fd.write('<b>{{ data }}</b>')
+
+        process_until(
+            self.watcher, lambda: 'tmp/added' in self.registry.molds)
+        self.assertEqual(self.registry.molds['tmp/added'], target)
+        self.assertEqual(
+            self.engine.render('tmp/added', {'data': 'Hello'}), '<b>Hello</b>')
+
+        remove(join(target, 'template.nja'))
+        process_until(
+            self.watcher, lambda: 'tmp/added' not in self.registry.molds)
+        self.assertNotIn('tmp/added', self.registry.molds)
+
+    def test_background(self):
+        self.watcher.stop()
+        watched = self.engine.watch()
+        self.addCleanup(watched.stop)
+        self.assertIsNotNone(watched.thread)
+
+        self.engine.render('tmp/mold', {'data': 'Hello'})
+        with open(self.sub_template, 'w') as fd:
+            fd.write('<p>{{ data }}</p>')
+
+        for i in range(40):
+            if self.engine.render('tmp/mold', {'data': 'Hello'}) == (
+                    '<div><p>Hello</p></div>'):
+                break
+            sleep(0.05)
+        self.assertEqual(
+            self.engine.render('tmp/mold', {'data': 'Hello'}),
+            '<div><p>Hello</p></div>')
+
+
+@unittest.skipIf(not inotify_available(), 'inotify is unavailable')
+class JinjaTemplateWatcherTestCase(unittest.TestCase):
+
+    def test_added_modified(self):
+        registry, main_template, sub_template = (
+            mocks.setup_tmp_jinja_templates_registry(self))
+        engine = JinjaEngine(registry)
+        inst = TemplateWatcher(
+            registry, engine.invalidate, loader=engine.env.loader)
+        with pretty_logging('nunja', stream=StringIO()):
+            self.assertTrue(inst.start(background=False))
+        self.addCleanup(inst.stop)
+
+        added = join(dirname(sub_template), 'added.nja')
+        with open(added, 'w') as fd:
+            fd.write('<i>{{ data }}</i>')
+        process_until(
+            inst, lambda: 'templates/mold/added.nja' in registry.templates)
+        self.assertEqual(
+            engine.render_template(
+                'templates/mold/added.nja', {'data': 'Hello'}),
+            '<i>Hello</i>')
+
+        with open(added, 'w') as fd:
+            fd.write('<em>{{ data }}</em>')
+        invalidated = process_until(inst, lambda: False, rounds=5)
+        self.assertEqual(invalidated, {'templates/mold'})
+        self.assertEqual(
+            engine.render_template(
+                'templates/mold/added.nja', {'data': 'Hello'}),
+            '<em>Hello</em>')
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Watching of the template directories for modifications.
+
+By default, every template is checked for modifications by the loader
+through its mtime whenever it is used.  For development on Linux, the
+directories indexed by a registry may be watched through inotify, such
+that the loaded templates are invalidated as their files are modified
+and the loader will no longer need to check the files.  The registry is
+also updated as molds or templates are added or removed.
+
+Where inotify is unavailable, the watcher cannot be started, and the
+loader will continue to check the templates as it did.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from errno import EINTR
+from logging import getLogger
+from os.path import dirname
+from os.path import isdir
+from os.path import join
+from select import select
+from threading import Thread
+
+from nunja.analysis import name_to_mold_id
+from nunja.registry import JinjaTemplateRegistry
+from nunja.registry import MoldRegistry
+
+logger = getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+IN_ADDED = IN_CREATE | IN_MOVED_TO
+IN_REMOVED = IN_DELETE | IN_MOVED_FROM
+
+_event_header = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+libc = _load_libc()
+
+
+def inotify_available():
+    """
+    Return whether inotify is available.
+    """
+
+    return libc is not None
+
+
+class Inotify(object):
+    """
+    A minimal wrapper around an inotify instance.
+    """
+
+    def __init__(self):
+        if libc is None:
+            raise OSError('inotify is unavailable')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        Add a watch for the path, returning the watch descriptor.
+        """
+
+        wd = libc.inotify_add_watch(
+            self.fd, path.encode(sys.getfilesystemencoding()), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read(self, timeout=None):
+        """
+        Return the list of events as 4-tuples of the watch descriptor,
+        the mask, the cookie and the name, waiting for timeout seconds
+        for them if there are none.
+        """
+
+        try:
+            if not select([self.fd], [], [], timeout)[0]:
+                return []
+            data = os.read(self.fd, 65536)
+        except (IOError, OSError) as e:
+            if e.errno == EINTR:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((
+                wd, mask, cookie, name.decode(sys.getfilesystemencoding())))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class TemplateWatcher(object):
+    """
+    Watch the directories indexed by a MoldRegistry or a
+    JinjaTemplateRegistry through inotify, and invalidate the templates
+    that are modified through the callback.
+
+    The callback will be called with the mold_id for the templates that
+    were modified (or the prefix of the names for the templates in the
+    JinjaTemplateRegistry), or None once the watcher is stopped.
+
+    If the NunjaLoader used for the templates is provided as the loader,
+    it will no longer check the templates for modifications while the
+    watcher is running.
+    """
+
+    def __init__(self, registry, callback, loader=None):
+        self.registry = registry
+        self.callback = callback
+        self.loader = loader
+        self.inotify = None
+        self.thread = None
+        self.running = False
+        # the mapping of the watched directories to the prefix for the
+        # names of the templates within, and for the directories with
+        # the molds, to the prefix for the mold_ids.
+        self.directories = {}
+        self.roots = {}
+        self._watches = {}
+        self._auto_reload = None
+
+    def start(self, background=True):
+        """
+        Start watching, with the events processed in a background thread
+        unless background is False, in which case process_events must be
+        called.  Returns True if the watcher was started, or False if
+        inotify is unavailable.
+        """
+
+        if self.running:
+            return True
+
+        try:
+            self.inotify = Inotify()
+        except OSError as e:
+            logger.warning(
+                "cannot watch registry '%s' for modifications: %s",
+                self.registry.registry_name, e,
+            )
+            return False
+
+        for path, prefix in self._find_roots().items():
+            self._watch(path, prefix, root=True)
+        for path, prefix in self._find_directories().items():
+            self._watch(path, prefix)
+
+        if self.loader is not None:
+            self._auto_reload = self.loader.auto_reload
+            self.loader.auto_reload = False
+        # the templates loaded previously still check for modifications.
+        self.callback(None)
+
+        self.running = True
+        if background:
+            self.thread = Thread(target=self._run, name='nunja-watcher')
+            self.thread.daemon = True
+            self.thread.start()
+        logger.info(
+            "watching %d directories of registry '%s' for modifications",
+            len(self._watches), self.registry.registry_name,
+        )
+        return True
+
+    def stop(self):
+        """
+        Stop watching, and restore the loader to check the templates.
+        """
+
+        if not self.running:
+            return
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.inotify.close()
+        self.inotify = None
+        self.directories.clear()
+        self.roots.clear()
+        self._watches.clear()
+
+        if self.loader is not None:
+            self.loader.auto_reload = self._auto_reload
+        self.callback(None)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _find_roots(self):
+        roots = {}
+        if not isinstance(self.registry, MoldRegistry):
+            return roots
+        for mold_id, path in self.registry.molds.items():
+            roots[dirname(path)] = mold_id.split('/')[0]
+        for prefix, entry_point in self.registry.tracked_entry_points.items():
+            try:
+                roots[self.registry._entry_point_to_path(entry_point)] = prefix
+            except ImportError:
+                continue
+        return roots
+
+    def _find_directories(self):
+        directories = {}
+        for name in self.registry.iter_template_names():
+            path = self.registry.lookup_path(name, None)
+            if path:
+                directories[dirname(path)] = name.rsplit('/', 1)[0]
+        if isinstance(self.registry, MoldRegistry):
+            for mold_id, path in self.registry.molds.items():
+                directories[path] = mold_id
+        return directories
+
+    def _watch(self, path, prefix, root=False):
+        try:
+            wd = self._watches.get(path) or self.inotify.add_watch(path)
+        except OSError as e:
+            logger.warning("failed to watch directory '%s': %s", path, e)
+            return
+        self._watches[path] = wd
+        (self.roots if root else self.directories)[wd] = (path, prefix)
+
+    def _watch_tree(self, path, prefix):
+        self._watch(path, prefix)
+        for name in sorted(os.listdir(path)):
+            target = join(path, name)
+            if isdir(target):
+                self._watch_tree(target, prefix + '/' + name)
+
+    def _run(self):
+        while self.running:
+            try:
+                self.process_events(timeout=0.1)
+            except Exception:
+                logger.exception('failed to process the template events')
+
+    def process_events(self, timeout=0):
+        """
+        Process the pending events, waiting for timeout seconds for them
+        if there are none.  Returns the set of the mold_ids invalidated.
+        """
+
+        invalidated = set()
+        for wd, mask, cookie, name in self.inotify.read(timeout):
+            if mask & IN_IGNORED:
+                self._forget(wd)
+                continue
+            if not name:
+                continue
+            if wd in self.roots:
+                mold_id = self._root_event(wd, mask, name)
+            elif wd in self.directories:
+                mold_id = self._directory_event(wd, mask, name)
+            else:
+                continue
+            if mold_id is not None:
+                invalidated.add(mold_id)
+
+        for mold_id in sorted(invalidated):
+            logger.debug("invalidating '%s' as it was modified", mold_id)
+            self.callback(mold_id)
+        return invalidated
+
+    def _forget(self, wd):
+        path, prefix = self.roots.pop(wd, None) or self.directories.pop(
+            wd, (None, None))
+        self._watches.pop(path, None)
+
+    def _root_event(self, wd, mask, name):
+        root, prefix = self.roots[wd]
+        mold_id = prefix + '/' + name
+        path = join(root, name)
+        if mask & IN_ISDIR and mask & IN_ADDED and isdir(path):
+            self._watch_tree(path, mold_id)
+        if mask & (IN_ADDED | IN_REMOVED):
+            self.registry.update_mold(mold_id, path)
+        return mold_id
+
+    def _directory_event(self, wd, mask, name):
+        directory, prefix = self.directories[wd]
+        template_name = prefix + '/' + name
+        path = join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & IN_ADDED and isdir(path):
+                self._watch_tree(path, template_name)
+            return name_to_mold_id(template_name)
+
+        if not name.endswith(self.registry.fext):
+            return None
+
+        if mask & (IN_ADDED | IN_REMOVED):
+            if isinstance(self.registry, JinjaTemplateRegistry):
+                self.registry.update_template(template_name, path)
+            elif (isinstance(self.registry, MoldRegistry) and
+                    name == self.registry.req_tmpl_name and
+                    template_name.count('/') == 2):
+                self.registry.update_mold(prefix, directory)
+        return name_to_mold_id(template_name)
+
+
+def watch(registry, callback, loader=None):
+    """
+    Start and return a TemplateWatcher, or None if it cannot be started.
+    """
+
+    watcher = TemplateWatcher(registry, callback, loader=loader)
+    if not watcher.start():
+        return None
+    return watcher